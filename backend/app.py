@@ -1,14 +1,33 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
-import requests
 import logging
 from dotenv import load_dotenv
 import os
-import psycopg2
-import pymongo
-import mysql.connector
-import sqlite3
-import decimal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from db_pool import PoolTimeoutError, start_idle_reaper
+from drivers import DRIVERS, get_driver, reconnect_errors
+from result_handles import ResultHandleStore, RESULT_PAGE_SIZE
+from translation_cache import TranslationCache
+from result_encoding import EncodingError, ARROW_MIMETYPE, negotiate_format, encode_arrow, maybe_gzip, \
+    convert_rows, convert_column, to_columns
+from result_cache import ResultCache
+from result_export import ResultExport
+from query_guard import QueryBlockedError, guard_query
+from mongo_query import MongoQueryError
+from session_registry import SessionRegistry, SessionStore
+from health_monitor import HealthMonitor
+from query_jobs import QueryJobManager, JobLimitError, JOB_GUARD_MODE
+from schema_catalog import SchemaCatalog, is_ddl, start_schema_refresher
+from few_shot import FewShotSelector, SYSTEM_PROMPT, estimate_tokens
+from schema_index import SchemaIndex
+from rule_engine import RuleEngine, RULE_ENGINE_MODE, RULE_CANDIDATE_TABLES
+from visualization import VisualizationError, VIZ_GUARD_MODE
+from query_history import QueryHistory
+from sql_validator import SQL_VALIDATION_MODE, validate_query, repair_prompt
+from metrics import REGISTRY, LLM_TOKENS, ROWS_RETURNED, TRANSLATIONS, instrument, stage, record_stage
+from profiler import SamplingProfiler, PROFILE_SLOW_REQUEST_MS
+from llm_client import LLMClient, LLMError, CircuitOpenError
 
 # Load environment variables
 load_dotenv()
@@ -16,139 +35,258 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Allow CORS for all routes
 
+# Request IDs and per-stage timings on every request; stack sampling only when PROFILE_SLOW_REQUEST_MS is set
+profiler = SamplingProfiler().start() if PROFILE_SLOW_REQUEST_MS > 0 else None
+instrument(app, profiler)
+
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GPT_MODEL = 'gpt-4'
+CHAT_BATCH_CONCURRENCY = int(os.getenv('CHAT_BATCH_CONCURRENCY', '8'))
+CHAT_BATCH_MAX_SIZE = int(os.getenv('CHAT_BATCH_MAX_SIZE', '500'))
+# Lets requests without a session token use the latest connection; only safe when one person uses the server
+SINGLE_USER_MODE = os.getenv('SINGLE_USER_MODE', 'off')  # on or off
+
+# Shared keep-alive client with timeouts, retries and a circuit breaker
+llm_client = LLMClient(OPENAI_API_KEY)
 
 logging.basicConfig(level=logging.INFO)
 
-# Global dictionary to hold connections
-connections = {}
+# Connection pool and schema catalog per session token, for the sessions rehydrated in this worker
+pools = {}
+start_idle_reaper(pools)
+catalogs = {}
+start_schema_refresher(catalogs)
+
+# Pings every pool in the background and replaces dead connections, so requests do not find them first
+health_monitor = HealthMonitor(pools)
+health_monitor.start()
+
+# Open result cursors that clients page through with /api/execute_query/page
+result_handles = ResultHandleStore()
+result_handles.start_reaper()
+
+# Small SELECT results keyed on connection and normalized SQL, invalidated by writes to their tables
+result_cache = ResultCache()
+
+# Generated queries keyed on the normalized message, database type and schema fingerprint
+translation_cache = TranslationCache()
+
+# Append-only record of translated and executed queries, written off the request thread
+query_history = QueryHistory()
+query_history.start()
+
+# Index over the few-shot examples, built once so each request only sends the most similar ones
+few_shot_selector = FewShotSelector()
+
+# Template-based translation of simple questions, tried before the translation cache and the LLM
+rule_engine = RuleEngine()
+
+# Per-connection BM25 index over tables and columns, keyed by pool id, for the schema part of the prompt
+schema_indexes = {}
+
+# Latest session per database type in this worker, for clients without a session token in single-user mode
+default_sessions = {}
+
+def schema_changed(pool, query):
+    """Have the catalogs of every session on pool's database re-read the schema after a DDL statement has run;
+    marking them any earlier lets the refresher read the old schema while the statement is still executing."""
+    if not is_ddl(query):
+        return
+    for token, session_pool in list(pools.items()):
+        if session_pool.database_id == pool.database_id and token in catalogs:
+            catalogs[token].mark_stale()
+
+def job_finished(job):
+    """Apply the same cache and schema bookkeeping to a finished job as execute_query does inline."""
+    if get_driver(job.db_type).writes(job.query):
+        result_cache.invalidate_for_statement(job.pool.database_id, job.query)
+    schema_changed(job.pool, job.query)
+    query_history.record_execution(job.db_type, job.query, exec_ms=(job.finished_at - job.started_at) * 1000,
+                                   rows=job.row_count,
+                                   bytes_returned=job.export.bytes_written() if job.export is not None else None)
+
+# Long-running queries submitted through /api/jobs, run off the request thread. Jobs are held in this
+# process only, unlike sessions, so job ids are not visible to other workers
+query_jobs = QueryJobManager(on_finish=job_finished)
+
+@REGISTRY.collector
+def component_metrics():
+    """Expose the counters the caches and pools already keep, summed over this worker's pools per engine."""
+    translation = translation_cache.stats()
+    results = result_cache.stats()
+    history = query_history.stats()
+    health_counts = {}
+    for health in health_monitor.snapshot():
+        key = (health['db_type'], health['state'])
+        health_counts[key] = health_counts.get(key, 0) + 1
+    pool_totals = {}
+    for pool in list(pools.values()):
+        stats = pool.stats()
+        totals = pool_totals.setdefault(stats['name'], {'in_use': 0, 'idle': 0, 'checkouts': 0, 'timeouts': 0})
+        for key in totals:
+            totals[key] += stats.get(key, 0)
+    return [
+        ('dbchat_translation_cache_lookups_total', 'counter', 'Translation cache lookups by outcome', [
+            ({'result': 'memory_hit'}, translation['memory_hits']),
+            ({'result': 'disk_hit'}, translation['disk_hits']),
+            ({'result': 'miss'}, translation['misses'])]),
+        ('dbchat_result_cache_lookups_total', 'counter', 'Result cache lookups by outcome', [
+            ({'result': 'hit'}, results['hits']),
+            ({'result': 'miss'}, results['misses'])]),
+        ('dbchat_result_cache_bytes', 'gauge', 'Bytes held by the result cache', [({}, results['bytes'])]),
+        ('dbchat_pool_connections', 'gauge', 'Pooled connections by state', [
+            ({'db_type': name, 'state': state}, totals[state])
+            for name, totals in sorted(pool_totals.items()) for state in ('in_use', 'idle')]),
+        ('dbchat_pool_checkouts_total', 'counter', 'Connection checkouts', [
+            ({'db_type': name}, totals['checkouts']) for name, totals in sorted(pool_totals.items())]),
+        ('dbchat_pool_timeouts_total', 'counter', 'Checkouts that timed out waiting for a connection', [
+            ({'db_type': name}, totals['timeouts']) for name, totals in sorted(pool_totals.items())]),
+        ('dbchat_open_result_handles', 'gauge', 'Result cursors parked for paging', [({}, len(result_handles))]),
+        ('dbchat_query_jobs', 'gauge', 'Asynchronous query jobs by state', [
+            ({'state': state}, count) for state, count in sorted(query_jobs.stats().items()) if state != 'jobs']),
+        ('dbchat_query_history_entries_total', 'counter', 'Query history entries by outcome', [
+            ({'result': result}, history[result]) for result in ('written', 'dropped', 'write_errors')]),
+        ('dbchat_connections_by_health', 'gauge', 'Connection pools by health state', [
+            ({'db_type': db_type, 'state': state}, count) for (db_type, state), count in sorted(health_counts.items())]),
+    ]
 
 def normalize_db_type(db_type):
     return db_type.lower() if db_type else None
 
-def reconnect_mysql():
-    conn_info = {
-        'host': os.getenv('MYSQL_HOST'),
-        'port': os.getenv('MYSQL_PORT'),
-        'user': os.getenv('MYSQL_USER'),
-        'password': os.getenv('MYSQL_PASSWORD'),
-        'database': os.getenv('MYSQL_DATABASE')
-    }
+def session_token():
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    return request.headers.get('X-Session-Token') or request.args.get('session') or (data or {}).get('session')
+
+def get_session(db_type):
+    """Resolve the caller's session; in single-user mode requests without a token use the latest one for db_type."""
+    token = session_token()
+    if not token and SINGLE_USER_MODE == 'on':
+        token = default_sessions.get(db_type)
+    if not token:
+        return None
     try:
-        conn = mysql.connector.connect(**conn_info)
-        connections['mysql'] = conn
-        logging.info("Reconnected to MySQL.")
+        session = sessions.get(token)
     except Exception as e:
-        logging.error(f"Error reconnecting to MySQL: {e}")
+        logging.error(f"Error rehydrating session: {e}")
+        return None
+    if session is None or (db_type and session.db_type != db_type):
+        return None
+    return session
+
+def no_session_response():
+    if not session_token() and SINGLE_USER_MODE != 'on':
+        return jsonify({'error': 'A session token is required'}), 401
+    return jsonify({'error': 'No connection found for the given database type'}), 400
+
+def attach_session(session):
+    pools[session.token] = session.pool
+    catalogs[session.token] = SchemaCatalog(session.pool, session.db_type)
+    schema_indexes[session.pool.id] = SchemaIndex(catalogs[session.token])
+
+def detach_session(session):
+    pools.pop(session.token, None)
+    catalogs.pop(session.token, None)
+    schema_indexes.pop(session.pool.id, None)
+    if session.pool.database_id == session.pool.id:
+        # Entries for a shared database stay useful to the other sessions on it; a private one is gone for good
+        result_cache.invalidate_database(session.pool.id)
+    result_handles.close_for_pool(session.pool)
+    query_jobs.cancel_for_pool(session.pool)
+    if default_sessions.get(session.db_type) == session.token:
+        del default_sessions[session.db_type]
 
 def execute_query_and_reconnect_if_needed(db_type, query_func):
     try:
         return query_func()
-    except (psycopg2.OperationalError, pymongo.errors.ServerSelectionTimeoutError, mysql.connector.Error) as e:
+    except PoolTimeoutError as e:
+        logging.error(f"Connection pool exhausted for {db_type}: {e}")
+        return jsonify({"error": str(e)}), 503
+    except reconnect_errors() as e:
+        # The broken connection has been discarded by the pool, so the retry gets a fresh one
         logging.warning(f"Reconnection needed for {db_type}: {e}")
-        if db_type == 'mysql':
-            reconnect_mysql()
         return query_func()
 
-@app.route('/connect/postgresql', methods=['POST'])
-def connect_postgresql():
-    data = request.json
-    try:
-        conn = psycopg2.connect(
-            host=data['host'],
-            port=data['port'],
-            user=data['user'],
-            password=data['password'],
-            database=data['database']
-        )
-        connections['postgresql'] = conn
-        logging.info("PostgreSQL connection established and stored.")
-        return jsonify({"message": "Successfully connected to PostgreSQL"}), 200
-    except Exception as e:
-        logging.error(f"Error connecting to PostgreSQL: {e}")
-        return jsonify({"error": str(e)}), 500
+def open_pool(db_type, params):
+    """Build the connection pool for a connection descriptor; this is also how other workers rehydrate it."""
+    driver = get_driver(db_type)
+    pool = driver.open_pool(params)
+    # Every session has its own pool, but sessions on one database must see each other's writes in the result cache
+    pool.database_id = driver.database_id(params) or pool.id
+    pool.user = params.get('user')
+    return pool
 
-@app.route('/connect/mongodb', methods=['POST'])
-def connect_mongodb():
-    data = request.json
-    try:
-        client = pymongo.MongoClient(f"mongodb://{data['user']}:{data['password']}@{data['host']}:{data['port']}/{data['database']}")
-        client.server_info()  # Trigger a server info request to test the connection
-        connections['mongodb'] = client
-        logging.info("MongoDB connection established and stored.")
-        return jsonify({"message": "Successfully connected to MongoDB"}), 200
-    except Exception as e:
-        logging.error(f"Error connecting to MongoDB: {e}")
-        return jsonify({"error": str(e)}), 500
+# Descriptors live in a SQLite file shared by all workers; pools are built lazily per worker
+sessions = SessionRegistry(SessionStore(), open_pool, on_open=attach_session, on_close=detach_session)
+sessions.start_reaper()
 
-@app.route('/connect/mysql', methods=['POST'])
-def connect_mysql():
-    data = request.json
+def connect_session(db_type, label, params):
     try:
-        conn = mysql.connector.connect(
-            host=data['host'],
-            port=data['port'],
-            user=data['user'],
-            password=data['password'],
-            database=data['database']
-        )
-        connections['mysql'] = conn
-        logging.info("MySQL connection established and stored.")
-        return jsonify({"message": "Successfully connected to MySQL"}), 200
+        pool = open_pool(db_type, params)
+        session = sessions.connect(db_type, params, pool)
+        default_sessions[db_type] = session.token
+        logging.info(f"{label} connection pool established and stored.")
+        return jsonify({"message": f"Successfully connected to {label}", "session": session.token}), 200
     except Exception as e:
-        logging.error(f"Error connecting to MySQL: {e}")
+        logging.error(f"Error connecting to {label}: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/connect/sqlite', methods=['POST'])
-def connect_sqlite():
-    data = request.json
+@app.route('/connect/<db_type>', methods=['POST'])
+def connect(db_type):
     try:
-        conn = sqlite3.connect(data['database'])
-        connections['sqlite'] = conn
-        logging.info("SQLite connection established and stored.")
-        return jsonify({"message": "Successfully connected to SQLite"}), 200
-    except Exception as e:
-        logging.error(f"Error connecting to SQLite: {e}")
-        return jsonify({"error": str(e)}), 500
+        driver = get_driver(normalize_db_type(db_type))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    try:
+        params = driver.params(request.json)
+    except KeyError as e:
+        return jsonify({"error": f"Missing connection parameter: {e.args[0]}"}), 400
+    return connect_session(driver.name, driver.label, params)
+
+@app.route('/api/drivers', methods=['GET'])
+def list_drivers():
+    return jsonify({'drivers': [driver.to_dict() for driver in DRIVERS.values()]}), 200
+
+@app.route('/disconnect', methods=['POST'])
+def disconnect():
+    token = session_token()
+    if not token or not sessions.disconnect(token):
+        return jsonify({"error": "Session not found or expired"}), 404
+    return jsonify({"message": "Disconnected"}), 200
+
+@app.route('/api/session/stats', methods=['GET'])
+def session_stats():
+    return jsonify({"sessions": sessions.stats()}), 200
+
+@app.route('/api/pool/stats', methods=['GET'])
+def pool_stats():
+    return jsonify({"pools": {pool.id: pool.stats() for pool in list(pools.values())}}), 200
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    session = get_session(normalize_db_type(request.args.get('db')))
+    connections = health_monitor.snapshot()
+    payload = {
+        'status': 'degraded' if any(c['state'] == 'down' for c in connections) else 'ok',
+        'connections': connections,
+    }
+    if session is not None:
+        payload['session'] = health_monitor.status(session.pool)
+    return jsonify(payload), 200
 
 @app.route('/api/tables', methods=['GET'])
 def get_tables():
     db_type = normalize_db_type(request.args.get('db'))
     logging.info(f"Request for tables with db_type: {db_type}")
-    logging.info(f"Current connections: {connections}")
+    logging.info(f"Current sessions in this worker: {len(pools)}")
 
-    if not db_type or db_type not in connections or connections[db_type] is None:
+    session = get_session(db_type)
+    catalog = catalogs.get(session.token) if session else None
+    if catalog is None:
         logging.error("No connection found for the given database type")
-        return jsonify({"error": "No connection found for the given database type"}), 400
+        return no_session_response()
 
     def query_func():
-        if db_type == 'mysql':
-            conn = connections['mysql']
-            cur = conn.cursor()
-            cur.execute('SHOW TABLES')
-            tables = cur.fetchall()
-            table_names = [table[0] for table in tables]
-            return jsonify({"tables": table_names}), 200
-        elif db_type == 'postgresql':
-            conn = connections['postgresql']
-            cur = conn.cursor()
-            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public'")
-            tables = cur.fetchall()
-            table_names = [table[0] for table in tables]
-            return jsonify({"tables": table_names}), 200
-        elif db_type == 'sqlite':
-            conn = connections['sqlite']
-            cur = conn.cursor()
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = cur.fetchall()
-            table_names = [table[0] for table in tables]
-            return jsonify({"tables": table_names}), 200
-        elif db_type == 'mongodb':
-            client = connections['mongodb']
-            db = client.get_database()
-            collections = db.list_collection_names()
-            return jsonify({"tables": collections}), 200
+        return jsonify({"tables": catalog.table_names()}), 200
 
     return execute_query_and_reconnect_if_needed(db_type, query_func)
 
@@ -156,353 +294,40 @@ def get_tables():
 def dbinfo():
     db_type = normalize_db_type(request.args.get('db'))
     logging.info(f"Request for DB info with db_type: {db_type}")
-    logging.info(f"Current connections: {connections}")
+    logging.info(f"Current sessions in this worker: {len(pools)}")
 
-    if not db_type or db_type not in connections or connections[db_type] is None:
+    session = get_session(db_type)
+    catalog = catalogs.get(session.token) if session else None
+    if catalog is None:
         logging.error("No connection found for the given database type")
-        return jsonify({"error": "No connection found for the given database type"}), 400
+        return no_session_response()
 
     def query_func():
-        if db_type == 'postgresql':
-            conn = connections['postgresql']
-            cur = conn.cursor()
-            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public'")
-            tables = cur.fetchall()
-            return jsonify({"info": {"tables": [table[0] for table in tables]}}), 200
-        elif db_type == 'mysql':
-            conn = connections['mysql']
-            cur = conn.cursor()
-            cur.execute("SHOW TABLES")
-            tables = cur.fetchall()
-            return jsonify({"info": {"tables": [table[0] for table in tables]}}), 200
-        elif db_type == 'sqlite':
-            conn = connections['sqlite']
-            cur = conn.cursor()
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = cur.fetchall()
-            return jsonify({"info": {"tables": [table[0] for table in tables]}}), 200
-        elif db_type == 'mongodb':
-            client = connections['mongodb']
-            db = client.get_database()
-            collections = db.list_collection_names()
-            return jsonify({"info": {"tables": collections}}), 200
+        schema = catalog.to_dict()
+        return jsonify({"info": {
+            "tables": catalog.table_names(),
+            "schema": schema['tables'],
+            "checksum": schema['checksum'],
+            "version": schema['version']
+        }}), 200
 
     return execute_query_and_reconnect_if_needed(db_type, query_func)
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    data = request.json
-    message = data.get('message')
-    db_type = normalize_db_type(data.get('db_type'))
-
-    if not message or not db_type:
-        return jsonify({'error': 'No message or database type provided'}), 400
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
 
-    if db_type not in connections or connections[db_type] is None:
-        return jsonify({'error': 'No connection found for the given database type'}), 400
-    
-    few_shot_examples = [
-    {
-        "role": "system",
-        "content": "You are a helpful assistant that generates SQL queries based on user input."
-    },
-    {
-        "role": "user",
-        "content": "Show all students who are 15 years old."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT name FROM students WHERE age = 15;"
-    },
-    {
-        "role": "user",
-        "content": "Show the names of students enrolled in English."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name FROM students JOIN enrollments ON students.student_id = enrollments.student_id JOIN courses ON enrollments.course_id = courses.course_id WHERE courses.course_name = 'English Literature';"
-    },
-    {
-        "role": "user",
-        "content": "List the names and grades of students who are in grade 12."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT name, grade FROM students WHERE grade = 12;"
-    },
-    {
-        "role": "user",
-        "content": "Count the number of students in each grade."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT grade, COUNT(*) FROM students GROUP BY grade;"
-    },
-    {
-        "role": "user",
-        "content": "List students who scored above 90 in Science."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE exam_results.subject = 'Biology' AND exam_results.score > 90;"
-    },
-    {
-        "role": "user",
-        "content": "Show the names of students who took exams after 2023-01-01."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE exam_results.exam_date > '2023-01-01';"
-    },
-    {
-        "role": "user",
-        "content": "List students who are in grade 11 and scored below 50 in Mathematics."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE students.grade = 11 AND exam_results.subject = 'Algebra I' AND exam_results.score < 50;"
-    },
-    {
-        "role": "user",
-        "content": "Show names of students who are in grade 10 and have taken both Science and English."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name FROM students JOIN enrollments e1 ON students.student_id = e1.student_id JOIN courses c1 ON e1.course_id = c1.course_id JOIN enrollments e2 ON students.student_id = e2.student_id JOIN courses c2 ON e2.course_id = c2.course_id WHERE students.grade = 10 AND c1.course_name = 'Biology' AND c2.course_name = 'English Literature';"
-    },
-    {
-        "role": "user",
-        "content": "List the names of students who have never scored below 60 in any exam."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT name FROM students WHERE student_id NOT IN (SELECT student_id FROM exam_results WHERE score < 60);"
-    },
-    {
-        "role": "user",
-        "content": "Show the average score of each student in Mathematics."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name, AVG(exam_results.score) AS average_score FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE exam_results.subject = 'Algebra I' GROUP BY students.name;"
-    },
-    {
-        "role": "user",
-        "content": "Create a new table named 'teachers' with columns 'teacher_id', 'name', and 'subject'."
-    },
-    {
-        "role": "assistant",
-        "content": "CREATE TABLE teachers (teacher_id INT PRIMARY KEY, name VARCHAR(100), subject VARCHAR(100));"
-    },
-    {
-        "role": "user",
-        "content": "Add a new column 'email' to the 'students' table."
-    },
-    {
-        "role": "assistant",
-        "content": "ALTER TABLE students ADD COLUMN email VARCHAR(100);"
-    },
-    {
-        "role": "user",
-        "content": "Delete all records of students who scored below 40 in any exam."
-    },
-    {
-        "role": "assistant",
-        "content": "DELETE FROM students WHERE student_id IN (SELECT student_id FROM exam_results WHERE score < 40);"
-    },
-    {
-        "role": "user",
-        "content": "List the names of teachers who teach more than one subject."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT teachers.name FROM teachers JOIN courses ON teachers.teacher_id = courses.teacher_id GROUP BY teachers.name HAVING COUNT(DISTINCT courses.course_name) > 1;"
-    },
-    {
-        "role": "user",
-        "content": "Retrieve the names of all students and their corresponding courses."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name AS student_name, courses.course_name FROM students JOIN enrollments ON students.student_id = enrollments.student_id JOIN courses ON enrollments.course_id = courses.course_id;"
-    },
-    {
-        "role": "user",
-        "content": "Show the names of students and the names of their teachers."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name AS student_name, teachers.name AS teacher_name FROM students JOIN enrollments ON students.student_id = enrollments.student_id JOIN courses ON enrollments.course_id = courses.course_id JOIN teachers ON courses.teacher_id = teachers.teacher_id;"
-    },
-    {
-        "role": "user",
-        "content": "Update the grade level of students who scored above 95 in all exams to the next grade."
-    },
-    {
-        "role": "assistant",
-        "content": "UPDATE students SET grade = grade + 1 WHERE student_id IN (SELECT student_id FROM exam_results GROUP BY student_id HAVING MIN(score) > 95);"
-    },
-    {
-        "role": "user",
-        "content": "Show the names of students along with their total exam scores."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name, SUM(exam_results.score) AS total_score FROM students JOIN exam_results ON students.student_id = exam_results.student_id GROUP BY students.name;"
-    },
-    {
-        "role": "user",
-        "content": "Find the average score for each subject."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT exam_results.subject, AVG(exam_results.score) AS average_score FROM exam_results GROUP BY exam_results.subject;"
-    },
-    {
-        "role": "user",
-        "content": "Find the average score for each student in the exam results."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name AS student_name, AVG(exam_results.score) AS average_score FROM students JOIN exam_results ON students.student_id = exam_results.student_id GROUP BY students.name;"
-    },
-    {
-        "role": "user",
-        "content": "List the names and departments of all teachers who teach courses that have enrollments."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT DISTINCT teachers.name AS teacher_name, teachers.department FROM teachers JOIN courses ON teachers.teacher_id = courses.teacher_id JOIN enrollments ON courses.course_id = enrollments.course_id;"
-    },
-    {
-        "role": "user",
-        "content": "Get the names of all students who have taken an exam in 'Algebra I'."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name FROM students JOIN exam_results ON students.student_id = exam_results.student_id JOIN courses ON exam_results.subject = courses.course_name WHERE courses.course_name = 'Algebra I';"
-    },
-    {
-        "role": "user",
-        "content": "List all courses along with the names of the teachers who teach them."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT courses.course_name, teachers.name AS teacher_name FROM courses JOIN teachers ON courses.teacher_id = teachers.teacher_id;"
-    },
-    {
-        "role": "user",
-        "content": "Find the highest score achieved in each subject."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT subject, MAX(score) AS highest_score FROM exam_results GROUP BY subject;"
-    },
-    {
-        "role": "user",
-        "content": "Retrieve the contact details (email and phone) of teachers who teach 'Science' department courses."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT teachers.name, teachers.email, teachers.phone FROM teachers WHERE teachers.department = 'Science';"
-    },
-    {
-        "role": "user",
-        "content": "Get the names of students and their grades who scored above 90 in any exam."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT students.name, students.grade FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE exam_results.score > 90;"
-    },
-    {
-        "role": "user",
-        "content": "List all students along with their family IDs."
-    },
-    {
-        "role": "assistant",
-        "content": "SELECT name, family_id FROM students;"
-    },
-    {
-        "role": "user",
-        "content": "Retrieve the names and scores of students who scored the highest in each subject."
-    },
-    {
-        "role": "assistant",
-        "content": "WITH max_scores AS (SELECT subject, MAX(score) AS highest_score FROM exam_results GROUP BY subject) SELECT students.name, exam_results.subject, exam_results.score FROM exam_results JOIN students ON exam_results.student_id = students.student_id JOIN max_scores ON exam_results.subject = max_scores.subject AND exam_results.score = max_scores.highest_score;"
-    },
-     {
-        "role": "user",
-        "content": "Design a table for student feedback with feedback_id, student_id, course_id, feedback_text, and feedback_date."
-    },
-    {
-        "role": "assistant",
-        "content": "CREATE TABLE student_feedback ( feedback_id INT PRIMARY KEY,  student_id INT NOT NULL,course_id INT NOT NULL,  feedback_text TEXT NOT NULL, feedback_date DATE NOT NULL, FOREIGN KEY (student_id) REFERENCES students(student_id), FOREIGN KEY (course_id) REFERENCES courses(course_id) );"
-    },
-    {
-        "role": "user",
-        "content": "Create a table to keep track of teacher schedules with schedule_id, teacher_id, course_id, day_of_week, and time_slot."
-    },
-    {
-        "role": "assistant",
-        "content": "CREATE TABLE teacher_schedules (schedule_id INT PRIMARY KEY,teacher_id INT NOT NULL,course_id INT NOT NULL,day_of_week VARCHAR(20) NOT NULL,time_slot VARCHAR(20) NOT NULL,FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id),FOREIGN KEY (course_id) REFERENCES courses(course_id));"
-    },
-    {
-        "role": "user",
-        "content": "Create a table to log student library usage with usage_id, student_id, book_id, borrow_date, and return_date."
-    },
-    {
-        "role": "assistant",
-        "content": "CREATE TABLE library_usage (usage_id INT PRIMARY KEY,student_id INT NOT NULL,book_id INT NOT NULL,borrow_date DATE NOT NULL,return_date DATE,FOREIGN KEY (student_id) REFERENCES students(student_id),FOREIGN KEY (book_id) REFERENCES library_books(book_id));"
-    },
-    {
-        "role": "user",
-        "content": "Design a table for storing information about school facilities with facility_id, facility_name, location, and capacity."
-    },
-    {
-        "role": "assistant",
-        "content": "CREATE TABLE school_facilities (facility_id INT PRIMARY KEY,facility_name VARCHAR(100) NOT NULL, location VARCHAR(100) NOT NULL, capacity INT NOT NULL);"
-    },
-    {
-        "role": "user",
-        "content": "Design a table for storing sports team information with team_id, team_name, coach_name, and sport."
-    },
-    {
-        "role": "assistant",
-        "content": "CREATE TABLE sports_teams (team_id INT PRIMARY KEY,team_name VARCHAR(100) NOT NULL,coach_name VARCHAR(100) NOT NULL,sport VARCHAR(50) NOT NULL);"
+def completion_payload(messages):
+    return {
+        'model': GPT_MODEL,
+        'messages': messages,
+        'max_tokens': 200,
+        'temperature': 0.7,
+        'top_p': 0.9,
+        'frequency_penalty': 0,
+        'presence_penalty': 0.6
     }
-]
-
-    user_message = {"role": "user", "content": message}
-    messages = few_shot_examples + [user_message]
-
-    try:
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {OPENAI_API_KEY}'
-            },
-            json={
-                'model': GPT_MODEL,
-                'messages': messages,
-                'max_tokens': 200,
-                'temperature': 0.7,
-                'top_p': 0.9,
-                'frequency_penalty': 0,
-                'presence_penalty': 0.6
-            }
-        )
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        logging.error(f'Error communicating with OpenAI: {e}')
-        return jsonify({'error': 'Failed to communicate with OpenAI'}), 500
-
-    response_data = response.json()
-    bot_message = response_data['choices'][0]['message']['content'].strip()
-
-    # Extract SQL query from the response
-    logging.info(f"Received response: {bot_message}")
 
+def extract_query(bot_message):
     # We assume the first code block in the response is the SQL query
     try:
         query_start = bot_message.index("```") + 3
@@ -514,84 +339,729 @@ def chat():
     
     if query.lower().startswith("sql"):
         query = query[3:].strip()
+    return query
+
+def get_loaded_catalog(db_type):
+    """Return (catalog, None) for a connected database, or (None, error response)."""
+    session = get_session(db_type)
+    catalog = catalogs.get(session.token) if session else None
+    if catalog is None:
+        return None, no_session_response()
+
+    try:
+        catalog.ensure_loaded()
+    except Exception as e:
+        logging.error(f"Error loading {db_type} schema catalog: {e}")
+        return None, (jsonify({'error': str(e)}), 500)
+    return catalog, None
+
+def prepare_chat(data):
+    """Validate a chat request; returns (context, None) or (None, error response)."""
+    message = data.get('message')
+    db_type = normalize_db_type(data.get('db_type'))
+
+    if not message or not db_type:
+        return None, (jsonify({'error': 'No message or database type provided'}), 400)
+
+    catalog, error = get_loaded_catalog(db_type)
+    if error:
+        return None, error
+
+    return {
+        'message': message,
+        'db_type': db_type,
+        'catalog': catalog,
+        'cache_key': translation_cache.make_key(message, db_type, catalog.checksum)
+    }, None
+
+def build_messages(message, catalog):
+    """Few-shot messages whose system prompt summarizes the tables relevant to the question."""
+    schema_index = schema_indexes.get(catalog.pool.id)
+    if schema_index is None:
+        return few_shot_selector.build_messages(message)
+    with stage('schema'):
+        schema = schema_index.summarize(message)
+    messages, prompt_stats = few_shot_selector.build_messages(message, f"{SYSTEM_PROMPT}\n\n{schema['text']}")
+    prompt_stats.update(schema_tables=schema['tables'], schema_tokens=schema['tokens'])
+    return messages, prompt_stats
+
+def check_query(query, catalog, messages, bot_message):
+    """Validate a generated query against the cached schema; on failure ask the LLM once for a fix.
+
+    Returns (query, validation report or None when validation is off).
+    """
+    if SQL_VALIDATION_MODE == 'off' or not query:
+        return query, None
+    with stage('validate'):
+        errors = validate_query(query, catalog.db_type, catalog.tables)
+    validation = {'valid': not errors, 'errors': errors, 'repaired': False}
+    if not errors or SQL_VALIDATION_MODE != 'repair':
+        return query, validation
+
+    logging.warning(f"Generated query failed validation: {errors}")
+    repair_messages = messages + [
+        {'role': 'assistant', 'content': bot_message},
+        {'role': 'user', 'content': repair_prompt(query, errors, catalog.db_type, catalog.tables)},
+    ]
+    try:
+        with stage('repair'):
+            response_data = llm_client.chat_completion(completion_payload(repair_messages))
+    except LLMError as e:
+        logging.error(f"Query repair request failed: {e}")
+        return query, validation
+    repair_message = response_data['choices'][0]['message']['content'].strip()
+    LLM_TOKENS.inc(estimate_tokens(repair_messages[-1]['content']), kind='prompt')
+    LLM_TOKENS.inc(response_data.get('usage', {}).get('completion_tokens') or estimate_tokens(repair_message),
+                   kind='completion')
+    repaired = extract_query(repair_message)
+    if not repaired:
+        return query, validation
+
+    with stage('validate'):
+        remaining = validate_query(repaired, catalog.db_type, catalog.tables)
+    logging.info(f"Repaired query: {repaired}")
+    return repaired, {'valid': not remaining, 'errors': remaining, 'repaired': True, 'original_errors': errors}
+
+def match_rules(message, catalog):
+    """Answer simple question shapes from the schema alone; None means the LLM path should handle it."""
+    if RULE_ENGINE_MODE != 'on':
+        return None
+    schema_index = schema_indexes.get(catalog.pool.id)
+    with stage('rules'):
+        if schema_index is None:
+            rule = rule_engine.match(message, catalog.db_type, catalog.tables)
+        else:
+            rule = rule_engine.match(message, catalog.db_type, catalog.tables, schema_index.links(),
+                                     schema_index.rank(message, RULE_CANDIDATE_TABLES))
+    if rule is not None:
+        TRANSLATIONS.inc(path='rules')
+        logging.info(f"Rule engine answered with the {rule['template']} template: {rule['query']}")
+    return rule
+
+def generate_query(message, cache_key, catalog):
+    """Translate one message into a query via the rule engine, the translation cache or the LLM.
+
+    Raises LLMError. The result's 'path' says which of the three answered; its 'history_id' identifies the
+    translation in the query history, for /api/execute_query to link its run to.
+    """
+    rule = match_rules(message, catalog)
+    if rule is not None:
+        return {'query': rule['query'], 'cached': False, 'path': 'rules', 'rule': rule,
+                'history_id': query_history.record_translation(message, catalog.db_type, rule['query'], 'rules')}
+
+    with stage('translation_cache'):
+        cached_query = translation_cache.get(cache_key)
+    if cached_query is not None:
+        logging.info(f"Translation cache hit: {cached_query}")
+        TRANSLATIONS.inc(path='cache')
+        return {'query': cached_query, 'cached': True, 'path': 'cache',
+                'history_id': query_history.record_translation(message, catalog.db_type, cached_query, 'cache')}
+
+    with stage('prompt'):
+        messages, prompt_stats = build_messages(message, catalog)
+    llm_started = time.perf_counter()
+    with stage('llm'):
+        response_data = llm_client.chat_completion(completion_payload(messages))
+    bot_message = response_data['choices'][0]['message']['content'].strip()
+    LLM_TOKENS.inc(prompt_stats['prompt_tokens'], kind='prompt')
+    LLM_TOKENS.inc(response_data.get('usage', {}).get('completion_tokens') or estimate_tokens(bot_message),
+                   kind='completion')
+
+    # Extract SQL query from the response
+    logging.info(f"Received response: {bot_message}")
+    with stage('extract'):
+        query = extract_query(bot_message)
 
     logging.info(f"Generated query: {query}")
-    return jsonify({'query': query}), 200
-
-def convert_decimal_to_float(data):
-    """Recursively convert Decimal objects to floats."""
-    if isinstance(data, decimal.Decimal):
-        return float(data)
-    elif isinstance(data, dict):
-        return {key: convert_decimal_to_float(value) for key, value in data.items()}
-    elif isinstance(data, list):
-        return [convert_decimal_to_float(item) for item in data]
-    return data
+    query, validation = check_query(query, catalog, messages, bot_message)
+    # LLM latency includes the repair round-trip, when there was one
+    llm_ms = (time.perf_counter() - llm_started) * 1000
+    # Queries that still fail validation are returned for the user to fix, but never cached
+    if query and (validation is None or validation['valid']):
+        translation_cache.put(cache_key, query)
+    TRANSLATIONS.inc(path='llm')
+    return {'query': query, 'cached': False, 'path': 'llm', 'prompt_tokens': prompt_stats['prompt_tokens'],
+            'schema_tables': prompt_stats.get('schema_tables'), 'validation': validation,
+            'history_id': query_history.record_translation(message, catalog.db_type, query, 'llm', llm_ms)}
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    context, error = prepare_chat(request.json)
+    if error:
+        return error
+
+    try:
+        result = generate_query(context['message'], context['cache_key'], context['catalog'])
+    except LLMError as e:
+        logging.error(f'Error communicating with OpenAI: {e}')
+        return jsonify({'error': 'Failed to communicate with OpenAI'}), 503 if isinstance(e, CircuitOpenError) else 500
+
+    return jsonify(result), 200
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    data = request.json
+    messages = data.get('messages')
+    db_type = normalize_db_type(data.get('db_type'))
+
+    if not isinstance(messages, list) or not messages or not db_type:
+        return jsonify({'error': 'No messages or database type provided'}), 400
+    if len(messages) > CHAT_BATCH_MAX_SIZE:
+        return jsonify({'error': f'At most {CHAT_BATCH_MAX_SIZE} messages per batch'}), 400
+
+    catalog, error = get_loaded_catalog(db_type)
+    if error:
+        return error
+
+    # Identical questions (after normalization) are only sent to the LLM once
+    checksum = catalog.checksum
+    keys = [
+        translation_cache.make_key(message, db_type, checksum) if isinstance(message, str) and message.strip()
+        else None
+        for message in messages
+    ]
+    unique = {}
+    for key, message in zip(keys, messages):
+        if key is not None:
+            unique.setdefault(key, message)
+
+    def translate(item):
+        cache_key, message = item
+        try:
+            return cache_key, generate_query(message, cache_key, catalog)
+        except LLMError as e:
+            logging.error(f'Error communicating with OpenAI for batch item: {e}')
+            return cache_key, {'error': str(e)}
+        except Exception as e:
+            logging.error(f'Error translating batch item: {e}')
+            return cache_key, {'error': str(e)}
+
+    concurrency = max(1, min(int(data.get('concurrency') or CHAT_BATCH_CONCURRENCY), CHAT_BATCH_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='chat-batch') as executor:
+        translated = dict(executor.map(translate, unique.items()))
+
+    results = []
+    for key, message in zip(keys, messages):
+        if key is None:
+            results.append({'message': message, 'error': 'Empty message'})
+        else:
+            results.append(dict(translated[key], message=message))
+
+    failed = sum(1 for result in results if 'error' in result)
+    logging.info(f"Batch of {len(messages)} messages ({len(unique)} unique) translated, {failed} failed")
+    return jsonify({'results': results, 'unique': len(unique), 'failed': failed}), 200
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same as /api/chat, but forwards model tokens to the browser as server-sent events."""
+    context, error = prepare_chat(request.json)
+    if error:
+        return error
+
+    cache_key = context['cache_key']
+    rule = match_rules(context['message'], context['catalog'])
+    cached_query = translation_cache.get(cache_key) if rule is None else None
+    messages, prompt_stats = (None, None) if rule is not None or cached_query is not None else \
+        build_messages(context['message'], context['catalog'])
+
+    message, db_type = context['message'], context['db_type']
+
+    def generate():
+        if rule is not None:
+            history_id = query_history.record_translation(message, db_type, rule['query'], 'rules')
+            yield sse_event('query', {'query': rule['query'], 'cached': False, 'path': 'rules', 'rule': rule,
+                                      'history_id': history_id})
+            return
+        if cached_query is not None:
+            logging.info(f"Translation cache hit: {cached_query}")
+            TRANSLATIONS.inc(path='cache')
+            history_id = query_history.record_translation(message, db_type, cached_query, 'cache')
+            yield sse_event('query', {'query': cached_query, 'cached': True, 'path': 'cache', 'history_id': history_id})
+            return
+
+        parts = []
+        started = time.perf_counter()
+        try:
+            for delta in llm_client.stream_chat_completion(completion_payload(messages)):
+                parts.append(delta)
+                yield sse_event('token', delta)
+        except LLMError as e:
+            logging.error(f'Error communicating with OpenAI: {e}')
+            yield sse_event('error', 'Failed to communicate with OpenAI')
+            return
+        finally:
+            record_stage('llm', time.perf_counter() - started)
+
+        bot_message = ''.join(parts).strip()
+        LLM_TOKENS.inc(prompt_stats['prompt_tokens'], kind='prompt')
+        LLM_TOKENS.inc(estimate_tokens(bot_message), kind='completion')
+        logging.info(f"Received streamed response: {bot_message}")
+        query = extract_query(bot_message)
+        logging.info(f"Generated query: {query}")
+        query, validation = check_query(query, context['catalog'], messages, bot_message)
+        llm_ms = (time.perf_counter() - started) * 1000
+        if query and (validation is None or validation['valid']):
+            translation_cache.put(cache_key, query)
+        TRANSLATIONS.inc(path='llm')
+        history_id = query_history.record_translation(message, db_type, query, 'llm', llm_ms)
+        yield sse_event('query', {'query': query, 'cached': False, 'path': 'llm',
+                                  'prompt_tokens': prompt_stats['prompt_tokens'],
+                                  'schema_tables': prompt_stats.get('schema_tables'), 'validation': validation,
+                                  'history_id': history_id})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(generate(), mimetype='text/event-stream', headers=headers)
+
+@app.route('/api/chat/cache/stats', methods=['GET'])
+def chat_cache_stats():
+    return jsonify({'translation_cache': translation_cache.stats()}), 200
+
+@app.route('/api/chat/rules/stats', methods=['GET'])
+def chat_rules_stats():
+    return jsonify({'rules': rule_engine.stats()}), 200
+
+@app.route('/api/chat/prompt/stats', methods=['GET'])
+def chat_prompt_stats():
+    return jsonify({'few_shot': few_shot_selector.stats(),
+                    'schema': [index.stats() for index in list(schema_indexes.values())]}), 200
+
+def render_result(result_format, compression, columns, rows, **meta):
+    """Encode a result page as row-major JSON, columnar JSON or Arrow IPC, converting types per column."""
+    if result_format == 'arrow':
+        with stage('encode'):
+            body = encode_arrow(columns, rows, metadata=meta, compression=compression)
+        response = Response(body, mimetype=ARROW_MIMETYPE)
+        response.headers['X-Result-Handle'] = meta.get('handle') or ''
+        response.headers['X-Has-More'] = 'true' if meta.get('has_more') else 'false'
+        return response, 200
+
+    with stage('convert'):
+        if result_format == 'columnar':
+            payload = dict(meta, columns=columns, row_count=len(rows),
+                           data=[convert_column(column) for column in to_columns(rows, len(columns))])
+        else:
+            payload = dict(meta, columns=columns, result=convert_rows(rows, len(columns)))
+    with stage('encode'):
+        body, encoding = maybe_gzip(app.json.dumps(payload).encode('utf-8'), compression,
+                                    request.headers.get('Accept-Encoding'))
+    response = Response(body, mimetype='application/json')
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response, 200
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+def stream_query_result(pool, db_type, query, stream_format, guard=None, history_id=None):
+    """Execute the query and stream its rows batch by batch as NDJSON or server-sent events."""
+    started = time.perf_counter()
+    driver = get_driver(db_type)
+    conn = pool.acquire()
+    try:
+        cursor = driver.execute(conn, query)
+    except Exception:
+        pool.release(conn)
+        raise
+
+    def encode(event, payload):
+        if stream_format == 'sse':
+            return sse_event(event, payload)
+        return app.json.dumps({event: payload}) + '\n'
+
+    def generate():
+        sent = 0
+        error = None
+        try:
+            for chunk in stream_chunks():
+                sent += len(chunk.encode('utf-8'))
+                yield chunk
+        except Exception as e:
+            logging.error(f"Error streaming query result: {str(e)}")
+            error = str(e)
+            yield encode('error', error)
+        finally:
+            cursor.close()
+            pool.release(conn, broken=not cursor.reusable)
+            logging.info(f"Streamed {cursor.row_count} rows from {db_type}")
+            query_history.record_execution(db_type, query, exec_ms=(time.perf_counter() - started) * 1000,
+                                           rows=cursor.row_count, bytes_returned=sent, translation_id=history_id,
+                                           error=error)
+
+    def stream_chunks():
+        yield encode('columns', cursor.columns)
+        for rows in cursor:
+            rows = convert_rows(rows, len(cursor.columns))
+            if stream_format == 'sse':
+                yield encode('rows', rows)
+            else:
+                yield ''.join(app.json.dumps(row) + '\n' for row in rows)
+        if driver.writes(query):
+            conn.commit()
+            result_cache.invalidate_for_statement(pool.database_id, query)
+            schema_changed(pool, query)
+        yield encode('end', {'row_count': cursor.row_count, 'guard': guard})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(generate(), mimetype=STREAM_FORMATS[stream_format], headers=headers)
 
 @app.route('/api/execute_query', methods=['POST'])
 def execute_query():
     data = request.json
     query = data.get('query')
     db_type = normalize_db_type(data.get('db_type'))
+    stream_format = data.get('stream')
+    page_size = int(data.get('page_size') or RESULT_PAGE_SIZE)
+    compression = data.get('compression')
+    history_id = data.get('history_id')  # the /api/chat translation this query came from, if any
 
     if not query or not db_type:
         return jsonify({'error': 'No query or database type provided'}), 400
 
-    if db_type not in connections or connections[db_type] is None:
-        return jsonify({'error': 'No connection found for the given database type'}), 400
+    try:
+        result_format = negotiate_format(data.get('format'), request.headers.get('Accept'), compression)
+    except EncodingError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if stream_format and stream_format not in STREAM_FORMATS:
+        return jsonify({'error': f"Unsupported stream format: {stream_format}"}), 400
+
+    session = get_session(db_type)
+    if session is None:
+        return no_session_response()
+    pool = session.pool
+    if health_monitor.is_down(pool):
+        return jsonify({'error': f"The {db_type} connection is down and is being re-established",
+                        'health': health_monitor.status(pool)}), 503, \
+            {'Retry-After': str(health_monitor.retry_after(pool))}
 
     logging.info(f"Executing query on {db_type}: {query}")
+    driver = get_driver(db_type)
 
-    def query_func():
+    if stream_format:
         try:
-            result = []
-            columns = []
-
-            if db_type == 'postgresql':
-                conn = connections['postgresql']
-                cur = conn.cursor()
-                cur.execute(query)
-                result = cur.fetchall()
-                columns = [desc[0] for desc in cur.description]
-                cur.close()
-            elif db_type == 'mysql':
-                conn = connections['mysql']
-                cur = conn.cursor()
-                cur.execute(query)
-                result = cur.fetchall()
-                columns = [desc[0] for desc in cur.description]
-                cur.close()
-            elif db_type == 'sqlite':
-                conn = connections['sqlite']
-                cur = conn.cursor()
-                cur.execute(query)
-                result = cur.fetchall()
-                columns = [desc[0] for desc in cur.description]
-                cur.close()
-            elif db_type == 'mongodb':
-                client = connections['mongodb']
-                db = client.get_database()
-                collection_name = query.split('.')[1]
-                query_body = query.split('find(')[1][:-1]
-                collection = db[collection_name]
-                result = list(collection.find(eval(query_body)))
-                if result:
-                    columns = result[0].keys()
-                    result = [list(r.values()) for r in result]
-                else:
-                    columns = []
-            else:
-                return jsonify({'error': 'Unsupported database type'}), 400
+            with stage('guard'), pool.connection() as conn:
+                run_query, guard = guard_query(conn, db_type, query)
+            return stream_query_result(pool, db_type, run_query, stream_format, guard, history_id)
+        except QueryBlockedError as e:
+            logging.warning(f"{e} ({db_type}): {query}")
+            return jsonify({'error': str(e), 'plan': e.report}), 422
+        except MongoQueryError as e:
+            return jsonify({'error': str(e)}), 400
+        except PoolTimeoutError as e:
+            return jsonify({'error': str(e)}), 503
+        except Exception as e:
+            logging.error(f"Error executing query: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+    cacheable = driver.is_cacheable(query)
+    cache_key = result_cache.make_key(db_type, pool.database_id, query, pool.user) if cacheable else None
+    if cacheable:
+        with stage('result_cache'):
+            cached = result_cache.get(cache_key)
+        if cached is not None and len(cached[1]) <= page_size:
+            logging.info("Serving query result from cache")
+            columns, result = cached
+            rendered = render_result(result_format, compression, columns, result,
+                                     query=query, handle=None, has_more=False, cached=True)
+            query_history.record_execution(db_type, query, rows=len(result), cached=True, translation_id=history_id,
+                                           bytes_returned=rendered[0].calculate_content_length())
+            return rendered
 
-            result = [convert_decimal_to_float(row) for row in result]
-            return jsonify({'query': query, 'columns': columns, 'result': result}), 200
-        
+    def query_func():
+        try:
+            with stage('guard'), pool.connection() as conn:
+                run_query, guard = guard_query(conn, db_type, query)
+            started = time.perf_counter()
+            with stage('db'):
+                columns, result, handle_id = result_handles.open(pool, db_type, run_query, page_size, owner=session.token)
+            # Time to the first page; later pages are fetched through the result handle
+            exec_ms = (time.perf_counter() - started) * 1000
+            ROWS_RETURNED.observe(len(result), db_type=db_type)
+            if cacheable and handle_id is None:
+                result_cache.put(cache_key, columns, convert_rows(result, len(columns)))
+            elif driver.writes(query):
+                result_cache.invalidate_for_statement(pool.database_id, query)
+                schema_changed(pool, query)
+            rendered = render_result(result_format, compression, columns, result, query=run_query,
+                                     handle=handle_id, has_more=handle_id is not None, cached=False, guard=guard)
+            query_history.record_execution(db_type, query, exec_ms=exec_ms, rows=len(result), translation_id=history_id,
+                                           bytes_returned=rendered[0].calculate_content_length())
+            return rendered
+        except QueryBlockedError as e:
+            logging.warning(f"{e} ({db_type}): {query}")
+            return jsonify({'error': str(e), 'plan': e.report}), 422
+        except MongoQueryError as e:
+            query_history.record_execution(db_type, query, translation_id=history_id, error=str(e))
+            return jsonify({'error': str(e)}), 400
+        except PoolTimeoutError:
+            raise
         except Exception as e:
             logging.error(f"Error executing query: {str(e)}")
+            query_history.record_execution(db_type, query, translation_id=history_id, error=str(e))
             return jsonify({'error': str(e)}), 500
 
     return execute_query_and_reconnect_if_needed(db_type, query_func)
 
+@app.route('/api/execute_query/cache/stats', methods=['GET'])
+def execute_query_cache_stats():
+    return jsonify({'result_cache': result_cache.stats()}), 200
+
+@app.route('/api/execute_query/page', methods=['POST'])
+def execute_query_page():
+    data = request.json
+    handle_id = data.get('handle')
+    page_size = int(data.get('page_size') or RESULT_PAGE_SIZE)
+    compression = data.get('compression')
+
+    if not handle_id:
+        return jsonify({'error': 'No result handle provided'}), 400
+    session = get_session(normalize_db_type(data.get('db_type')))
+    if session is None:
+        return no_session_response()
+
+    try:
+        result_format = negotiate_format(data.get('format'), request.headers.get('Accept'), compression)
+    except EncodingError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with stage('db'):
+            page = result_handles.fetch(handle_id, page_size, owner=session.token)
+    except Exception as e:
+        logging.error(f"Error fetching result page: {str(e)}")
+        result_handles.close(handle_id, owner=session.token)
+        return jsonify({'error': str(e)}), 500
+
+    if page is None:
+        return jsonify({'error': 'Result handle not found or expired'}), 404
+
+    columns, result, has_more = page
+    return render_result(result_format, compression, columns, result,
+                         handle=handle_id if has_more else None, has_more=has_more)
+
+@app.route('/api/execute_query/close', methods=['POST'])
+def execute_query_close():
+    data = request.json
+    handle_id = data.get('handle')
+    if not handle_id:
+        return jsonify({'error': 'No result handle provided'}), 400
+    session = get_session(normalize_db_type(data.get('db_type')))
+    if session is None:
+        return no_session_response()
+    if not result_handles.close(handle_id, owner=session.token):
+        return jsonify({'error': 'Result handle not found or expired'}), 404
+    return jsonify({'message': 'Result handle closed'}), 200
+
+def submit_query_job(data, export=None):
+    """Guard and queue a query for the caller's session; shared by /api/jobs and /api/export."""
+    query = data.get('query')
+    db_type = normalize_db_type(data.get('db_type'))
+
+    if not query or not db_type:
+        return jsonify({'error': 'No query or database type provided'}), 400
+
+    session = get_session(db_type)
+    if session is None:
+        return no_session_response()
+    driver = get_driver(db_type)
+    if export is not None and not driver.returns_rows(query):
+        return jsonify({'error': 'Only queries that return rows can be exported'}), 400
+    try:
+        # Checked up front so a malformed query is a 400 here rather than a failed job later
+        driver.check(query)
+    except MongoQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    pool = session.pool
+    if health_monitor.is_down(pool):
+        return jsonify({'error': f"The {db_type} connection is down and is being re-established",
+                        'health': health_monitor.status(pool)}), 503, \
+            {'Retry-After': str(health_monitor.retry_after(pool))}
+
+    try:
+        # Jobs return their full result, so no LIMIT is injected; the row cap is JOB_MAX_ROWS instead
+        with stage('guard'), pool.connection() as conn:
+            run_query, guard = guard_query(conn, db_type, query, mode=JOB_GUARD_MODE, default_limit=0)
+        job = query_jobs.submit(session.token, pool, db_type, run_query, export)
+    except QueryBlockedError as e:
+        logging.warning(f"{e} ({db_type}): {query}")
+        return jsonify({'error': str(e), 'plan': e.report}), 422
+    except JobLimitError as e:
+        return jsonify({'error': str(e)}), 429
+    except PoolTimeoutError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logging.error(f"Error submitting query job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    payload = {'job': job.to_dict(), 'guard': guard}
+    if export is not None:
+        payload['download'] = f"/api/export/{job.id}/download"
+    return jsonify(payload), 202
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    return submit_query_job(request.json)
+
+def job_owner():
+    session = get_session(normalize_db_type(request.args.get('db_type')))
+    return session.token if session else None
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    owner = job_owner()
+    if owner is None:
+        return no_session_response()
+    return jsonify({'jobs': [job.to_dict() for job in query_jobs.list(owner)]}), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = query_jobs.get(job_id, job_owner())
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return jsonify({'job': job.to_dict()}), 200
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = query_jobs.get(job_id, job_owner())
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job.state != 'succeeded':
+        return jsonify({'error': f"Job is {job.state}", 'job': job.to_dict()}), 409
+    if job.export is not None:
+        return jsonify({'error': 'Export results are fetched from their download URL',
+                        'download': f"/api/export/{job.id}/download"}), 409
+
+    compression = request.args.get('compression')
+    try:
+        result_format = negotiate_format(request.args.get('format'), request.headers.get('Accept'), compression)
+        offset = int(request.args.get('offset') or 0)
+        limit = int(request.args.get('limit') or RESULT_PAGE_SIZE)
+    except (EncodingError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    rows = job.rows[offset:offset + limit]
+    return render_result(result_format, compression, job.columns, rows, job=job.id, offset=offset,
+                         total=len(job.rows), has_more=offset + len(rows) < len(job.rows), truncated=job.truncated)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = query_jobs.cancel(job_id, job_owner())
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return jsonify({'job': job.to_dict()}), 200
+
+@app.route('/api/export', methods=['POST'])
+def export_query():
+    data = request.json
+    try:
+        export = ResultExport(data.get('format') or 'csv', data.get('compression'))
+    except EncodingError as e:
+        return jsonify({'error': str(e)}), 400
+    return submit_query_job(data, export)
+
+@app.route('/api/export/<job_id>/download', methods=['GET'])
+def download_export(job_id):
+    job = query_jobs.get(job_id, job_owner())
+    if job is None or job.export is None:
+        return jsonify({'error': 'Export not found or expired'}), 404
+    if job.state != 'succeeded':
+        return jsonify({'error': f"Export is {job.state}", 'job': job.to_dict()}), 409
+    return send_file(job.export.path, mimetype=job.export.mimetype, as_attachment=True,
+                     download_name=job.export.filename)
+
+@app.route('/api/visualize', methods=['POST'])
+def visualize():
+    """Chart-ready series for a query, aggregated or downsampled in the database instead of returned row by row."""
+    data = request.json
+    query = data.get('query')
+    db_type = normalize_db_type(data.get('db_type'))
+    chart = data.get('chart') or {}
+
+    if not query or not db_type:
+        return jsonify({'error': 'No query or database type provided'}), 400
+    if not isinstance(chart, dict):
+        return jsonify({'error': 'chart must be an object'}), 400
+
+    session = get_session(db_type)
+    if session is None:
+        return no_session_response()
+    driver = get_driver(db_type)
+    if not driver.returns_rows(query):
+        return jsonify({'error': 'Only queries that return rows can be visualized'}), 400
+    pool = session.pool
+    if health_monitor.is_down(pool):
+        return jsonify({'error': f"The {db_type} connection is down and is being re-established",
+                        'health': health_monitor.status(pool)}), 503, \
+            {'Retry-After': str(health_monitor.retry_after(pool))}
+
+    try:
+        # The whole result feeds the aggregation, so no LIMIT is injected into the source query
+        with stage('guard'), pool.connection() as conn:
+            run_query, guard = guard_query(conn, db_type, query, mode=VIZ_GUARD_MODE, default_limit=0)
+        with stage('visualize'), pool.connection() as conn:
+            result = driver.visualizer(conn, run_query).build(chart)
+    except QueryBlockedError as e:
+        logging.warning(f"{e} ({db_type}): {query}")
+        return jsonify({'error': str(e), 'plan': e.report}), 422
+    except VisualizationError as e:
+        return jsonify({'error': str(e)}), 400
+    except PoolTimeoutError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logging.error(f"Error building visualization: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    result['guard'] = guard
+    return jsonify(result), 200
+
+def history_filters():
+    """limit, since (epoch seconds) and db_type query parameters shared by the history reports."""
+    return {
+        'limit': min(int(request.args.get('limit') or 20), 500),
+        'since': float(request.args['since']) if request.args.get('since') else None,
+        'db_type': normalize_db_type(request.args.get('db_type')),
+    }
+
+@app.route('/api/history/slowest', methods=['GET'])
+def history_slowest():
+    try:
+        filters = history_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'queries': query_history.slowest(**filters)}), 200
+
+@app.route('/api/history/fingerprints', methods=['GET'])
+def history_fingerprints():
+    try:
+        filters = history_filters()
+        min_count = int(request.args.get('min_count') or 1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'fingerprints': query_history.fingerprints(min_count=min_count, **filters)}), 200
+
+@app.route('/api/history/cache_candidates', methods=['GET'])
+def history_cache_candidates():
+    try:
+        filters = history_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'candidates': query_history.cache_candidates(**filters)}), 200
+
+@app.route('/api/history/stats', methods=['GET'])
+def history_stats():
+    return jsonify({'query_history': query_history.stats()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/debug/profiles', methods=['GET'])
+def debug_profiles():
+    if profiler is None:
+        return jsonify({'error': 'Profiling is disabled; set PROFILE_SLOW_REQUEST_MS to enable it'}), 404
+    return jsonify({'profiles': profiler.profiles()}), 200
+
 
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
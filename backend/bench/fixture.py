@@ -0,0 +1,76 @@
+"""Deterministic SQLite fixture in the students / subjects / enrollments / exam_results schema
+used by prompt-completion.json.
+"""
+import datetime
+import random
+import sqlite3
+
+SUBJECTS = ['Mathematics', 'Science', 'English', 'History', 'Geography', 'Art', 'Music', 'Computer Science']
+FIRST_NAMES = ['Alice', 'Bob', 'Carla', 'David', 'Elena', 'Farid', 'Grace', 'Hugo', 'Ines', 'Jamal', 'Kira', 'Liam',
+               'Maya', 'Noah', 'Olga', 'Pavel', 'Quinn', 'Rosa', 'Sam', 'Tara']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Okafor', 'Novak', 'Silva', 'Kim', 'Haddad', 'Muller', 'Rossi']
+
+SCHEMA = """
+CREATE TABLE students (
+    student_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    grade_level INTEGER NOT NULL
+);
+CREATE TABLE subjects (
+    subject_id INTEGER PRIMARY KEY,
+    subject_name TEXT NOT NULL
+);
+CREATE TABLE enrollments (
+    enrollment_id INTEGER PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students (student_id),
+    subject_id INTEGER NOT NULL REFERENCES subjects (subject_id)
+);
+CREATE TABLE exam_results (
+    result_id INTEGER PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students (student_id),
+    subject_id INTEGER NOT NULL REFERENCES subjects (subject_id),
+    score REAL NOT NULL,
+    exam_date TEXT NOT NULL
+);
+CREATE INDEX enrollments_student ON enrollments (student_id);
+CREATE INDEX enrollments_subject ON enrollments (subject_id);
+CREATE INDEX exam_results_student ON exam_results (student_id);
+CREATE INDEX exam_results_subject ON exam_results (subject_id);
+"""
+
+
+def build_fixture(path, students=10000, subjects_per_student=4, exams_per_subject=2, seed=42):
+    """Create (or replace) the fixture database at path and return its row counts."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        for table in ('exam_results', 'enrollments', 'subjects', 'students'):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO subjects (subject_id, subject_name) VALUES (?, ?)",
+                         list(enumerate(SUBJECTS, start=1)))
+
+        start = datetime.date(2022, 9, 1)
+        student_rows, enrollment_rows, exam_rows = [], [], []
+        for student_id in range(1, students + 1):
+            grade_level = rng.randint(9, 12)
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            student_rows.append((student_id, name, grade_level + 5 + rng.randint(0, 1), grade_level))
+            for subject_id in rng.sample(range(1, len(SUBJECTS) + 1), min(subjects_per_student, len(SUBJECTS))):
+                enrollment_rows.append((student_id, subject_id))
+                for _ in range(exams_per_subject):
+                    exam_date = start + datetime.timedelta(days=rng.randint(0, 600))
+                    score = round(min(100.0, max(0.0, rng.gauss(72, 15))), 1)
+                    exam_rows.append((student_id, subject_id, score, exam_date.isoformat()))
+
+        conn.executemany("INSERT INTO students (student_id, name, age, grade_level) VALUES (?, ?, ?, ?)",
+                         student_rows)
+        conn.executemany("INSERT INTO enrollments (student_id, subject_id) VALUES (?, ?)", enrollment_rows)
+        conn.executemany("INSERT INTO exam_results (student_id, subject_id, score, exam_date) VALUES (?, ?, ?, ?)",
+                         exam_rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return {'students': len(student_rows), 'subjects': len(SUBJECTS), 'enrollments': len(enrollment_rows),
+            'exam_results': len(exam_rows)}
@@ -0,0 +1,312 @@
+"""Load test the backend against a stub LLM and a generated SQLite fixture.
+
+Starts a stub OpenAI server, builds the fixture, launches the Flask app in a subprocess, drives
+concurrent load at /api/chat, /api/execute_query and /api/tables and writes latency percentiles,
+throughput and peak RSS as JSON. Compare two runs with --baseline.
+
+    cd backend && python bench/run_bench.py --concurrency 16 --requests 500 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fixture import build_fixture  # noqa: E402
+from stub_openai import load_answers, start_server  # noqa: E402
+
+ENDPOINTS = ('chat', 'execute_query', 'tables')
+QUERIES = [
+    'SELECT name FROM students WHERE age = 15',
+    'SELECT grade_level, COUNT(*) FROM students GROUP BY grade_level',
+    "SELECT s.name FROM students s JOIN exam_results er ON s.student_id = er.student_id "
+    "JOIN subjects sub ON er.subject_id = sub.subject_id WHERE sub.subject_name = 'Science' AND er.score > 90",
+    "SELECT s.name, AVG(er.score) AS average_score FROM students s JOIN exam_results er "
+    "ON s.student_id = er.student_id JOIN subjects sub ON er.subject_id = sub.subject_id "
+    "WHERE sub.subject_name = 'Mathematics' GROUP BY s.name",
+    'SELECT * FROM exam_results WHERE student_id = 42',
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, p):
+    """Linear interpolation between closest ranks, p in [0, 100]."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def peak_rss_bytes(pid):
+    """High-water RSS of a live process from /proc, or None where that is not available."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_app(port, env, log_path):
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"
+    log = open(log_path, 'w')
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=BACKEND_DIR, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}, see {log_path}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Backend did not start listening on port {port}, see {log_path}")
+
+
+def make_request_factory(endpoint, base_url, token, prompts, unique_messages):
+    counter = iter(range(10 ** 12))
+    lock = threading.Lock()
+    headers = {'X-Session-Token': token}
+
+    def next_index():
+        with lock:
+            return next(counter)
+
+    def send(http):
+        i = next_index()
+        if endpoint == 'chat':
+            message = prompts[i % len(prompts)]
+            if unique_messages:
+                # A distinct suffix per request defeats the translation cache
+                message = f"{message.rstrip('.')} (request {i})"
+            return http.post(f"{base_url}/api/chat", json={'message': message, 'db_type': 'sqlite'},
+                             headers=headers)
+        if endpoint == 'execute_query':
+            return http.post(f"{base_url}/api/execute_query",
+                             json={'query': QUERIES[i % len(QUERIES)], 'db_type': 'sqlite'}, headers=headers)
+        return http.get(f"{base_url}/api/tables", params={'db': 'sqlite'}, headers=headers)
+
+    return send
+
+
+def run_load(send, concurrency, requests_total, duration, warmup):
+    """Closed-loop load: each worker sends its next request as soon as the previous one completes."""
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, 'http'):
+            local.http = requests.Session()
+        return local.http
+
+    for _ in range(warmup):
+        send(session())
+
+    latencies, statuses, errors = [], {}, []
+    lock = threading.Lock()
+    issued = iter(range(requests_total)) if requests_total else None
+    stop_at = time.monotonic() + duration if duration else None
+
+    def worker():
+        http = session()
+        while True:
+            if issued is not None:
+                with lock:
+                    if next(issued, None) is None:
+                        return
+            elif time.monotonic() >= stop_at:
+                return
+            started = time.perf_counter()
+            try:
+                response = send(http)
+                response.content
+                status = str(response.status_code)
+            except requests.RequestException as e:
+                status = 'exception'
+                with lock:
+                    errors.append(str(e))
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.startswith('2'))
+    return {
+        'requests': len(latencies),
+        'ok': ok,
+        'statuses': statuses,
+        'errors': errors[:5],
+        'wall_seconds': round(wall, 3),
+        'rps': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            **{f'p{p}': round(percentile(latencies, p) * 1000, 2) if latencies else None for p in (50, 95, 99)},
+            'max': round(latencies[-1] * 1000, 2) if latencies else None,
+        },
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Return the regressions of current against baseline: p95 slower or RPS lower by more than tolerance."""
+    regressions = []
+    for endpoint, result in current['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(endpoint)
+        if not before:
+            continue
+        p95, p95_before = result['latency_ms']['p95'], before['latency_ms']['p95']
+        if p95 and p95_before and p95 > p95_before * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {p95_before}ms -> {p95}ms")
+        if result['rps'] and before['rps'] and result['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{endpoint}: rps {before['rps']} -> {result['rps']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='comma-separated subset of ' +
+                        ', '.join(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint (ignored with --duration)')
+    parser.add_argument('--duration', type=float, default=0, help='seconds per endpoint instead of a request count')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--students', type=int, default=10000, help='fixture size')
+    parser.add_argument('--llm-delay', type=float, default=0.05, help='stub LLM seconds before the first token')
+    parser.add_argument('--llm-token-rate', type=float, default=0, help='stub LLM tokens per second, 0 for instant')
+    parser.add_argument('--unique-messages', action='store_true', help='make every chat message miss the cache')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment for the backend, e.g. RESULT_CACHE_TTL=0')
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative regression')
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='db-llm-bench-')
+    fixture_path = os.path.join(workdir, 'school.db')
+    fixture_rows = build_fixture(fixture_path, students=args.students)
+    stub = start_server(delay=args.llm_delay, token_rate=args.llm_token_rate)
+
+    port = free_port()
+    env = dict(os.environ,
+               OPENAI_API_KEY='bench',
+               OPENAI_BASE_URL=f"http://127.0.0.1:{stub.server_address[1]}/v1",
+               TRANSLATION_CACHE_PATH=os.path.join(workdir, 'translation_cache.sqlite3'),
+               SESSION_STORE_PATH=os.path.join(workdir, 'sessions.sqlite3'))
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+
+    log_path = os.path.join(workdir, 'backend.log')
+    process = start_app(port, env, log_path)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        response = requests.post(f"{base_url}/connect/sqlite", json={'database': fixture_path})
+        response.raise_for_status()
+        token = response.json()['session']
+        prompts = list(load_answers().keys()) or ['show all students who are 15 years old.']
+
+        results = {}
+        for endpoint in endpoints:
+            send = make_request_factory(endpoint, base_url, token, prompts, args.unique_messages)
+            results[endpoint] = run_load(send, args.concurrency, 0 if args.duration else args.requests,
+                                         args.duration, args.warmup)
+            print(f"{endpoint}: {results[endpoint]['rps']} req/s, p50 {results[endpoint]['latency_ms']['p50']}ms, "
+                  f"p99 {results[endpoint]['latency_ms']['p99']}ms", file=sys.stderr)
+        peak_rss = peak_rss_bytes(process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        stub.shutdown()
+
+    if peak_rss is None:
+        # ru_maxrss of waited-for children: kilobytes on Linux, bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak_rss = maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'concurrency': args.concurrency,
+            'requests': None if args.duration else args.requests,
+            'duration': args.duration or None,
+            'warmup': args.warmup,
+            'llm_delay': args.llm_delay,
+            'llm_token_rate': args.llm_token_rate,
+            'unique_messages': args.unique_messages,
+            'env': args.env,
+            'fixture': fixture_rows,
+        },
+        'llm_stub_requests': stub.requests,
+        'peak_rss_bytes': peak_rss,
+        'endpoints': results,
+        'backend_log': log_path,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
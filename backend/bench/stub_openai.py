@@ -0,0 +1,118 @@
+"""Local stand-in for the OpenAI chat completions API, with configurable latency and token rate.
+
+Run on its own with: python bench/stub_openai.py --port 8900 --delay 0.2 --token-rate 50
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROMPT_COMPLETION_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      'prompt-completion.json')
+DEFAULT_COMPLETION = 'SELECT name FROM students WHERE age = 15;'
+
+
+def load_answers(path=PROMPT_COMPLETION_PATH):
+    try:
+        with open(path) as f:
+            return {item['prompt'].strip().lower(): item['completion'] for item in json.load(f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def split_tokens(text):
+    """Rough word-piece split, so streamed chunks look like the real API's."""
+    tokens = []
+    for word in text.split(' '):
+        tokens.append(word + ' ')
+    tokens[-1] = tokens[-1].rstrip(' ')
+    return tokens
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('chat/completions'):
+            self.send_error(404)
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        question = ''
+        for message in payload.get('messages', []):
+            if message.get('role') == 'user':
+                question = message.get('content', '')
+        completion = server.answers.get(question.strip().lower(), DEFAULT_COMPLETION)
+        content = f"```sql\n{completion}\n```"
+        tokens = split_tokens(content)
+
+        time.sleep(server.delay)
+        if payload.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for token in tokens:
+                if server.token_rate:
+                    time.sleep(1 / server.token_rate)
+                chunk = {'choices': [{'index': 0, 'delta': {'content': token}}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b'')
+            return
+
+        if server.token_rate:
+            time.sleep(len(tokens) / server.token_rate)
+        body = json.dumps({
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'completion_tokens': len(tokens)},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+
+def make_server(host='127.0.0.1', port=0, delay=0.0, token_rate=0.0):
+    """Create the stub server; port 0 picks a free port (see server.server_address)."""
+    server = ThreadingHTTPServer((host, port), StubOpenAIHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.token_rate = token_rate
+    server.answers = load_answers()
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def start_server(**kwargs):
+    server = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, name='stub-openai', daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds before the first token')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='tokens per second, 0 for instant')
+    args = parser.parse_args()
+    stub = make_server(args.host, args.port, args.delay, args.token_rate)
+    print(f"Stub OpenAI API on http://{args.host}:{stub.server_address[1]}/v1")
+    stub.serve_forever()
@@ -0,0 +1,84 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'all', 'are', 'as', 'by', 'for', 'from', 'in', 'is', 'it', 'me', 'of', 'on', 'or',
+    'show', 'the', 'their', 'them', 'to', 'what', 'which', 'who', 'with', 'list', 'get', 'find', 'give',
+))
+
+
+def stem(token):
+    """Very small plural stripper so 'students' and 'student' share a term."""
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    # Underscores split too, so column names like exam_date match "exam date"
+    tokens = TOKEN_PATTERN.findall(text.lower().replace('_', ' '))
+    return [stem(token) for token in tokens if token not in STOP_WORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over small in-memory document sets, with incremental add and remove."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs = {}  # doc_id -> Counter of terms
+        self._lengths = {}
+        self._postings = defaultdict(set)
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._docs
+
+    def add(self, doc_id, text):
+        if doc_id in self._docs:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        self._docs[doc_id] = terms
+        length = sum(terms.values())
+        self._lengths[doc_id] = length
+        self._total_length += length
+        for term in terms:
+            self._postings[term].add(doc_id)
+
+    def remove(self, doc_id):
+        terms = self._docs.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._lengths.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            postings.discard(doc_id)
+            if not postings:
+                del self._postings[term]
+
+    def search(self, text, limit=None):
+        """Return [(doc_id, score)] for documents sharing at least one term, best first."""
+        if not self._docs:
+            return []
+        n_docs = len(self._docs)
+        avg_length = self._total_length / n_docs or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id in postings:
+                tf = self._docs[doc_id][term]
+                norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit else ranked
@@ -1,11 +1,11 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import requests
 import logging
 from dotenv import load_dotenv
 import os
 import psycopg2
 import pymongo
+from llm_client import LLMClient, LLMError
 
 load_dotenv()
 
@@ -15,6 +15,8 @@ CORS(app)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GPT_MODEL = 'gpt-4'
 
+llm_client = LLMClient(OPENAI_API_KEY)
+
 # PostgreSQL connection details from environment variables
 PG_HOST = os.getenv('PG_HOST')
 PG_PORT = os.getenv('PG_PORT')
@@ -61,40 +63,44 @@ def chat():
         return jsonify({'error': 'No message provided'}), 400
 
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers={
-                'Authorization': f'Bearer {OPENAI_API_KEY}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': GPT_MODEL,
-                'messages': [{'role': 'user', 'content': message}],
-                'max_tokens': 200,
-                'temperature': 0.7,
-                'top_p': 0.9,
-                'frequency_penalty': 0,
-                'presence_penalty': 0.6
-            }
-        )
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+        response_data = llm_client.chat_completion({
+            'model': GPT_MODEL,
+            'messages': [{'role': 'user', 'content': message}],
+            'max_tokens': 200,
+            'temperature': 0.7,
+            'top_p': 0.9,
+            'frequency_penalty': 0,
+            'presence_penalty': 0.6
+        })
+    except LLMError as e:
         logging.error(f'Error communicating with OpenAI: {e}')
         return jsonify({'error': 'Failed to communicate with OpenAI'}), 500
 
-    response_data = response.json()
     bot_message = response_data['choices'][0]['message']['content'].strip()
 
-    # Assuming some logic to extract visualization data from bot_message
-    visualization_data = None
-    if 'some condition to detect visualization' in bot_message:
-        visualization_data = extract_visualization_data(bot_message)
+    visualization_data = extract_visualization_data(bot_message)
 
     return jsonify({'message': bot_message, 'visualizationData': visualization_data})
 
 def extract_visualization_data(message):
-    # Implement your logic to extract visualization data from the message
-    return {'example': 'data'}
+    """The row-returning query in the reply, for a client that charts it against its own connection;
+    this app keeps no connection to run it on, so no rows are shipped from here."""
+    try:
+        start = message.index("```") + 3
+        query = message[start:message.index("```", start)].strip()
+    except ValueError:
+        return None
+    head = query.split(None, 1)
+    if head and head[0].lower() in ('sql', 'mongodb', 'javascript', 'js'):
+        query = head[1] if len(head) > 1 else ''
+    first = query.lstrip().split(None, 1)
+    if not first:
+        return None
+    if query.lstrip().startswith('db.'):
+        return {'query': query, 'language': 'mongodb'}
+    if first[0].lower() in ('select', 'with'):
+        return {'query': query, 'language': 'sql'}
+    return None
 
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
@@ -0,0 +1,289 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', '30'))
+POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300'))
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out before the timeout."""
+
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections for one database."""
+
+    def __init__(self, name, factory, validate=None, reset=None,
+                 min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.id = uuid.uuid4().hex
+        self.database_id = self.id  # shared by every pool on the same database once the app knows it
+        self.user = None
+        self.name = name
+        self.factory = factory
+        self.validate = validate
+        self.reset = reset
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+
+        self._idle = deque()  # (connection, last_used) pairs, most recent on the right
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'evicted': 0,
+            'wait_time_total': 0.0,
+        }
+
+        for _ in range(self.min_size):
+            self._idle.append((self._create(), time.monotonic()))
+
+    def _create(self):
+        conn = self.factory()
+        with self._cond:
+            self._size += 1
+            self._stats['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logging.warning(f"Error closing pooled {self.name} connection: {e}")
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    def _is_valid(self, conn):
+        if self.validate is None:
+            return True
+        try:
+            self.validate(conn)
+            return True
+        except Exception as e:
+            logging.warning(f"Pooled {self.name} connection failed validation: {e}")
+            return False
+
+    def acquire(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeoutError(f"{self.name} pool is closed")
+                    if self._idle:
+                        conn, _ = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1  # reserve the slot before connecting outside the lock
+                        create = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout}s waiting for a {self.name} connection")
+                    self._cond.wait(remaining)
+
+            if create:
+                try:
+                    conn = self.factory()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats['created'] += 1
+            elif not self._is_valid(conn):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._stats['checkouts'] += 1
+                self._stats['wait_time_total'] += time.monotonic() - started
+            return conn
+
+    def release(self, conn, broken=False):
+        if not broken and self.reset is not None:
+            try:
+                self.reset(conn)
+            except Exception as e:
+                logging.warning(f"Error resetting pooled {self.name} connection: {e}")
+                broken = True
+        if broken or self._closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, broken=not self._is_valid(conn))
+            raise
+        else:
+            self.release(conn)
+
+    def evict_idle(self):
+        """Close idle connections unused for longer than idle_timeout, keeping min_size."""
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = []
+        with self._cond:
+            while self._idle and self._size - len(expired) > self.min_size and self._idle[0][1] < cutoff:
+                expired.append(self._idle.popleft()[0])
+            self._stats['evicted'] += len(expired)
+        for conn in expired:
+            self._discard(conn)
+        return len(expired)
+
+    def check(self):
+        """Validate idle connections, replace broken ones and top the pool back up to min_size.
+
+        Returns (checked, replaced); raises when no working connection can be opened.
+        """
+        with self._cond:
+            if self._closed:
+                return 0, 0
+            idle = list(self._idle)
+            self._idle.clear()
+        healthy, replaced = [], 0
+        for conn, last_used in idle:
+            if self._is_valid(conn):
+                healthy.append((conn, last_used))
+            else:
+                self._discard(conn)
+                replaced += 1
+        with self._cond:
+            # Checked connections are older than anything released meanwhile, so they go back on the left
+            self._idle.extendleft(reversed(healthy))
+            self._cond.notify_all()
+
+        with self._cond:
+            missing = max(self.min_size - self._size, 0)
+            if not healthy and not missing and self._size < self.max_size:
+                missing = 1  # nothing idle to test, so probe with a fresh connection
+        for _ in range(missing):
+            conn = self._create()
+            try:
+                if self.validate is not None:
+                    self.validate(conn)
+            except Exception:
+                self._discard(conn)
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+        return len(idle) + missing, replaced
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'name': self.name,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        return stats
+
+
+class SharedClientPool:
+    """Pool facade for clients that are already thread-safe and pooled (MongoClient)."""
+
+    def __init__(self, name, client):
+        self.id = uuid.uuid4().hex
+        self.database_id = self.id
+        self.user = None
+        self.name = name
+        self.client = client
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._in_use = 0
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+        return self.client
+
+    def release(self, conn, broken=False):
+        with self._lock:
+            self._in_use -= 1
+
+    @contextmanager
+    def connection(self, timeout=None):
+        client = self.acquire(timeout)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def evict_idle(self):
+        return 0
+
+    def check(self):
+        """Ping the server; the client re-establishes its own sockets once the server is reachable."""
+        self.client.admin.command('ping')
+        return 1, 0
+
+    def close(self):
+        self.client.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'checkouts': self._checkouts,
+                'in_use': self._in_use,
+            }
+
+
+def start_idle_reaper(pools, interval=60):
+    """Periodically evict idle connections from every pool in the given dict."""
+    def reap():
+        while True:
+            time.sleep(interval)
+            for pool in list(pools.values()):
+                try:
+                    evicted = pool.evict_idle()
+                    if evicted:
+                        logging.info(f"Evicted {evicted} idle connection(s) from {pool.name} pool")
+                except Exception as e:
+                    logging.error(f"Error evicting idle connections from {pool.name} pool: {e}")
+
+    thread = threading.Thread(target=reap, name='db-pool-reaper', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,584 @@
+import abc
+import hashlib
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import mongo_query
+from db_pool import ConnectionPool, SharedClientPool, POOL_CHECKOUT_TIMEOUT, POOL_MAX_SIZE, POOL_MIN_SIZE
+from result_cache import is_cacheable
+from result_cursor import (MongoResultCursor, MySQLResultCursor, PostgresResultCursor, SQLiteResultCursor,
+                           STATEMENT_TIMEOUT_MS, is_row_returning)
+from sql_text import is_read_only
+from visualization import MongoVisualizer, SQLVisualizer
+
+
+class GuardedSQLiteConnection(sqlite3.Connection):
+    """sqlite3 connection whose progress handler aborts statements that run past their deadline."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deadline = None
+        self.set_progress_handler(self._check_deadline, 10000)
+
+    def _check_deadline(self):
+        return 1 if self.deadline is not None and time.monotonic() > self.deadline else 0
+
+    def arm(self, timeout_ms=STATEMENT_TIMEOUT_MS):
+        self.deadline = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+
+    def disarm(self):
+        self.deadline = None
+
+
+def validate_sql_connection(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT 1')
+        cur.fetchall()
+    finally:
+        cur.close()
+
+
+def reset_sql_connection(conn):
+    conn.rollback()
+
+
+def server_params(data):
+    return {
+        'host': data['host'],
+        'port': data['port'],
+        'user': data['user'],
+        'password': data['password'],
+        'database': data['database']
+    }
+
+
+def _walk_postgres(node, scans):
+    if node.get('Node Type') == 'Seq Scan':
+        scans.append(node.get('Relation Name'))
+    for child in node.get('Plans', []):
+        _walk_postgres(child, scans)
+
+
+def _walk_mysql(node, tables):
+    if isinstance(node, dict):
+        if 'table_name' in node and 'access_type' in node:
+            tables.append(node)
+        for value in node.values():
+            _walk_mysql(value, tables)
+    elif isinstance(node, list):
+        for item in node:
+            _walk_mysql(item, tables)
+
+
+def _fill_tables(tables, columns, comments, keys):
+    """Spread the rows of the information_schema queries over the tables being introspected."""
+    for table_name, column, data_type, nullable, comment in columns:
+        tables[table_name]['columns'].append(
+            {'name': column, 'type': data_type, 'nullable': nullable == 'YES', 'comment': comment or None})
+    for table_name, comment in comments:
+        tables[table_name]['comment'] = comment
+    for table_name, constraint_type, column, ref_table, ref_column in keys:
+        if constraint_type == 'PRIMARY KEY':
+            tables[table_name]['primary_key'].append(column)
+        else:
+            tables[table_name]['foreign_keys'].append(
+                {'column': column, 'ref_table': ref_table, 'ref_column': ref_column})
+
+
+class Driver(abc.ABC):
+    """One database engine: how to connect to it, read its schema, and run, guard and cancel queries on it.
+
+    The client library is imported on first use, so a worker only pays for the engines it actually connects to.
+    """
+
+    name = None
+    label = None
+    module_name = None
+
+    def __init__(self):
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._module is not None or self.module_name is None
+
+    @property
+    def module(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.module_name)
+                    logging.info(f"Loaded the {self.label} driver ({self.module_name})")
+        return self._module
+
+    def available(self):
+        """Whether the client library is installed, without importing it."""
+        return self.module_name is None or importlib.util.find_spec(self.module_name.split('.')[0]) is not None
+
+    def params(self, data):
+        """Connection descriptor from a /connect request body; raises KeyError for a missing field."""
+        return server_params(data)
+
+    def database_id(self, params):
+        """The database a descriptor points at, or None when no other descriptor can reach the same one."""
+        return f"{self.name}://{params['host']}:{params['port']}/{params['database']}"
+
+    @abc.abstractmethod
+    def connect(self, params):
+        """Open one raw connection."""
+
+    @abc.abstractmethod
+    def open_pool(self, params):
+        """Build the pool sessions check connections out of."""
+
+    def configure_session(self, conn, timeout_ms=STATEMENT_TIMEOUT_MS):
+        """Apply the per-session statement timeout on a connection; returns it."""
+        return conn
+
+    def reset_session(self, conn):
+        """Undo what a job did to a connection's session before it goes back to the pool."""
+
+    def reconnect_errors(self):
+        """Exceptions meaning the connection was lost, after which one retry on a fresh connection is worth it."""
+        return ()
+
+    @abc.abstractmethod
+    def list_tables(self, conn):
+        """{table: signature} from one cheap catalog query; a signature changes whenever the table's DDL does."""
+
+    @abc.abstractmethod
+    def introspect(self, conn, tables):
+        """Fill in the columns, keys and comments of tables ({name: empty table entry}) in place."""
+
+    def backend_id(self, conn):
+        """Server-side id of a connection, for cancelling its statement from another connection."""
+        return None
+
+    def cancel(self, pool, conn, backend_id, tag):
+        """Stop the statement running on conn (tagged with tag where the engine supports comments)."""
+
+    def check(self, query):
+        """Raise for a query that cannot run, before a connection is spent on it."""
+
+    @abc.abstractmethod
+    def execute(self, conn, query, **options):
+        """Run query and return a ResultCursor over its result."""
+
+    def explain(self, conn, query):
+        """Summarise the query plan as {'cost', 'rows', 'full_scans', 'plan'}, or None without one to check."""
+        return None
+
+    def returns_rows(self, query):
+        """Whether the query produces a result set that can be exported or charted."""
+        return True
+
+    def writes(self, query):
+        """Whether the statement may have changed data, and so has to be committed and invalidates cached reads."""
+        return False
+
+    def is_cacheable(self, query):
+        """Whether the result may be served from the result cache."""
+        return False
+
+    @abc.abstractmethod
+    def visualizer(self, conn, query, **options):
+        """The Visualizer that charts query's result on this engine."""
+
+    def to_dict(self):
+        return {'name': self.name, 'label': self.label, 'module': self.module_name, 'loaded': self.loaded,
+                'available': self.available()}
+
+
+class SQLDriver(Driver):
+    """DB-API engines, whose statements are SQL text."""
+
+    cursor_class = None
+
+    def open_pool(self, params):
+        return ConnectionPool(self.name, lambda: self.connect(params), validate=validate_sql_connection,
+                              reset=reset_sql_connection)
+
+    def reset_session(self, conn):
+        conn.rollback()
+        self.configure_session(conn)
+
+    def execute(self, conn, query, **options):
+        return self.cursor_class(conn, query, **options)
+
+    def returns_rows(self, query):
+        return is_row_returning(query)
+
+    def writes(self, query):
+        return not is_read_only(query)
+
+    def is_cacheable(self, query):
+        return is_cacheable(query)
+
+    def visualizer(self, conn, query, **options):
+        return SQLVisualizer(self, conn, query, **options)
+
+    def epoch_seconds(self, ref, kind):
+        """SQL expression for a date, timestamp or date-like text column as epoch seconds."""
+        return f"((julianday({ref}) - 2440587.5) * 86400.0)"
+
+    def floor(self, expression):
+        return f"FLOOR({expression})"
+
+
+class PostgresDriver(SQLDriver):
+    name = 'postgresql'
+    label = 'PostgreSQL'
+    module_name = 'psycopg2'
+    cursor_class = PostgresResultCursor
+
+    def connect(self, params):
+        return self.configure_session(self.module.connect(**params))
+
+    def configure_session(self, conn, timeout_ms=STATEMENT_TIMEOUT_MS):
+        if not timeout_ms:
+            return conn
+        cur = conn.cursor()
+        try:
+            cur.execute('SET statement_timeout = %s', (int(timeout_ms),))
+            conn.commit()
+        finally:
+            cur.close()
+        return conn
+
+    def reconnect_errors(self):
+        return (self.module.OperationalError,)
+
+    def backend_id(self, conn):
+        return conn.get_backend_pid()
+
+    def cancel(self, pool, conn, backend_id, tag):
+        if backend_id is None:
+            return
+        # A separate connection straight from the factory, so cancelling never waits on a full pool
+        conn = pool.factory()
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT pg_cancel_backend(%s)', (backend_id,))
+            cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+
+    def list_tables(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT table_name, md5(string_agg(column_name || ':' || data_type || ':' || is_nullable, ',' "
+                "ORDER BY ordinal_position)) FROM information_schema.columns "
+                "WHERE table_schema = 'public' GROUP BY table_name")
+            return {name: signature for name, signature in cur.fetchall()}
+        finally:
+            cur.close()
+
+    def introspect(self, conn, tables):
+        names = list(tables)
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT table_name, column_name, data_type, is_nullable, "
+                "col_description((quote_ident(table_schema) || '.' || quote_ident(table_name))::regclass, "
+                "ordinal_position) FROM information_schema.columns "
+                "WHERE table_schema = 'public' AND table_name = ANY(%s) ORDER BY table_name, ordinal_position",
+                (names,))
+            columns = cur.fetchall()
+            cur.execute(
+                "SELECT c.relname, obj_description(c.oid, 'pg_class') FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE n.nspname = 'public' AND c.relname = ANY(%s) AND obj_description(c.oid, 'pg_class') IS NOT NULL",
+                (names,))
+            comments = cur.fetchall()
+            cur.execute(
+                "SELECT tc.table_name, tc.constraint_type, kcu.column_name, ccu.table_name, ccu.column_name "
+                "FROM information_schema.table_constraints tc "
+                "JOIN information_schema.key_column_usage kcu "
+                "ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema "
+                "LEFT JOIN information_schema.constraint_column_usage ccu "
+                "ON tc.constraint_type = 'FOREIGN KEY' AND tc.constraint_name = ccu.constraint_name "
+                "AND tc.table_schema = ccu.table_schema "
+                "WHERE tc.table_schema = 'public' AND tc.table_name = ANY(%s) "
+                "AND tc.constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')",
+                (names,))
+            keys = cur.fetchall()
+        finally:
+            cur.close()
+        _fill_tables(tables, columns, comments, keys)
+
+    def explain(self, conn, query):
+        cur = conn.cursor()
+        try:
+            cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+            plan = cur.fetchone()[0]
+        finally:
+            cur.close()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        root = plan[0]['Plan']
+        scans = []
+        _walk_postgres(root, scans)
+        return {'cost': root.get('Total Cost'), 'rows': root.get('Plan Rows'), 'full_scans': scans, 'plan': plan}
+
+    def epoch_seconds(self, ref, kind):
+        if kind == 'temporal':
+            return f"EXTRACT(EPOCH FROM {ref})"
+        return f"EXTRACT(EPOCH FROM CAST({ref} AS TIMESTAMP))"
+
+
+class MySQLDriver(SQLDriver):
+    name = 'mysql'
+    label = 'MySQL'
+    module_name = 'mysql.connector'
+    cursor_class = MySQLResultCursor
+
+    def connect(self, params):
+        return self.configure_session(self.module.connect(**params))
+
+    def open_pool(self, params):
+        return ConnectionPool(self.name, lambda: self.connect(params), validate=lambda conn: conn.ping(reconnect=False),
+                              reset=reset_sql_connection)
+
+    def configure_session(self, conn, timeout_ms=STATEMENT_TIMEOUT_MS):
+        if not timeout_ms:
+            return conn
+        cur = conn.cursor()
+        try:
+            # MAX_EXECUTION_TIME only covers SELECT, which is what the guard is about
+            cur.execute('SET SESSION MAX_EXECUTION_TIME = %s', (int(timeout_ms),))
+            conn.commit()
+        finally:
+            cur.close()
+        return conn
+
+    def reconnect_errors(self):
+        return (self.module.Error,)
+
+    def backend_id(self, conn):
+        return conn.connection_id
+
+    def cancel(self, pool, conn, backend_id, tag):
+        if backend_id is None:
+            return
+        conn = pool.factory()
+        try:
+            cur = conn.cursor()
+            cur.execute(f'KILL QUERY {int(backend_id)}')
+            cur.close()
+        finally:
+            conn.close()
+
+    def list_tables(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("SET SESSION group_concat_max_len = 1000000")
+            cur.execute(
+                "SELECT table_name, MD5(GROUP_CONCAT(CONCAT(column_name, ':', column_type, ':', column_key) "
+                "ORDER BY ordinal_position)) FROM information_schema.columns "
+                "WHERE table_schema = DATABASE() GROUP BY table_name")
+            return {name: signature for name, signature in cur.fetchall()}
+        finally:
+            cur.close()
+
+    def introspect(self, conn, tables):
+        names = list(tables)
+        placeholders = ', '.join(['%s'] * len(names))
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT table_name, column_name, column_type, is_nullable, column_comment FROM information_schema.columns "
+                f"WHERE table_schema = DATABASE() AND table_name IN ({placeholders}) "
+                "ORDER BY table_name, ordinal_position",
+                names)
+            columns = cur.fetchall()
+            cur.execute(
+                "SELECT table_name, table_comment FROM information_schema.tables "
+                f"WHERE table_schema = DATABASE() AND table_name IN ({placeholders}) AND table_comment <> ''",
+                names)
+            comments = cur.fetchall()
+            cur.execute(
+                "SELECT table_name, IF(constraint_name = 'PRIMARY', 'PRIMARY KEY', 'FOREIGN KEY'), column_name, "
+                "referenced_table_name, referenced_column_name FROM information_schema.key_column_usage "
+                f"WHERE table_schema = DATABASE() AND table_name IN ({placeholders}) "
+                "AND (constraint_name = 'PRIMARY' OR referenced_table_name IS NOT NULL)",
+                names)
+            keys = cur.fetchall()
+        finally:
+            cur.close()
+        _fill_tables(tables, columns, comments, keys)
+
+    def explain(self, conn, query):
+        cur = conn.cursor()
+        try:
+            cur.execute(f"EXPLAIN FORMAT=JSON {query}")
+            plan = json.loads(cur.fetchone()[0])
+        finally:
+            cur.close()
+        tables = []
+        _walk_mysql(plan, tables)
+        rows = 1.0
+        for table in tables:
+            rows *= float(table.get('rows_produced_per_join') or table.get('rows_examined_per_scan') or 1)
+        cost = plan.get('query_block', {}).get('cost_info', {}).get('query_cost')
+        return {'cost': float(cost) if cost is not None else None, 'rows': rows if tables else None,
+                'full_scans': [t['table_name'] for t in tables if t.get('access_type') == 'ALL'],
+                'plan': plan}
+
+    def epoch_seconds(self, ref, kind):
+        return f"UNIX_TIMESTAMP({ref})"
+
+
+class SQLiteDriver(SQLDriver):
+    name = 'sqlite'
+    label = 'SQLite'
+    module_name = 'sqlite3'
+    cursor_class = SQLiteResultCursor
+
+    def params(self, data):
+        return {'database': data['database']}
+
+    def database_id(self, params):
+        if params['database'] == ':memory:':
+            return None
+        return f"{self.name}://{os.path.realpath(params['database'])}"
+
+    def connect(self, params):
+        return self.module.connect(params['database'], check_same_thread=False, factory=GuardedSQLiteConnection)
+
+    def open_pool(self, params):
+        return ConnectionPool(self.name, lambda: self.connect(params), validate=validate_sql_connection,
+                              reset=reset_sql_connection,
+                              # Every connection to :memory: is a separate database, so it cannot be shared out
+                              max_size=1 if params['database'] == ':memory:' else POOL_MAX_SIZE)
+
+    def cancel(self, pool, conn, backend_id, tag):
+        if conn is not None:
+            conn.interrupt()
+
+    def list_tables(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'")
+            return {name: hashlib.md5((sql or '').encode('utf-8')).hexdigest() for name, sql in cur.fetchall()}
+        finally:
+            cur.close()
+
+    def introspect(self, conn, tables):
+        cur = conn.cursor()
+        try:
+            for name, table in tables.items():
+                quoted = name.replace('"', '""')
+                cur.execute(f'PRAGMA table_info("{quoted}")')
+                for _, column, data_type, notnull, _, pk in cur.fetchall():
+                    table['columns'].append(
+                        {'name': column, 'type': data_type, 'nullable': not notnull, 'comment': None})
+                    if pk:
+                        table['primary_key'].append(column)
+                cur.execute(f'PRAGMA foreign_key_list("{quoted}")')
+                for row in cur.fetchall():
+                    table['foreign_keys'].append({'column': row[3], 'ref_table': row[2], 'ref_column': row[4]})
+        finally:
+            cur.close()
+
+    def explain(self, conn, query):
+        cur = conn.cursor()
+        try:
+            cur.execute(f"EXPLAIN QUERY PLAN {query}")
+            steps = [{'id': row[0], 'parent': row[1], 'detail': row[3]} for row in cur.fetchall()]
+        finally:
+            cur.close()
+        scans = [step['detail'] for step in steps
+                 if step['detail'].startswith('SCAN') and 'INDEX' not in step['detail']]
+        return {'cost': None, 'rows': None, 'full_scans': scans, 'plan': steps}
+
+    def floor(self, expression):
+        # FLOOR is optional in SQLite builds; the operand is never negative here, so truncation matches
+        return f"CAST({expression} AS INTEGER)"
+
+
+class MongoDriver(Driver):
+    name = 'mongodb'
+    label = 'MongoDB'
+    module_name = 'pymongo'
+
+    def connect(self, params):
+        client = self.module.MongoClient(
+            f"mongodb://{params['user']}:{params['password']}@{params['host']}:{params['port']}/{params['database']}",
+            minPoolSize=POOL_MIN_SIZE,
+            maxPoolSize=POOL_MAX_SIZE,
+            waitQueueTimeoutMS=int(POOL_CHECKOUT_TIMEOUT * 1000)
+        )
+        client.server_info()  # Trigger a server info request to test the connection
+        return client
+
+    def open_pool(self, params):
+        # The client keeps its own connection pool, so every checkout shares it
+        return SharedClientPool(self.name, self.connect(params))
+
+    def reconnect_errors(self):
+        return (self.module.errors.ServerSelectionTimeoutError,)
+
+    def cancel(self, pool, conn, backend_id, tag):
+        admin = pool.client.admin
+        ops = admin.aggregate([{'$currentOp': {'allUsers': True}}, {'$match': {'command.comment': tag}}])
+        for op in ops:
+            admin.command('killOp', op=op['opid'])
+
+    def list_tables(self, conn):
+        # Collections are schemaless, so there is no DDL to sign
+        return {name: '' for name in conn.get_database().list_collection_names()}
+
+    def introspect(self, conn, tables):
+        db = conn.get_database()
+        for name, table in tables.items():
+            # Collections are schemaless; a single sampled document stands in for the column list
+            sample = db[name].find_one() or {}
+            table['columns'] = [
+                {'name': key, 'type': type(value).__name__, 'nullable': True, 'comment': None}
+                for key, value in sample.items()]
+            table['primary_key'] = ['_id']
+
+    def check(self, query):
+        mongo_query.parse(query)
+
+    def execute(self, conn, query, **options):
+        return MongoResultCursor(conn, query, **options)
+
+    def visualizer(self, conn, query, **options):
+        return MongoVisualizer(self, conn, query, **options)
+
+
+DRIVERS = {}
+
+
+def register(driver):
+    """Make an engine available to /connect/<name> and everything keyed on db_type."""
+    DRIVERS[driver.name] = driver
+    return driver
+
+
+def get_driver(db_type):
+    driver = DRIVERS.get(db_type)
+    if driver is None:
+        raise ValueError(f"Unsupported database type: {db_type}")
+    return driver
+
+
+def reconnect_errors():
+    """Reconnect exceptions of the drivers loaded so far; an engine never imported cannot have raised one."""
+    return tuple(error for driver in DRIVERS.values() if driver.loaded for error in driver.reconnect_errors())
+
+
+register(PostgresDriver())
+register(MongoDriver())
+register(MySQLDriver())
+register(SQLiteDriver())
@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import threading
+
+from bm25 import BM25Index
+from translation_cache import normalize_message
+
+FEW_SHOT_K = int(os.getenv('FEW_SHOT_K', '6'))
+FEW_SHOT_TOKEN_BUDGET = int(os.getenv('FEW_SHOT_TOKEN_BUDGET', '800'))
+PROMPT_COMPLETION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt-completion.json')
+
+SYSTEM_PROMPT = "You are a helpful assistant that generates SQL queries based on user input."
+
+IN_CODE_EXAMPLES = [
+    {
+        "prompt": "Show all students who are 15 years old.",
+        "completion": "SELECT name FROM students WHERE age = 15;"
+    },
+    {
+        "prompt": "Show the names of students enrolled in English.",
+        "completion": "SELECT students.name FROM students JOIN enrollments ON students.student_id = enrollments.student_id JOIN courses ON enrollments.course_id = courses.course_id WHERE courses.course_name = 'English Literature';"
+    },
+    {
+        "prompt": "List the names and grades of students who are in grade 12.",
+        "completion": "SELECT name, grade FROM students WHERE grade = 12;"
+    },
+    {
+        "prompt": "Count the number of students in each grade.",
+        "completion": "SELECT grade, COUNT(*) FROM students GROUP BY grade;"
+    },
+    {
+        "prompt": "List students who scored above 90 in Science.",
+        "completion": "SELECT students.name FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE exam_results.subject = 'Biology' AND exam_results.score > 90;"
+    },
+    {
+        "prompt": "Show the names of students who took exams after 2023-01-01.",
+        "completion": "SELECT students.name FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE exam_results.exam_date > '2023-01-01';"
+    },
+    {
+        "prompt": "List students who are in grade 11 and scored below 50 in Mathematics.",
+        "completion": "SELECT students.name FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE students.grade = 11 AND exam_results.subject = 'Algebra I' AND exam_results.score < 50;"
+    },
+    {
+        "prompt": "Show names of students who are in grade 10 and have taken both Science and English.",
+        "completion": "SELECT students.name FROM students JOIN enrollments e1 ON students.student_id = e1.student_id JOIN courses c1 ON e1.course_id = c1.course_id JOIN enrollments e2 ON students.student_id = e2.student_id JOIN courses c2 ON e2.course_id = c2.course_id WHERE students.grade = 10 AND c1.course_name = 'Biology' AND c2.course_name = 'English Literature';"
+    },
+    {
+        "prompt": "List the names of students who have never scored below 60 in any exam.",
+        "completion": "SELECT name FROM students WHERE student_id NOT IN (SELECT student_id FROM exam_results WHERE score < 60);"
+    },
+    {
+        "prompt": "Show the average score of each student in Mathematics.",
+        "completion": "SELECT students.name, AVG(exam_results.score) AS average_score FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE exam_results.subject = 'Algebra I' GROUP BY students.name;"
+    },
+    {
+        "prompt": "Create a new table named 'teachers' with columns 'teacher_id', 'name', and 'subject'.",
+        "completion": "CREATE TABLE teachers (teacher_id INT PRIMARY KEY, name VARCHAR(100), subject VARCHAR(100));"
+    },
+    {
+        "prompt": "Add a new column 'email' to the 'students' table.",
+        "completion": "ALTER TABLE students ADD COLUMN email VARCHAR(100);"
+    },
+    {
+        "prompt": "Delete all records of students who scored below 40 in any exam.",
+        "completion": "DELETE FROM students WHERE student_id IN (SELECT student_id FROM exam_results WHERE score < 40);"
+    },
+    {
+        "prompt": "List the names of teachers who teach more than one subject.",
+        "completion": "SELECT teachers.name FROM teachers JOIN courses ON teachers.teacher_id = courses.teacher_id GROUP BY teachers.name HAVING COUNT(DISTINCT courses.course_name) > 1;"
+    },
+    {
+        "prompt": "Retrieve the names of all students and their corresponding courses.",
+        "completion": "SELECT students.name AS student_name, courses.course_name FROM students JOIN enrollments ON students.student_id = enrollments.student_id JOIN courses ON enrollments.course_id = courses.course_id;"
+    },
+    {
+        "prompt": "Show the names of students and the names of their teachers.",
+        "completion": "SELECT students.name AS student_name, teachers.name AS teacher_name FROM students JOIN enrollments ON students.student_id = enrollments.student_id JOIN courses ON enrollments.course_id = courses.course_id JOIN teachers ON courses.teacher_id = teachers.teacher_id;"
+    },
+    {
+        "prompt": "Update the grade level of students who scored above 95 in all exams to the next grade.",
+        "completion": "UPDATE students SET grade = grade + 1 WHERE student_id IN (SELECT student_id FROM exam_results GROUP BY student_id HAVING MIN(score) > 95);"
+    },
+    {
+        "prompt": "Show the names of students along with their total exam scores.",
+        "completion": "SELECT students.name, SUM(exam_results.score) AS total_score FROM students JOIN exam_results ON students.student_id = exam_results.student_id GROUP BY students.name;"
+    },
+    {
+        "prompt": "Find the average score for each subject.",
+        "completion": "SELECT exam_results.subject, AVG(exam_results.score) AS average_score FROM exam_results GROUP BY exam_results.subject;"
+    },
+    {
+        "prompt": "Find the average score for each student in the exam results.",
+        "completion": "SELECT students.name AS student_name, AVG(exam_results.score) AS average_score FROM students JOIN exam_results ON students.student_id = exam_results.student_id GROUP BY students.name;"
+    },
+    {
+        "prompt": "List the names and departments of all teachers who teach courses that have enrollments.",
+        "completion": "SELECT DISTINCT teachers.name AS teacher_name, teachers.department FROM teachers JOIN courses ON teachers.teacher_id = courses.teacher_id JOIN enrollments ON courses.course_id = enrollments.course_id;"
+    },
+    {
+        "prompt": "Get the names of all students who have taken an exam in 'Algebra I'.",
+        "completion": "SELECT students.name FROM students JOIN exam_results ON students.student_id = exam_results.student_id JOIN courses ON exam_results.subject = courses.course_name WHERE courses.course_name = 'Algebra I';"
+    },
+    {
+        "prompt": "List all courses along with the names of the teachers who teach them.",
+        "completion": "SELECT courses.course_name, teachers.name AS teacher_name FROM courses JOIN teachers ON courses.teacher_id = teachers.teacher_id;"
+    },
+    {
+        "prompt": "Find the highest score achieved in each subject.",
+        "completion": "SELECT subject, MAX(score) AS highest_score FROM exam_results GROUP BY subject;"
+    },
+    {
+        "prompt": "Retrieve the contact details (email and phone) of teachers who teach 'Science' department courses.",
+        "completion": "SELECT teachers.name, teachers.email, teachers.phone FROM teachers WHERE teachers.department = 'Science';"
+    },
+    {
+        "prompt": "Get the names of students and their grades who scored above 90 in any exam.",
+        "completion": "SELECT students.name, students.grade FROM students JOIN exam_results ON students.student_id = exam_results.student_id WHERE exam_results.score > 90;"
+    },
+    {
+        "prompt": "List all students along with their family IDs.",
+        "completion": "SELECT name, family_id FROM students;"
+    },
+    {
+        "prompt": "Retrieve the names and scores of students who scored the highest in each subject.",
+        "completion": "WITH max_scores AS (SELECT subject, MAX(score) AS highest_score FROM exam_results GROUP BY subject) SELECT students.name, exam_results.subject, exam_results.score FROM exam_results JOIN students ON exam_results.student_id = students.student_id JOIN max_scores ON exam_results.subject = max_scores.subject AND exam_results.score = max_scores.highest_score;"
+    },
+    {
+        "prompt": "Design a table for student feedback with feedback_id, student_id, course_id, feedback_text, and feedback_date.",
+        "completion": "CREATE TABLE student_feedback ( feedback_id INT PRIMARY KEY,  student_id INT NOT NULL,course_id INT NOT NULL,  feedback_text TEXT NOT NULL, feedback_date DATE NOT NULL, FOREIGN KEY (student_id) REFERENCES students(student_id), FOREIGN KEY (course_id) REFERENCES courses(course_id) );"
+    },
+    {
+        "prompt": "Create a table to keep track of teacher schedules with schedule_id, teacher_id, course_id, day_of_week, and time_slot.",
+        "completion": "CREATE TABLE teacher_schedules (schedule_id INT PRIMARY KEY,teacher_id INT NOT NULL,course_id INT NOT NULL,day_of_week VARCHAR(20) NOT NULL,time_slot VARCHAR(20) NOT NULL,FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id),FOREIGN KEY (course_id) REFERENCES courses(course_id));"
+    },
+    {
+        "prompt": "Create a table to log student library usage with usage_id, student_id, book_id, borrow_date, and return_date.",
+        "completion": "CREATE TABLE library_usage (usage_id INT PRIMARY KEY,student_id INT NOT NULL,book_id INT NOT NULL,borrow_date DATE NOT NULL,return_date DATE,FOREIGN KEY (student_id) REFERENCES students(student_id),FOREIGN KEY (book_id) REFERENCES library_books(book_id));"
+    },
+    {
+        "prompt": "Design a table for storing information about school facilities with facility_id, facility_name, location, and capacity.",
+        "completion": "CREATE TABLE school_facilities (facility_id INT PRIMARY KEY,facility_name VARCHAR(100) NOT NULL, location VARCHAR(100) NOT NULL, capacity INT NOT NULL);"
+    },
+    {
+        "prompt": "Design a table for storing sports team information with team_id, team_name, coach_name, and sport.",
+        "completion": "CREATE TABLE sports_teams (team_id INT PRIMARY KEY,team_name VARCHAR(100) NOT NULL,coach_name VARCHAR(100) NOT NULL,sport VARCHAR(50) NOT NULL);"
+    }
+]
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token) that needs no tokenizer download."""
+    return len(text) // 4 + 1
+
+
+def messages_tokens(messages):
+    # Every chat message carries a few tokens of role/formatting overhead
+    return sum(estimate_tokens(message['content']) + 4 for message in messages)
+
+
+def load_examples(path=PROMPT_COMPLETION_PATH):
+    """In-code examples first, then prompt-completion.json pairs whose prompt is not already covered."""
+    examples = list(IN_CODE_EXAMPLES)
+    seen = {normalize_message(example['prompt']) for example in examples}
+    try:
+        with open(path) as f:
+            for example in json.load(f):
+                key = normalize_message(example['prompt'])
+                if key not in seen:
+                    seen.add(key)
+                    examples.append({'prompt': example['prompt'], 'completion': example['completion']})
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not load few-shot examples from {path}: {e}")
+    return examples
+
+
+def as_messages(examples):
+    messages = []
+    for example in examples:
+        messages.append({"role": "user", "content": example['prompt']})
+        messages.append({"role": "assistant", "content": example['completion']})
+    return messages
+
+
+class FewShotSelector:
+    """Picks the most similar examples for a question from a BM25 index built once at startup."""
+
+    def __init__(self, examples=None, k=FEW_SHOT_K, token_budget=FEW_SHOT_TOKEN_BUDGET):
+        self.examples = examples if examples is not None else load_examples()
+        self.k = k
+        self.token_budget = token_budget
+        self.index = BM25Index()
+        for i, example in enumerate(self.examples):
+            self.index.add(i, example['prompt'] + ' ' + example['completion'])
+        self.full_prompt_tokens = messages_tokens(as_messages(self.examples))
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'selected_tokens': 0, 'full_tokens': 0, 'examples_selected': 0}
+
+    def select(self, message, k=None, token_budget=None):
+        k = self.k if k is None else k
+        token_budget = self.token_budget if token_budget is None else token_budget
+        selected = []
+        used = 0
+        for i, _ in self.index.search(message):
+            example = self.examples[i]
+            cost = estimate_tokens(example['prompt']) + estimate_tokens(example['completion']) + 8
+            if used + cost > token_budget:
+                continue
+            selected.append(example)
+            used += cost
+            if len(selected) >= k:
+                break
+        # Most similar example last, right before the question
+        selected.reverse()
+        return selected
+
+    def build_messages(self, message, system_prompt=SYSTEM_PROMPT):
+        messages = [{"role": "system", "content": system_prompt}]
+        messages += as_messages(self.select(message))
+        messages.append({"role": "user", "content": message})
+
+        prompt_tokens = messages_tokens(messages)
+        full_tokens = self.full_prompt_tokens + messages_tokens(
+            [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}])
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['selected_tokens'] += prompt_tokens
+            self._stats['full_tokens'] += full_tokens
+            self._stats['examples_selected'] += (len(messages) - 2) // 2
+        logging.info(f"Few-shot prompt: ~{prompt_tokens} tokens (all examples would be ~{full_tokens})")
+        return messages, {'prompt_tokens': prompt_tokens, 'full_prompt_tokens': full_tokens}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['indexed_examples'] = len(self.examples)
+        requests = stats['requests']
+        stats['avg_prompt_tokens'] = stats['selected_tokens'] / requests if requests else 0
+        stats['avg_full_prompt_tokens'] = stats['full_tokens'] / requests if requests else 0
+        return stats
@@ -0,0 +1,130 @@
+import logging
+import os
+import random
+import threading
+import time
+
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '15'))
+HEALTH_BACKOFF_MAX = float(os.getenv('HEALTH_BACKOFF_MAX', '120'))
+
+
+class ConnectionHealth:
+    def __init__(self, pool):
+        self.pool_id = pool.id
+        self.db_type = pool.name
+        self.state = 'unknown'  # unknown, healthy or down
+        self.failures = 0
+        self.last_check = None
+        self.last_ok = None
+        self.next_check = 0.0  # monotonic
+        self.latency_ms = None
+        self.error = None
+        self.replaced = 0
+
+    def to_dict(self):
+        return {
+            'pool': self.pool_id,
+            'db_type': self.db_type,
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'last_check': self.last_check,
+            'last_ok': self.last_ok,
+            'next_check_in': max(round(self.next_check - time.monotonic(), 1), 0.0),
+            'latency_ms': self.latency_ms,
+            'error': self.error,
+            'replaced_connections': self.replaced,
+        }
+
+
+class HealthMonitor:
+    """Pings every pool in the given dict in the background and rebuilds broken connections.
+
+    Failing pools are retried with exponential backoff; while a pool is down, callers can fail fast
+    with is_down() instead of waiting on connection timeouts.
+    """
+
+    def __init__(self, pools, interval=HEALTH_CHECK_INTERVAL, backoff_max=HEALTH_BACKOFF_MAX):
+        self.pools = pools
+        self.interval = interval
+        self.backoff_max = backoff_max
+        self._health = {}  # pool id -> ConnectionHealth
+        self._lock = threading.Lock()
+
+    def _entry(self, pool):
+        with self._lock:
+            health = self._health.get(pool.id)
+            if health is None:
+                health = self._health[pool.id] = ConnectionHealth(pool)
+            return health
+
+    def check(self, pool):
+        health = self._entry(pool)
+        started = time.monotonic()
+        try:
+            _, replaced = pool.check()
+        except Exception as e:
+            health.failures += 1
+            # Full jitter keeps many workers from hammering a recovering server in lockstep
+            backoff = min(self.backoff_max, self.interval * 2 ** (health.failures - 1))
+            health.next_check = time.monotonic() + random.uniform(backoff / 2, backoff)
+            if health.state != 'down':
+                logging.error(f"{pool.name} connection is down: {e}")
+            health.state = 'down'
+            health.error = str(e)
+        else:
+            if health.state == 'down':
+                logging.info(f"{pool.name} connection recovered after {health.failures} failed check(s)")
+            if replaced:
+                logging.warning(f"Replaced {replaced} broken {pool.name} connection(s)")
+            health.state = 'healthy'
+            health.failures = 0
+            health.error = None
+            health.replaced += replaced
+            health.last_ok = time.time()
+            health.next_check = time.monotonic() + self.interval
+        health.latency_ms = round((time.monotonic() - started) * 1000, 1)
+        health.last_check = time.time()
+        return health
+
+    def run_once(self):
+        pools = list(self.pools.values())
+        live = {pool.id for pool in pools}
+        with self._lock:
+            for pool_id in [pool_id for pool_id in self._health if pool_id not in live]:
+                del self._health[pool_id]
+        now = time.monotonic()
+        for pool in pools:
+            if self._entry(pool).next_check <= now:
+                self.check(pool)
+
+    def start(self, tick=1.0):
+        def run():
+            while True:
+                time.sleep(tick)
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logging.error(f"Error in connection health monitor: {e}")
+
+        thread = threading.Thread(target=run, name='db-health-monitor', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self, pool):
+        with self._lock:
+            health = self._health.get(pool.id)
+        return health.to_dict() if health else None
+
+    def is_down(self, pool):
+        with self._lock:
+            health = self._health.get(pool.id)
+        return health is not None and health.state == 'down'
+
+    def retry_after(self, pool):
+        with self._lock:
+            health = self._health.get(pool.id)
+        return max(int(health.next_check - time.monotonic()) + 1, 1) if health else 1
+
+    def snapshot(self):
+        with self._lock:
+            return [health.to_dict() for health in self._health.values()]
@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '60'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '20'))
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '20'))
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', '5'))
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', '30'))
+
+RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504))
+
+
+class LLMError(Exception):
+    """Raised when the LLM could not produce a response."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one trial call through once the reset period has passed."""
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, reset_after=LLM_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._trial_in_flight):
+                raise CircuitOpenError('LLM circuit breaker is open', status_code=503)
+            if state == 'half-open':
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logging.error(f"LLM circuit breaker opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a half-open trial that told us nothing about upstream health, so the next call can try again."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def retry_after_seconds(response):
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def completion_body(response):
+    data = response.json()
+    if not isinstance(data['choices'][0]['message']['content'], str):
+        raise TypeError('message content is not text')
+    return data
+
+
+class LLMClient:
+    """Chat completions client sharing one keep-alive session across all request threads."""
+
+    def __init__(self, api_key, base_url=OPENAI_BASE_URL, connect_timeout=LLM_CONNECT_TIMEOUT,
+                 read_timeout=LLM_READ_TIMEOUT, max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE,
+                 backoff_max=LLM_BACKOFF_MAX, pool_size=LLM_POOL_SIZE, breaker=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        # Set when upstream answers 429 so every thread sharing the client backs off, not just the one that saw it
+        self._paused_until = 0.0
+        self._pause_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}'
+        })
+
+    def _backoff(self, attempt, response=None):
+        delay = retry_after_seconds(response)
+        if delay is None:
+            # Full jitter keeps concurrent workers from retrying in lockstep
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        return min(delay, self.backoff_max)
+
+    def _pause(self, delay):
+        with self._pause_lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _wait_for_rate_limit(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def post(self, path, payload, stream=False, parse=None):
+        """POST to the API with retries; returns the successful requests.Response, or parse(response).
+
+        parse raising ValueError, KeyError, IndexError or TypeError makes the attempt a failed one.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_rate_limit()
+            self.breaker.before_call()
+            response = None
+            try:
+                try:
+                    response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    last_error = LLMError(f"Error communicating with LLM: {e}")
+                else:
+                    if response.status_code < 400:
+                        try:
+                            result = parse(response) if parse is not None else response
+                        except (ValueError, KeyError, IndexError, TypeError) as e:
+                            # A 200 with a body we cannot use is an upstream failure all the same
+                            last_error = LLMError(f"Malformed LLM response: {e!r}", response.status_code)
+                        else:
+                            self.breaker.record_success()
+                            return result
+                    else:
+                        last_error = LLMError(
+                            f"LLM returned HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+                        response.close()
+                        if response.status_code not in RETRYABLE_STATUS:
+                            # Client errors are our fault, not the upstream's, so they do not trip the breaker
+                            raise last_error
+            except BaseException:
+                # Anything that is neither a success nor a counted failure must not leave a half-open trial pending
+                self.breaker.release_trial()
+                raise
+
+            self.breaker.record_failure()
+            if attempt == self.max_retries:
+                break
+            delay = self._backoff(attempt, response)
+            if response is not None and response.status_code == 429:
+                self._pause(delay)
+            logging.warning(f"{last_error}; retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+        raise last_error
+
+    def chat_completion(self, payload):
+        """The decoded completion; every caller reads the first choice's message, so one must be there."""
+        return self.post('chat/completions', payload, parse=completion_body)
+
+    def stream_chat_completion(self, payload):
+        """Yield content deltas as the model produces them (OpenAI server-sent events)."""
+        response = self.post('chat/completions', dict(payload, stream=True), stream=True)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    return
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    logging.warning(f"Skipping malformed LLM stream chunk: {data[:100]}")
+                    continue
+                for choice in chunk.get('choices', []):
+                    delta = choice.get('delta', {}).get('content')
+                    if delta:
+                        yield delta
+        except requests.exceptions.RequestException as e:
+            self.breaker.record_failure()
+            raise LLMError(f"LLM stream interrupted: {e}")
+        finally:
+            response.close()
@@ -0,0 +1,212 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import request
+
+# Requests slower than this log their stage breakdown at WARNING instead of INFO
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = _format_labels(dict(labels, le=_format_value(bound)))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics plus collectors that read counters other components already keep (cache and pool stats)."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """Register func() -> [(name, type, help, [(labels, value), ...]), ...], evaluated at scrape time."""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                logging.error(f"Metrics collector {collect.__name__} failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    'dbchat_http_request_duration_seconds', 'HTTP request latency', ('endpoint', 'method', 'status'))
+STAGE_SECONDS = REGISTRY.histogram(
+    'dbchat_stage_duration_seconds', 'Time spent per request stage', ('stage',))
+LLM_TOKENS = REGISTRY.counter(
+    'dbchat_llm_tokens_total', 'LLM tokens sent and received (prompt tokens are estimated)', ('kind',))
+TRANSLATIONS = REGISTRY.counter(
+    'dbchat_translations_total', 'Chat questions translated, by the path that answered them', ('path',))
+ROWS_RETURNED = REGISTRY.histogram(
+    'dbchat_rows_returned', 'Rows returned per query page', ('db_type',), buckets=SIZE_BUCKETS)
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_request_id():
+    timing = _current.get()
+    return timing.request_id if timing else None
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current request (and in the stage histogram)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def instrument(app, profiler=None):
+    """Give every request an ID, record its latency and stage timings, and profile it when asked to."""
+    @app.before_request
+    def start_timing():
+        timing = RequestTiming(request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+        request.environ['dbchat.timing'] = timing
+        _current.set(timing)
+        if profiler is not None:
+            profiler.begin()
+
+    @app.after_request
+    def finish_timing(response):
+        timing = request.environ.get('dbchat.timing')
+        if timing is None:
+            return response
+        elapsed = timing.elapsed()
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        response.headers['X-Request-ID'] = timing.request_id
+        response.headers['Server-Timing'] = ', '.join(
+            [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timing.stages.items()] +
+            [f"total;dur={elapsed * 1000:.1f}"])
+        stages = ' '.join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in timing.stages.items())
+        level = logging.WARNING if elapsed * 1000 >= SLOW_REQUEST_MS else logging.INFO
+        logging.log(level, f"request_id={timing.request_id} {request.method} {endpoint} "
+                           f"status={response.status_code} total={elapsed * 1000:.1f}ms {stages}".rstrip())
+        return response
+
+    @app.teardown_request
+    def stop_profiling(exc):
+        timing = request.environ.get('dbchat.timing')
+        if profiler is not None and timing is not None:
+            profiler.end(timing.request_id, request.path, timing.elapsed())
+        _current.set(None)
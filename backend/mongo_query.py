@@ -0,0 +1,326 @@
+import datetime
+import re
+
+# Operators that run arbitrary JavaScript on the server, and the pipeline stages that write to a collection,
+# are never accepted from generated queries
+FORBIDDEN_OPERATORS = frozenset(('$where', '$function', '$accumulator', '$out', '$merge'))
+
+CURSOR_MODIFIERS = ('sort', 'limit', 'skip', 'projection')
+
+TOKEN_PATTERN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<number>-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[$A-Za-z_][$\w]*)
+  | (?P<punct>[{}\[\](),:.;])
+''', re.VERBOSE)
+
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '0': '\0'}
+
+
+class MongoQueryError(ValueError):
+    """Raised when a query is outside the supported shell subset."""
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_PATTERN.match(text, pos)
+        if match is None:
+            raise MongoQueryError(f"Unexpected character {text[pos]!r} at position {pos}")
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append((kind, match.group(), pos))
+        pos = match.end()
+    return tokens
+
+
+def _unquote(literal):
+    body = literal[1:-1]
+    return re.sub(r'\\(.)', lambda m: ESCAPES.get(m.group(1), m.group(1)), body)
+
+
+class MongoQuery:
+    """A parsed shell statement: db.<collection>.<operation>(...) plus cursor modifiers."""
+
+    def __init__(self, collection, operation):
+        self.collection = collection
+        self.operation = operation
+        self.filter = {}
+        self.projection = None
+        self.sort = None
+        self.limit = 0
+        self.skip = 0
+        self.pipeline = []
+
+    def columns_hint(self):
+        """Column order implied by an inclusion projection, or None when documents decide it."""
+        if not self.projection or not any(value for key, value in self.projection.items() if key != '_id'):
+            return None
+        columns = [key for key, value in self.projection.items() if value and key != '_id']
+        if self.projection.get('_id', 1):
+            columns.insert(0, '_id')
+        return columns
+
+    def as_pipeline(self):
+        """The same documents as an aggregation pipeline, so further stages can be appended server-side."""
+        if self.operation == 'aggregate':
+            return list(self.pipeline)
+        if self.operation != 'find':
+            raise MongoQueryError(f"{self.operation}() results cannot be extended with pipeline stages")
+        pipeline = [{'$match': self.filter}] if self.filter else []
+        if self.sort:
+            pipeline.append({'$sort': dict(self.sort)})
+        if self.skip:
+            pipeline.append({'$skip': self.skip})
+        if self.limit:
+            pipeline.append({'$limit': self.limit})
+        if self.projection:
+            pipeline.append({'$project': self.projection})
+        return pipeline
+
+    @classmethod
+    def aggregation(cls, collection, pipeline, columns=None):
+        """A pipeline built in code; columns fixes the row layout the way an inclusion projection would."""
+        query = cls(collection, 'aggregate')
+        query.pipeline = pipeline
+        if columns:
+            query.projection = dict({'_id': 0}, **{column: 1 for column in columns})
+        return query
+
+
+class Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None, len(self.text))
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise MongoQueryError('Unexpected end of query')
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        kind, text, pos = self.next()
+        if text != value:
+            raise MongoQueryError(f"Expected {value!r} at position {pos}, found {text!r}")
+
+    def accept(self, value):
+        if self.peek()[1] == value:
+            self.pos += 1
+            return True
+        return False
+
+    def name(self):
+        kind, text, pos = self.next()
+        if kind != 'name':
+            raise MongoQueryError(f"Expected a name at position {pos}, found {text!r}")
+        return text
+
+    def value(self):
+        kind, text, pos = self.peek()
+        if text == '{':
+            return self.document()
+        if text == '[':
+            return self.array()
+        if kind == 'string':
+            self.pos += 1
+            return _unquote(text)
+        if kind == 'number':
+            self.pos += 1
+            return float(text) if any(c in text for c in '.eE') else int(text)
+        if kind == 'name':
+            self.pos += 1
+            if text == 'true':
+                return True
+            if text == 'false':
+                return False
+            if text == 'null':
+                return None
+            if text == 'new':
+                text = self.name()
+            return self.constructor(text, pos)
+        raise MongoQueryError(f"Unexpected {text!r} at position {pos}")
+
+    def constructor(self, name, pos):
+        self.expect('(')
+        args = [] if self.peek()[1] == ')' else self.arguments()
+        self.expect(')')
+        if name == 'ObjectId' and len(args) == 1:
+            from bson import ObjectId
+            return ObjectId(args[0])
+        if name in ('ISODate', 'Date') and len(args) == 1:
+            return datetime.datetime.fromisoformat(str(args[0]).replace('Z', '+00:00'))
+        if name in ('NumberInt', 'NumberLong') and len(args) == 1:
+            return int(args[0])
+        if name == 'NumberDecimal' and len(args) == 1:
+            from bson.decimal128 import Decimal128
+            return Decimal128(str(args[0]))
+        raise MongoQueryError(f"Unsupported constructor {name}() at position {pos}")
+
+    def document(self):
+        self.expect('{')
+        document = {}
+        while not self.accept('}'):
+            kind, key, pos = self.next()
+            if kind == 'string':
+                key = _unquote(key)
+            elif kind not in ('name', 'number'):
+                raise MongoQueryError(f"Expected a field name at position {pos}, found {key!r}")
+            if key in FORBIDDEN_OPERATORS:
+                raise MongoQueryError(f"Operator {key} is not allowed")
+            self.expect(':')
+            document[key] = self.value()
+            if not self.accept(','):
+                self.expect('}')
+                break
+        return document
+
+    def array(self):
+        self.expect('[')
+        items = []
+        while not self.accept(']'):
+            items.append(self.value())
+            if not self.accept(','):
+                self.expect(']')
+                break
+        return items
+
+    def arguments(self):
+        args = [self.value()]
+        while self.accept(','):
+            if self.peek()[1] == ')':
+                break
+            args.append(self.value())
+        return args
+
+    def call(self):
+        self.expect('(')
+        args = [] if self.peek()[1] == ')' else self.arguments()
+        self.expect(')')
+        return args
+
+    def statement(self):
+        if self.name() != 'db':
+            raise MongoQueryError('Query must start with db.')
+        self.expect('.')
+        collection = self.name()
+        if collection == 'getCollection':
+            args = self.call()
+            if len(args) != 1 or not isinstance(args[0], str):
+                raise MongoQueryError('getCollection() takes one collection name')
+            collection = args[0]
+        self.expect('.')
+        operation = self.name()
+        query = MongoQuery(collection, operation)
+        args = self.call()
+
+        if operation == 'find':
+            if len(args) > 2:
+                raise MongoQueryError('find() takes at most a filter and a projection')
+            query.filter = _document(args[0], 'find() filter') if args else {}
+            query.projection = _projection(args[1]) if len(args) > 1 else None
+        elif operation == 'findOne':
+            query.operation = 'find'
+            query.filter = _document(args[0], 'findOne() filter') if args else {}
+            query.projection = _projection(args[1]) if len(args) > 1 else None
+            query.limit = 1
+        elif operation == 'aggregate':
+            if len(args) != 1 or not isinstance(args[0], list):
+                raise MongoQueryError('aggregate() takes a pipeline array')
+            query.pipeline = [_document(stage, 'Each pipeline stage') for stage in args[0]]
+        elif operation in ('countDocuments', 'count'):
+            query.operation = 'countDocuments'
+            query.filter = _document(args[0], f'{operation}() filter') if args else {}
+        else:
+            raise MongoQueryError(f"Unsupported operation {operation}()")
+
+        while self.accept('.'):
+            modifier = self.name()
+            if query.operation != 'find' or modifier not in CURSOR_MODIFIERS:
+                raise MongoQueryError(f"Unsupported cursor modifier .{modifier}()")
+            args = self.call()
+            if len(args) != 1:
+                raise MongoQueryError(f".{modifier}() takes exactly one argument")
+            if modifier == 'sort':
+                query.sort = list(_document(args[0], '.sort() argument').items())
+                for key, direction in query.sort:
+                    if isinstance(direction, bool) or not (direction in (1, -1) or isinstance(direction, dict)):
+                        raise MongoQueryError(f".sort() direction for {key} must be 1 or -1")
+            elif modifier == 'projection':
+                query.projection = _projection(args[0])
+            else:
+                setattr(query, modifier, _count(args[0], modifier))
+
+        self.accept(';')
+        if self.peek()[0] is not None:
+            raise MongoQueryError(f"Unexpected {self.peek()[1]!r} at position {self.peek()[2]}")
+        for document in [query.filter, query.projection or {}] + query.pipeline:
+            _check_operators(document)
+        return query
+
+
+def _document(value, what):
+    if not isinstance(value, dict):
+        raise MongoQueryError(f"{what} must be a document")
+    return value
+
+
+def _projection(value):
+    return None if value is None else _document(value, 'The projection')
+
+
+def _count(value, modifier):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0 or \
+            isinstance(value, float) and not value.is_integer():
+        raise MongoQueryError(f".{modifier}() takes a non-negative whole number")
+    return int(value)
+
+
+def _check_operators(value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in FORBIDDEN_OPERATORS:
+                raise MongoQueryError(f"Operator {key} is not allowed")
+            _check_operators(item)
+    elif isinstance(value, list):
+        for item in value:
+            _check_operators(item)
+
+
+def parse(text):
+    """Parse a mongo shell statement such as db.students.find({age: {$gt: 15}}, {name: 1}).limit(10)."""
+    return Parser(text.strip()).statement()
+
+
+def open_cursor(db, query, batch_size, max_time_ms=None, comment=None):
+    """Run a parsed query with projection, sort, skip and limit pushed to the server; yields documents.
+
+    comment tags the server-side operation so it can be found in $currentOp (and killed).
+    """
+    collection = db[query.collection]
+    limits = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+    if comment:
+        limits['comment'] = comment
+    if query.operation == 'find':
+        cursor = collection.find(query.filter, query.projection, batch_size=batch_size,
+                                 **({'comment': comment} if comment else {}))
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        if query.skip:
+            cursor = cursor.skip(query.skip)
+        if query.limit:
+            cursor = cursor.limit(query.limit)
+        return cursor
+    if query.operation == 'aggregate':
+        return collection.aggregate(query.pipeline, batchSize=batch_size, **limits)
+    return iter([{'count': collection.count_documents(query.filter, **limits)}])
@@ -0,0 +1,76 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Off unless set: requests slower than this many milliseconds keep their stack samples
+PROFILE_SLOW_REQUEST_MS = float(os.getenv('PROFILE_SLOW_REQUEST_MS', '0'))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.01'))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '20'))
+
+
+def collapse(frame):
+    """Root-first 'file:function' stack, in the collapsed format flame graph tools read."""
+    parts = []
+    while frame is not None:
+        parts.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+class SamplingProfiler:
+    """Samples the stacks of in-flight request threads and keeps the profiles of slow requests."""
+
+    def __init__(self, threshold_ms=PROFILE_SLOW_REQUEST_MS, interval=PROFILE_SAMPLE_INTERVAL, keep=PROFILE_KEEP):
+        self.threshold_ms = threshold_ms
+        self.interval = interval
+        self._active = {}  # thread id -> Counter of collapsed stacks
+        self._profiles = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[collapse(frame)] += 1
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def end(self, request_id, path, elapsed):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or elapsed * 1000 < self.threshold_ms:
+            return None
+        profile = {
+            'request_id': request_id,
+            'path': path,
+            'duration_ms': round(elapsed * 1000, 1),
+            'samples': sum(samples.values()),
+            'stacks': dict(samples.most_common()),
+        }
+        with self._lock:
+            self._profiles.append(profile)
+        hottest = ', '.join(f"{stack.rsplit(';', 1)[-1]} x{count}" for stack, count in samples.most_common(3))
+        logging.warning(f"Profiled slow request {request_id} {path} ({profile['duration_ms']}ms): {hottest}")
+        return profile
+
+    def profiles(self):
+        with self._lock:
+            return list(self._profiles)
@@ -0,0 +1,115 @@
+import logging
+import os
+import re
+
+from drivers import get_driver
+from sql_text import SQL_COMMENT
+
+QUERY_GUARD_MODE = os.getenv('QUERY_GUARD_MODE', 'block')  # block, warn or off
+QUERY_GUARD_MAX_COST = float(os.getenv('QUERY_GUARD_MAX_COST', '1000000'))
+QUERY_GUARD_MAX_ROWS = float(os.getenv('QUERY_GUARD_MAX_ROWS', '10000000'))
+QUERY_GUARD_SQLITE_MAX_SCANS = int(os.getenv('QUERY_GUARD_SQLITE_MAX_SCANS', '2'))
+QUERY_GUARD_DEFAULT_LIMIT = int(os.getenv('QUERY_GUARD_DEFAULT_LIMIT', '100000'))
+
+LIMIT_CLAUSE = re.compile(r'\b(limit\s+\d+|fetch\s+(first|next)\s+\d*\s*rows?\s+only|top\s*\(?\s*\d+)', re.IGNORECASE)
+
+
+class QueryBlockedError(Exception):
+    """Raised when the estimated cost of a query is above the configured thresholds."""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+def _blank(match):
+    return ' ' * len(match.group())
+
+
+def _top_level(query):
+    """Query text with literals, comments and parenthesised sub-expressions blanked; offsets are unchanged."""
+    text = SQL_COMMENT.sub(_blank, query)
+    previous = None
+    while previous != text:
+        previous = text
+        text = re.sub(r'\([^()]*\)', _blank, text)
+    return text
+
+
+def strip_trailing_comments(query):
+    """Query without the comments after its last statement token, which would swallow an appended clause."""
+    end = len(query)
+    for match in reversed(list(SQL_COMMENT.finditer(query))):
+        if match.group(1) is not None or query[match.end():end].strip(' \t\r\n;'):
+            break
+        end = match.start()
+    return query[:end]
+
+
+def is_guardable(query):
+    head = query.lstrip().split(None, 1)
+    return bool(head) and head[0].lower() in ('select', 'with')
+
+
+def inject_limit(query, limit):
+    """Add a LIMIT to a SELECT without a top-level row limit; returns (query, injected)."""
+    if not limit or not is_guardable(query):
+        return query, False
+    top = _top_level(query).lower()
+    if LIMIT_CLAUSE.search(top) or re.search(r'\bfor\s+(update|share)\b|\binto\b', top):
+        return query, False
+    query = strip_trailing_comments(query).strip().rstrip(';').rstrip()
+    # LIMIT has to come before OFFSET in SQLite and MySQL
+    offset = list(re.finditer(r'\boffset\b', _top_level(query).lower()))
+    if offset:
+        start = offset[-1].start()
+        return f"{query[:start].rstrip()} LIMIT {int(limit)} {query[start:]}", True
+    return f"{query} LIMIT {int(limit)}", True
+
+
+def evaluate(summary, max_cost=QUERY_GUARD_MAX_COST, max_rows=QUERY_GUARD_MAX_ROWS,
+             max_scans=QUERY_GUARD_SQLITE_MAX_SCANS):
+    """Return the list of threshold violations for an EXPLAIN summary."""
+    violations = []
+    if summary['cost'] is not None and summary['cost'] > max_cost:
+        violations.append(f"estimated cost {summary['cost']:.0f} exceeds {max_cost:.0f}")
+    if summary['rows'] is not None and summary['rows'] > max_rows:
+        violations.append(f"estimated rows {summary['rows']:.0f} exceed {max_rows:.0f}")
+    if summary['cost'] is None and summary['rows'] is None and len(summary['full_scans']) > max_scans:
+        # Without a cost model (SQLite), several unindexed scans in one plan is the cross-join shape
+        violations.append(f"{len(summary['full_scans'])} full table scans in one plan")
+    return violations
+
+
+def guard_query(conn, db_type, query, mode=QUERY_GUARD_MODE, default_limit=QUERY_GUARD_DEFAULT_LIMIT):
+    """EXPLAIN a SELECT, block or warn on expensive plans and bound unbounded results.
+
+    Returns (query to run, report). Raises QueryBlockedError in block mode.
+    """
+    report = {'mode': mode, 'warnings': [], 'limit_injected': None}
+    if mode == 'off' or not is_guardable(query):
+        return query, report
+
+    guarded, injected = inject_limit(query, default_limit)
+    if injected:
+        report['limit_injected'] = default_limit
+
+    try:
+        summary = get_driver(db_type).explain(conn, guarded)
+    except Exception as e:
+        # The statement will fail the same way when executed; let that produce the user-facing error
+        logging.warning(f"EXPLAIN failed for {db_type} query: {e}")
+        conn.rollback()
+        return guarded, report
+    if summary is None:
+        return guarded, report
+
+    report.update({'cost': summary['cost'], 'rows': summary['rows'], 'full_scans': summary['full_scans']})
+    violations = evaluate(summary)
+    if violations:
+        report['plan'] = summary['plan']
+        if mode == 'block':
+            raise QueryBlockedError(f"Query blocked: {'; '.join(violations)}", report)
+        report['warnings'].extend(violations)
+        logging.warning(f"Expensive {db_type} query allowed in warn mode: {'; '.join(violations)}")
+    return guarded, report
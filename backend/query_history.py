@@ -0,0 +1,292 @@
+import hashlib
+import logging
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from drivers import DRIVERS
+from result_cache import RESULT_CACHE_ENTRY_MAX_BYTES
+from sql_text import STRING_LITERAL, normalize_sql
+
+QUERY_HISTORY_MODE = os.getenv('QUERY_HISTORY_MODE', 'on')  # on or off
+QUERY_HISTORY_PATH = os.getenv(
+    'QUERY_HISTORY_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_history.sqlite3'))
+QUERY_HISTORY_QUEUE_MAX = int(os.getenv('QUERY_HISTORY_QUEUE_MAX', '10000'))
+QUERY_HISTORY_BATCH_SIZE = int(os.getenv('QUERY_HISTORY_BATCH_SIZE', '500'))
+QUERY_HISTORY_FLUSH_INTERVAL = float(os.getenv('QUERY_HISTORY_FLUSH_INTERVAL', '1.0'))
+QUERY_HISTORY_RETENTION_DAYS = float(os.getenv('QUERY_HISTORY_RETENTION_DAYS', '30'))
+# Reports only look this far back, so they stay cheap as the history grows
+QUERY_HISTORY_REPORT_WINDOW = float(os.getenv('QUERY_HISTORY_REPORT_WINDOW', str(7 * 24 * 3600)))
+CACHE_CANDIDATE_MIN_RUNS = int(os.getenv('CACHE_CANDIDATE_MIN_RUNS', '3'))
+CACHE_CANDIDATE_MIN_MS = float(os.getenv('CACHE_CANDIDATE_MIN_MS', '100'))
+
+NUMBER_LITERAL = re.compile(r'(?<![\w$.])-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\b')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+COLUMNS = ('entry_id', 'recorded_at', 'kind', 'translation_id', 'db_type', 'message', 'query', 'query_hash',
+           'fingerprint', 'fingerprint_hash', 'path', 'cached', 'llm_ms', 'exec_ms', 'rows', 'bytes', 'error')
+
+
+def fingerprint(query):
+    """Query shape with literals replaced by ?, so runs that differ only in their values group together."""
+    text = STRING_LITERAL.sub(lambda m: m.group() if m.group()[0] in '`"' else '?', normalize_sql(query))
+    text = NUMBER_LITERAL.sub('?', text)
+    text = VALUE_LIST.sub('(?+)', text)
+    return re.sub(r'\s+', ' ', text).lower()
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class QueryHistory:
+    """Append-only record of translated and executed queries, written by a background thread.
+
+    Callers only enqueue; a full queue drops the entry rather than slowing the request down.
+    """
+
+    def __init__(self, path=QUERY_HISTORY_PATH, queue_max=QUERY_HISTORY_QUEUE_MAX,
+                 batch_size=QUERY_HISTORY_BATCH_SIZE, flush_interval=QUERY_HISTORY_FLUSH_INTERVAL,
+                 retention_days=QUERY_HISTORY_RETENTION_DAYS, enabled=QUERY_HISTORY_MODE == 'on'):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention_days * 24 * 3600
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._lock = threading.Lock()
+        self._counters = {'recorded': 0, 'written': 0, 'dropped': 0, 'write_errors': 0}
+        self._thread = None
+        self._stop = threading.Event()
+        self._disk = None
+        if not enabled:
+            return
+        try:
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY, entry_id TEXT NOT NULL, recorded_at REAL NOT NULL, kind TEXT NOT NULL, "
+                "translation_id TEXT, db_type TEXT, message TEXT, query TEXT, query_hash TEXT, fingerprint TEXT, "
+                "fingerprint_hash TEXT, path TEXT, cached INTEGER NOT NULL DEFAULT 0, llm_ms REAL, exec_ms REAL, "
+                "rows INTEGER, bytes INTEGER, error TEXT)")
+            self._disk.execute("CREATE INDEX IF NOT EXISTS history_recorded_at ON history (recorded_at)")
+            self._disk.execute("CREATE INDEX IF NOT EXISTS history_entry_id ON history (entry_id)")
+            self._disk.execute(
+                "CREATE INDEX IF NOT EXISTS history_fingerprint ON history (kind, fingerprint_hash, exec_ms)")
+            self._disk.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Query history disabled, could not open {path}: {e}")
+            self._disk = None
+
+    @property
+    def enabled(self):
+        return self._disk is not None
+
+    def start(self):
+        if self._disk is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._write_loop, name='query-history', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _enqueue(self, entry):
+        if self._disk is None:
+            return
+        try:
+            self._queue.put_nowait(entry)
+            counter = 'recorded'
+        except queue.Full:
+            counter = 'dropped'
+        with self._lock:
+            self._counters[counter] += 1
+
+    def record_translation(self, message, db_type, query, path, llm_ms=None, error=None):
+        """Queue a translated message; returns the entry id executions can refer back to."""
+        entry_id = uuid.uuid4().hex
+        self._enqueue({'entry_id': entry_id, 'recorded_at': time.time(), 'kind': 'translate', 'db_type': db_type,
+                       'message': message, 'query': query, 'path': path, 'llm_ms': llm_ms, 'error': error})
+        return entry_id
+
+    def record_execution(self, db_type, query, exec_ms=None, rows=None, bytes_returned=None, cached=False,
+                         translation_id=None, error=None):
+        self._enqueue({'entry_id': uuid.uuid4().hex, 'recorded_at': time.time(), 'kind': 'execute',
+                       'translation_id': translation_id, 'db_type': db_type, 'query': query, 'cached': cached,
+                       'exec_ms': exec_ms, 'rows': rows, 'bytes': bytes_returned, 'error': error})
+
+    def _write_loop(self):
+        last_prune = 0.0
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if time.time() - last_prune > 3600:
+                last_prune = time.time()
+                self._prune()
+
+    def _write(self, batch):
+        rows = []
+        for entry in batch:
+            query = entry.get('query')
+            if query and entry['db_type'] != 'mongodb':
+                shape = fingerprint(query)
+                entry.update(query_hash=_hash(normalize_sql(query)), fingerprint=shape, fingerprint_hash=_hash(shape))
+            elif query:
+                # Mongo shell text has no literal syntax worth normalizing; the exact text is its own shape
+                entry.update(query_hash=_hash(query), fingerprint=query, fingerprint_hash=_hash(query))
+            entry['cached'] = 1 if entry.get('cached') else 0
+            rows.append(tuple(entry.get(column) for column in COLUMNS))
+        try:
+            with self._lock:
+                self._disk.executemany(
+                    f"INSERT INTO history ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+                self._disk.commit()
+                self._counters['written'] += len(rows)
+        except sqlite3.Error as e:
+            logging.error(f"Could not write {len(rows)} query history entries: {e}")
+            with self._lock:
+                self._counters['write_errors'] += 1
+
+    def _prune(self):
+        if not self.retention:
+            return
+        try:
+            with self._lock:
+                removed = self._disk.execute("DELETE FROM history WHERE recorded_at < ?",
+                                             (time.time() - self.retention,)).rowcount
+                self._disk.commit()
+            if removed:
+                logging.info(f"Pruned {removed} query history entries older than the retention period")
+        except sqlite3.Error as e:
+            logging.warning(f"Query history pruning failed: {e}")
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far is written; reports call this so they include recent runs."""
+        deadline = time.monotonic() + timeout
+        # unfinished_tasks also counts the batch being written, which empty() does not see
+        while self._queue.unfinished_tasks and time.monotonic() < deadline and self._thread is not None:
+            time.sleep(0.01)
+
+    def _select(self, sql, params=()):
+        if self._disk is None:
+            return []
+        with self._lock:
+            return self._disk.execute(sql, params).fetchall()
+
+    def _window(self, since):
+        return since if since is not None else time.time() - QUERY_HISTORY_REPORT_WINDOW
+
+    def slowest(self, limit=20, since=None, db_type=None):
+        """The slowest executions in the window, with the question that produced them when known."""
+        self.flush()
+        rows = self._select(
+            "SELECT e.recorded_at, e.db_type, e.query, e.fingerprint_hash, e.exec_ms, e.rows, e.bytes, e.error, "
+            "t.message, t.llm_ms, t.path FROM history e "
+            "LEFT JOIN history t ON t.entry_id = e.translation_id AND t.kind = 'translate' "
+            "WHERE e.kind = 'execute' AND e.cached = 0 AND e.exec_ms IS NOT NULL AND e.recorded_at >= ? "
+            "AND (? IS NULL OR e.db_type = ?) ORDER BY e.exec_ms DESC LIMIT ?",
+            (self._window(since), db_type, db_type, limit))
+        keys = ('recorded_at', 'db_type', 'query', 'fingerprint', 'exec_ms', 'rows', 'bytes', 'error',
+                'message', 'llm_ms', 'path')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def _executions_by_shape(self, group_column, since, db_type):
+        """Yield (key, sample row, sorted latencies, rows, bytes) per group of uncached, successful runs."""
+        rows = self._select(
+            f"SELECT {group_column}, db_type, query, fingerprint, exec_ms, rows, bytes FROM history "
+            f"WHERE kind = 'execute' AND cached = 0 AND error IS NULL AND exec_ms IS NOT NULL AND recorded_at >= ? "
+            f"AND (? IS NULL OR db_type = ?) ORDER BY {group_column}, exec_ms",
+            (self._window(since), db_type, db_type))
+        group = []
+        for row in rows + [(None,)]:
+            if group and row[0] != group[0][0]:
+                yield (group[0][0], group[-1], [r[4] for r in group],
+                       [r[5] for r in group if r[5] is not None], [r[6] for r in group if r[6] is not None])
+                group = []
+            if row[0] is not None:
+                group.append(row)
+
+    def fingerprints(self, limit=20, since=None, db_type=None, min_count=1):
+        """Latency percentiles per query fingerprint, ordered by the total time spent on it."""
+        self.flush()
+        report = []
+        for key, sample, latencies, rows, sizes in self._executions_by_shape('fingerprint_hash', since, db_type):
+            if len(latencies) < min_count:
+                continue
+            report.append({
+                'fingerprint': key,
+                'db_type': sample[1],
+                'shape': sample[3],
+                'example': sample[2],
+                'count': len(latencies),
+                'total_ms': round(sum(latencies), 3),
+                'p50_ms': percentile(latencies, 0.5),
+                'p90_ms': percentile(latencies, 0.9),
+                'p99_ms': percentile(latencies, 0.99),
+                'max_ms': latencies[-1],
+                'avg_rows': sum(rows) / len(rows) if rows else None,
+                'avg_bytes': sum(sizes) / len(sizes) if sizes else None,
+            })
+        report.sort(key=lambda item: item['total_ms'], reverse=True)
+        return report[:limit]
+
+    def cache_candidates(self, limit=20, since=None, db_type=None, min_runs=CACHE_CANDIDATE_MIN_RUNS,
+                         min_ms=CACHE_CANDIDATE_MIN_MS, max_bytes=RESULT_CACHE_ENTRY_MAX_BYTES):
+        """Exact queries that keep being re-run, are slow, read-only and small enough for the result cache.
+
+        Ranked by the execution time caching would have saved: every run but one would have been a hit.
+        """
+        self.flush()
+        candidates = []
+        for key, sample, latencies, rows, sizes in self._executions_by_shape('query_hash', since, db_type):
+            query = sample[2]
+            median = percentile(latencies, 0.5)
+            driver = DRIVERS.get(sample[1])
+            if len(latencies) < min_runs or median < min_ms or driver is None or not driver.is_cacheable(query):
+                continue
+            largest = max(sizes) if sizes else None
+            if largest is not None and largest > max_bytes:
+                continue
+            candidates.append({
+                'query': query,
+                'db_type': sample[1],
+                'fingerprint': _hash(sample[3]) if sample[3] else None,
+                'runs': len(latencies),
+                'p50_ms': median,
+                'max_bytes': largest,
+                'saved_ms': round(sum(latencies) - latencies[0], 3),
+            })
+        candidates.sort(key=lambda item: item['saved_ms'], reverse=True)
+        return candidates[:limit]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['enabled'] = self.enabled
+        stats['queued'] = self._queue.qsize()
+        stats['path'] = self.path
+        return stats
@@ -0,0 +1,240 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from drivers import get_driver
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_PER_USER_LIMIT = int(os.getenv('JOB_PER_USER_LIMIT', '2'))
+JOB_QUEUE_MAX = int(os.getenv('JOB_QUEUE_MAX', '64'))
+JOB_MAX_ROWS = int(os.getenv('JOB_MAX_ROWS', '100000'))
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '900'))
+# Jobs exist for long queries, so they get a longer statement timeout than interactive requests
+JOB_STATEMENT_TIMEOUT_MS = int(os.getenv('JOB_STATEMENT_TIMEOUT_MS', str(30 * 60 * 1000)))
+# Expensive plans are what jobs are for, so by default the cost guard only warns
+JOB_GUARD_MODE = os.getenv('JOB_GUARD_MODE', 'warn')
+
+ACTIVE_STATES = ('queued', 'running')
+
+
+class JobLimitError(Exception):
+    """Raised when a submit would exceed the per-user or global job limits."""
+
+
+class QueryJob:
+    def __init__(self, owner, pool, db_type, query, export=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.pool = pool
+        self.db_type = db_type
+        self.query = query
+        self.export = export  # ResultExport that receives the rows instead of self.rows
+        self.state = 'queued'
+        self.error = None
+        self.columns = []
+        self.rows = []
+        self.row_count = 0
+        self.truncated = False
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.future = None
+        self.conn = None
+        self.backend_id = None  # Postgres backend pid or MySQL connection id, for cancellation
+        self.tag = f"dbchat-job:{self.id}"  # Mongo operation comment, for killOp
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        info = {
+            'id': self.id,
+            'db_type': self.db_type,
+            'query': self.query,
+            'state': self.state,
+            'error': self.error,
+            'columns': self.columns,
+            'rows_fetched': self.row_count,
+            'truncated': self.truncated,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed': round(end - self.started_at, 3) if self.started_at else None,
+        }
+        if self.export is not None:
+            info['export'] = self.export.to_dict()
+        return info
+
+
+def abort_query(job):
+    """Stop the statement a running job is executing, using the engine's own cancellation."""
+    get_driver(job.db_type).cancel(job.pool, job.conn, job.backend_id, job.tag)
+
+
+class QueryJobManager:
+    """Runs queries in the background on a bounded executor, with per-owner concurrency limits.
+
+    Jobs, their rows and their running statements live in the process that accepted them, so a job can only
+    be polled, fetched or cancelled through that process. Serve /api/jobs and /api/export from a single worker
+    process (threads are fine), or pin each session to one worker.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, per_owner=JOB_PER_USER_LIMIT, queue_max=JOB_QUEUE_MAX,
+                 max_rows=JOB_MAX_ROWS, ttl=JOB_RESULT_TTL, timeout_ms=JOB_STATEMENT_TIMEOUT_MS, on_finish=None):
+        self.per_owner = per_owner
+        self.queue_max = queue_max
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.timeout_ms = timeout_ms
+        self.on_finish = on_finish
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner, pool, db_type, query, export=None):
+        self.expire()
+        job = QueryJob(owner, pool, db_type, query, export)
+        with self._lock:
+            active = [j for j in self._jobs.values() if j.state in ACTIVE_STATES]
+            if sum(1 for j in active if j.owner == owner) >= self.per_owner:
+                raise JobLimitError(f"At most {self.per_owner} running or queued jobs per user")
+            if len(active) >= self.queue_max:
+                raise JobLimitError('Too many jobs queued; try again later')
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job)
+        logging.info(f"Submitted {db_type} query job {job.id}")
+        return job
+
+    def _run(self, job):
+        with self._lock:
+            if job.cancel_requested:
+                return
+            job.state = 'running'
+            job.started_at = time.time()
+
+        pool, driver = job.pool, get_driver(job.db_type)
+        try:
+            conn = pool.acquire()
+        except Exception as e:
+            self._finish(job, 'failed', str(e))
+            return
+        broken = False
+        cursor = None
+        try:
+            job.backend_id = driver.backend_id(conn)
+            job.conn = conn
+            driver.configure_session(conn, self.timeout_ms)
+            if job.cancel_requested:
+                raise InterruptedError('cancelled before start')
+            cursor = driver.execute(conn, job.query, timeout_ms=self.timeout_ms, comment=job.tag)
+            job.columns = cursor.columns
+            if job.export is not None:
+                job.export.open(cursor.columns)
+            for rows in cursor:
+                if job.cancel_requested:
+                    break
+                if job.export is not None:
+                    # Exports stream every batch to disk, so the in-memory row cap does not apply
+                    job.export.write(rows)
+                    job.row_count += len(rows)
+                    continue
+                room = self.max_rows - len(job.rows)
+                job.rows.extend(rows[:room])
+                job.row_count += len(rows)
+                if len(rows) > room:
+                    job.truncated = True
+                    break
+            if driver.writes(job.query) and not job.cancel_requested:
+                conn.commit()
+            if job.export is not None and not job.cancel_requested:
+                job.export.close()
+            state, error = ('cancelled', None) if job.cancel_requested else ('succeeded', None)
+        except Exception as e:
+            state, error = ('cancelled', None) if job.cancel_requested else ('failed', str(e))
+            if state == 'failed':
+                logging.error(f"Query job {job.id} failed: {e}")
+        finally:
+            if cursor is not None:
+                cursor.close()
+                broken = not cursor.reusable
+            job.conn = None
+            if not broken:
+                try:
+                    driver.reset_session(conn)
+                except Exception:
+                    broken = True
+            pool.release(conn, broken=broken)
+
+        if job.export is not None and state != 'succeeded':
+            job.export.discard()
+        self._finish(job, state, error)
+        if self.on_finish is not None and state == 'succeeded':
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                logging.error(f"Error in query job completion hook: {e}")
+
+    def _finish(self, job, state, error):
+        with self._lock:
+            job.state = state
+            job.error = error
+            job.finished_at = time.time()
+        logging.info(f"Query job {job.id} {state} after {job.finished_at - job.started_at:.2f}s, "
+                     f"{job.row_count} rows")
+
+    def get(self, job_id, owner):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+
+    def list(self, owner):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.owner == owner]
+
+    def cancel(self, job_id, owner):
+        """Request cancellation; returns the job, or None when it does not exist for this owner."""
+        job = self.get(job_id, owner)
+        if job is None:
+            return None
+        with self._lock:
+            if job.state not in ACTIVE_STATES or job.cancel_requested:
+                return job
+            job.cancel_requested = True
+            if job.state == 'queued':
+                job.state = 'cancelled'
+                job.finished_at = time.time()
+                if job.future is not None:
+                    job.future.cancel()
+                return job
+        try:
+            abort_query(job)
+            logging.info(f"Cancelled running {job.db_type} query job {job.id}")
+        except Exception as e:
+            logging.error(f"Error cancelling query job {job.id}: {e}")
+        return job
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            removed = [self._jobs.pop(job_id) for job_id in expired]
+        for job in removed:
+            if job.export is not None:
+                job.export.discard()
+        return len(removed)
+
+    def cancel_for_pool(self, pool):
+        with self._lock:
+            owned = [job for job in self._jobs.values() if job.pool is pool and job.state in ACTIVE_STATES]
+        for job in owned:
+            self.cancel(job.id, job.owner)
+
+    def stats(self):
+        with self._lock:
+            stats = {'jobs': len(self._jobs)}
+            for job in self._jobs.values():
+                stats[job.state] = stats.get(job.state, 0) + 1
+        return stats
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from sql_text import STRING_LITERAL, normalize_sql
+
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', '60'))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RESULT_CACHE_ENTRY_MAX_BYTES = int(os.getenv('RESULT_CACHE_ENTRY_MAX_BYTES', str(1024 * 1024)))
+
+IDENTIFIER = r'[`"\[]?([A-Za-z_][\w$]*)[`"\]]?(?:\s*\.\s*[`"\[]?([A-Za-z_][\w$]*)[`"\]]?)?'
+READ_TABLES = re.compile(r'\b(?:from|join)\s+' + IDENTIFIER, re.IGNORECASE)
+WRITE_TABLES = re.compile(
+    r'\b(?:insert\s+(?:ignore\s+)?into|replace\s+into|update|delete\s+from|truncate(?:\s+table)?|'
+    r'(?:create|alter|drop)\s+(?:temporary\s+|unique\s+)?(?:table|view|index\s+\w+\s+on)(?:\s+if\s+(?:not\s+)?exists)?|'
+    r'rename\s+table)\s+' + IDENTIFIER,
+    re.IGNORECASE)
+WRITE_KEYWORDS = re.compile(
+    r'\b(insert|update|delete|merge|replace|create|alter|drop|truncate|rename|grant|revoke|call|lock)\b',
+    re.IGNORECASE)
+VOLATILE_FUNCTIONS = re.compile(
+    r'\b(now|random|rand|uuid|gen_random_uuid|current_timestamp|current_date|current_time|sysdate|'
+    r'localtimestamp|nextval|last_insert_id|changes)\b',
+    re.IGNORECASE)
+
+
+def _outside_literals(query):
+    return STRING_LITERAL.sub("''", query)
+
+
+def _table_names(pattern, query):
+    # For schema-qualified names keep only the table part
+    return {(match.group(2) or match.group(1)).lower() for match in pattern.finditer(_outside_literals(query))}
+
+
+def read_tables(query):
+    return _table_names(READ_TABLES, query)
+
+
+def written_tables(query):
+    """Tables a DML or DDL statement modifies; None when the statement writes but no target is recognisable."""
+    tables = _table_names(WRITE_TABLES, query)
+    if tables:
+        return tables
+    return None if WRITE_KEYWORDS.search(_outside_literals(query)) else set()
+
+
+def is_cacheable(query):
+    stripped = _outside_literals(query)
+    head = stripped.lstrip().split(None, 1)
+    if not head or head[0].lower() not in ('select', 'with'):
+        return False
+    return not WRITE_KEYWORDS.search(stripped) and not VOLATILE_FUNCTIONS.search(stripped)
+
+
+class ResultCache:
+    """LRU cache of small query results, invalidated per table when writes go through execute_query."""
+
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_bytes=RESULT_CACHE_MAX_BYTES,
+                 entry_max_bytes=RESULT_CACHE_ENTRY_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entry_max_bytes = entry_max_bytes
+        self._entries = OrderedDict()  # key -> (columns, rows, size, expires_at, tables)
+        self._by_table = defaultdict(set)  # (database_id, table) -> keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'rejected': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(db_type, database_id, query, user=None):
+        """Sessions on the same database share entries only when they log in as the same user."""
+        return (db_type, database_id, normalize_sql(query), user)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[3] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[0], entry[1]
+
+    def put(self, key, columns, rows):
+        size = len(json.dumps([columns, rows], default=str))
+        if size > self.entry_max_bytes:
+            with self._lock:
+                self._counters['rejected'] += 1
+            return False
+        tables = read_tables(key[2])
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (columns, rows, size, time.monotonic() + self.ttl, tables)
+            self._bytes += size
+            for table in tables:
+                self._by_table[(key[1], table)].add(key)
+            self._counters['stores'] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+        return True
+
+    def _drop(self, key):
+        columns, rows, size, expires_at, tables = self._entries.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._by_table.get((key[1], table))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[(key[1], table)]
+
+    def invalidate_tables(self, database_id, tables):
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys |= self._by_table.get((database_id, table.lower()), set())
+            for key in keys:
+                self._drop(key)
+            self._counters['invalidations'] += len(keys)
+        if keys:
+            logging.info(f"Invalidated {len(keys)} cached result(s) for tables {sorted(tables)}")
+        return len(keys)
+
+    def invalidate_database(self, database_id):
+        with self._lock:
+            keys = [key for key in self._entries if key[1] == database_id]
+            for key in keys:
+                self._drop(key)
+            self._counters['invalidations'] += len(keys)
+        return len(keys)
+
+    def invalidate_for_statement(self, database_id, query):
+        """Invalidate whatever a statement may have modified; unrecognised writes flush the database."""
+        tables = written_tables(query)
+        if tables is None:
+            return self.invalidate_database(database_id)
+        return self.invalidate_tables(database_id, tables) if tables else 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes})
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
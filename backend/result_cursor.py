@@ -0,0 +1,143 @@
+import itertools
+import os
+import uuid
+
+import mongo_query
+
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '1000'))
+STATEMENT_TIMEOUT_MS = int(os.getenv('STATEMENT_TIMEOUT_MS', '30000'))
+
+
+def is_row_returning(query):
+    """Cheap check for statements that can be run through a server-side cursor."""
+    head = query.lstrip().split(None, 1)
+    return bool(head) and head[0].lower() in ('select', 'with', 'values', 'table')
+
+
+class ResultCursor:
+    """Uniform, incremental access to a query result over a DB-API connection.
+
+    Engines with their own way of executing or fetching subclass it; Driver.execute picks the class.
+    """
+
+    def __init__(self, conn, query, batch_size=STREAM_BATCH_SIZE, timeout_ms=STATEMENT_TIMEOUT_MS, comment=None):
+        self.conn = conn
+        self.query = query
+        self.batch_size = batch_size
+        # Postgres and MySQL take their timeout from the session; SQLite and Mongo per statement
+        self.timeout_ms = timeout_ms
+        self.comment = comment
+        self.columns = []
+        self.row_count = 0
+        self._cursor = None
+        self._exhausted = False
+        self.reusable = True
+        self._open()
+
+    def _open(self):
+        self._execute()
+        if self._cursor.description is None:
+            self._exhausted = True
+        else:
+            self.columns = [desc[0] for desc in self._cursor.description]
+
+    def _execute(self):
+        self._cursor = self.conn.cursor()
+        self._cursor.execute(self.query)
+
+    def _fetch(self, size):
+        return [list(row) for row in self._cursor.fetchmany(size)]
+
+    def fetch(self, size=None):
+        """Return up to size rows as lists; an empty list means the result is exhausted."""
+        size = size or self.batch_size
+        if self._exhausted:
+            return []
+        rows = self._fetch(size)
+        if len(rows) < size:
+            self._exhausted = True
+        self.row_count += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetch()
+            if not rows:
+                return
+            yield rows
+
+    def close(self):
+        if self._cursor is None:
+            return
+        try:
+            if hasattr(self._cursor, 'close'):
+                self._cursor.close()
+        except Exception:
+            self.reusable = False
+        finally:
+            self._cursor = None
+
+
+class PostgresResultCursor(ResultCursor):
+    def _execute(self):
+        if is_row_returning(self.query):
+            # Named cursors live on the server, so rows are only transferred on fetch
+            self._cursor = self.conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+            self._cursor.itersize = self.batch_size
+        else:
+            self._cursor = self.conn.cursor()
+        self._cursor.execute(self.query)
+
+
+class MySQLResultCursor(ResultCursor):
+    def _execute(self):
+        # mysql.connector cursors are unbuffered by default and read rows off the socket lazily
+        self._cursor = self.conn.cursor(buffered=False)
+        self._cursor.execute(self.query)
+
+    def close(self):
+        if self._cursor is not None and not self._exhausted:
+            # Unread rows are still on the socket; dropping the connection is cheaper than draining them
+            self.reusable = False
+        super().close()
+
+
+class SQLiteResultCursor(ResultCursor):
+    def _execute(self):
+        self._cursor = self.conn.cursor()
+        self._cursor.arraysize = self.batch_size
+        self._timed(self._cursor.execute, self.query)
+
+    def _fetch(self, size):
+        return [list(row) for row in self._timed(self._cursor.fetchmany, size)]
+
+    def _timed(self, func, *args):
+        # SQLite has no server-side timeout, so each step runs under the connection's own deadline
+        if not hasattr(self.conn, 'arm'):
+            return func(*args)
+        self.conn.arm(self.timeout_ms)
+        try:
+            return func(*args)
+        finally:
+            self.conn.disarm()
+
+
+class MongoResultCursor(ResultCursor):
+    def _open(self):
+        # Callers that build pipelines themselves pass a MongoQuery instead of shell text
+        parsed = self.query if isinstance(self.query, mongo_query.MongoQuery) else mongo_query.parse(self.query)
+        self._cursor = mongo_query.open_cursor(
+            self.conn.get_database(), parsed, self.batch_size, max_time_ms=self.timeout_ms, comment=self.comment)
+        first = next(self._cursor, None)
+        if first is None:
+            self._exhausted = True
+            self.columns = parsed.columns_hint() or []
+            self._pending = []
+        else:
+            self.columns = parsed.columns_hint() or list(first.keys())
+            self._pending = [first]
+
+    def _fetch(self, size):
+        docs = self._pending + list(itertools.islice(self._cursor, size - len(self._pending)))
+        self._pending = []
+        return [[doc.get(col) for col in self.columns] for doc in docs]
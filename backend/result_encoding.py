@@ -0,0 +1,126 @@
+import datetime
+import decimal
+import gzip
+import io
+import os
+import uuid
+
+RESULT_GZIP_MIN_BYTES = int(os.getenv('RESULT_GZIP_MIN_BYTES', str(64 * 1024)))
+
+RESULT_FORMATS = ('rows', 'columnar', 'arrow')
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+ARROW_COMPRESSIONS = ('lz4', 'zstd')
+
+
+class EncodingError(Exception):
+    """Raised when a requested format or compression cannot be produced."""
+
+
+def convert_value(value):
+    """Make a single arbitrary driver value JSON-friendly (used for nested and mixed-type cells)."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, dict):
+        return {key: convert_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [convert_value(item) for item in value]
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    # ObjectId, UUID and other driver types
+    return str(value)
+
+
+def _column_converter(values):
+    """Pick one conversion for a whole column from its first non-null value."""
+    sample = next((value for value in values if value is not None), None)
+    if sample is None or isinstance(sample, (str, bool, int, float)):
+        kinds = {type(value) for value in values if value is not None}
+        if len(kinds) <= 1:
+            return None
+    elif isinstance(sample, decimal.Decimal):
+        return float
+    elif isinstance(sample, (datetime.date, datetime.time)):
+        return lambda value: value.isoformat()
+    elif isinstance(sample, uuid.UUID):
+        return str
+    return convert_value
+
+
+def convert_column(values):
+    convert = _column_converter(values)
+    if convert is None:
+        return list(values)
+    return [None if value is None else convert(value) for value in values]
+
+
+def to_columns(rows, width):
+    """Transpose rows into one list per column."""
+    if not rows:
+        return [[] for _ in range(width)]
+    return [list(column) for column in zip(*rows)]
+
+
+def convert_rows(rows, width):
+    """Per-column bulk conversion, returned in row-major form."""
+    if not rows:
+        return []
+    columns = [convert_column(column) for column in to_columns(rows, width)]
+    return [list(row) for row in zip(*columns)]
+
+
+def encode_arrow(columns, rows, metadata=None, compression=None):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise EncodingError('Arrow output requires the pyarrow package')
+    if compression and compression not in ARROW_COMPRESSIONS:
+        raise EncodingError(f"Unsupported Arrow compression: {compression}")
+
+    names = [str(name) for name in columns]
+    arrays = []
+    for values in to_columns(rows, len(names)):
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed-type or driver-specific columns are shipped as text
+            arrays.append(pa.array([None if value is None else str(convert_value(value)) for value in values]))
+    schema_metadata = {str(key): str(value) for key, value in (metadata or {}).items() if value is not None}
+    table = pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(schema_metadata)
+
+    sink = io.BytesIO()
+    options = pa.ipc.IpcWriteOptions(compression=compression) if compression else None
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def negotiate_format(requested, accept_header, compression=None):
+    """Pick the output format from the request and check it can be produced before any query runs."""
+    if requested and requested not in RESULT_FORMATS:
+        raise EncodingError(f"Unsupported result format: {requested}")
+    result_format = requested or ('arrow' if accept_header and ARROW_MIMETYPE in accept_header else 'rows')
+    if result_format == 'arrow':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise EncodingError('Arrow output requires the pyarrow package')
+        if compression and compression not in ARROW_COMPRESSIONS:
+            raise EncodingError(f"Unsupported Arrow compression: {compression}")
+    elif compression not in (None, 'gzip', 'none'):
+        raise EncodingError(f"Unsupported JSON compression: {compression}")
+    return result_format
+
+
+def maybe_gzip(body, compression, accept_encoding):
+    """Gzip a JSON body when asked to, or when it is large and the client accepts gzip."""
+    if compression not in (None, 'gzip', 'none'):
+        raise EncodingError(f"Unsupported JSON compression: {compression}")
+    if compression == 'none':
+        return body, None
+    if compression == 'gzip' or (len(body) >= RESULT_GZIP_MIN_BYTES and 'gzip' in (accept_encoding or '')):
+        return gzip.compress(body, compresslevel=5), 'gzip'
+    return body, None
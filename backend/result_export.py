@@ -0,0 +1,195 @@
+import csv
+import datetime
+import decimal
+import gzip
+import json
+import logging
+import os
+import uuid
+
+from result_encoding import EncodingError, convert_value, to_columns
+
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports'))
+# Rows buffered per Parquet row group; the only part of an export held in memory
+EXPORT_ROW_GROUP_SIZE = int(os.getenv('EXPORT_ROW_GROUP_SIZE', '50000'))
+
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_COMPRESSIONS = {
+    'csv': (None, 'none', 'gzip'),
+    'parquet': (None, 'none', 'snappy', 'gzip', 'zstd', 'lz4', 'brotli'),
+}
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def check_export_format(export_format, compression=None):
+    """Validate the requested format before a job is queued, including the pyarrow dependency for Parquet."""
+    if export_format not in EXPORT_FORMATS:
+        raise EncodingError(f"Unsupported export format: {export_format}")
+    if compression not in EXPORT_COMPRESSIONS[export_format]:
+        raise EncodingError(f"Unsupported {export_format} compression: {compression}")
+    if export_format == 'parquet':
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise EncodingError('Parquet export requires the pyarrow package')
+
+
+def csv_value(value):
+    """Render one cell for CSV without the lossy float conversion used for JSON."""
+    if value is None:
+        return ''
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(convert_value(value))
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return value
+
+
+class _CsvWriter:
+    def __init__(self, path, columns, compression):
+        if compression == 'gzip':
+            self._file = gzip.open(path, 'wt', compresslevel=5, newline='', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def write(self, rows):
+        self._writer.writerows([csv_value(value) for value in row] for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    """Writes fixed-size row groups; the schema is taken from the first group."""
+
+    def __init__(self, path, columns, compression, row_group_size):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._pq = pq
+        self._path = path
+        self._names = [str(name) for name in columns]
+        self._compression = compression or 'snappy'
+        self._row_group_size = row_group_size
+        self._buffer = []
+        self._writer = None
+        self._schema = None
+
+    def _array(self, values, field=None):
+        pa = self._pa
+        try:
+            return pa.array(values, type=field.type if field is not None else None)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            if field is not None and not pa.types.is_string(field.type):
+                raise EncodingError(f"Column {field.name} changed type part way through the export")
+            # Mixed-type or driver-specific columns are written as text, as for Arrow results
+            return pa.array([None if value is None else str(convert_value(value)) for value in values],
+                            type=pa.string())
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        pa = self._pa
+        columns = to_columns(self._buffer, len(self._names))
+        if self._schema is None:
+            arrays = [self._array(values) for values in columns]
+            # An all-null first group has no type to go on; text is the safe choice for later groups
+            arrays = [array.cast(pa.string()) if pa.types.is_null(array.type) else array for array in arrays]
+            self._schema = pa.schema([pa.field(name, array.type) for name, array in zip(self._names, arrays)])
+            self._writer = self._pq.ParquetWriter(self._path, self._schema, compression=self._compression)
+        else:
+            arrays = [self._array(values, field) for values, field in zip(columns, self._schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema), row_group_size=len(self._buffer))
+        self._buffer = []
+
+    def write(self, rows):
+        for row in rows:
+            self._buffer.append(row)
+            if len(self._buffer) >= self._row_group_size:
+                self._flush()
+
+    def close(self):
+        self._flush()
+        if self._writer is None:
+            # No rows at all: still produce a valid file with every column typed as text
+            pa = self._pa
+            self._schema = pa.schema([pa.field(name, pa.string()) for name in self._names])
+            self._writer = self._pq.ParquetWriter(self._path, self._schema, compression=self._compression)
+        self._writer.close()
+
+
+class ResultExport:
+    """Sink for a query job that writes rows to a file batch by batch instead of keeping them."""
+
+    def __init__(self, export_format, compression=None, directory=EXPORT_DIR, row_group_size=EXPORT_ROW_GROUP_SIZE):
+        check_export_format(export_format, compression)
+        self.format = export_format
+        self.compression = None if compression == 'none' else compression
+        self.row_group_size = row_group_size
+        self.id = uuid.uuid4().hex
+        extension = 'csv.gz' if export_format == 'csv' and self.compression == 'gzip' else export_format
+        self.filename = f"export-{self.id[:12]}.{extension}"
+        self.path = os.path.join(directory, self.filename)
+        self.rows_written = 0
+        self.finished = False
+        self._writer = None
+
+    @property
+    def mimetype(self):
+        return EXPORT_MIMETYPES[self.format]
+
+    def open(self, columns):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.format == 'csv':
+            self._writer = _CsvWriter(self.path, columns, self.compression)
+        else:
+            self._writer = _ParquetWriter(self.path, columns, self.compression, self.row_group_size)
+
+    def write(self, rows):
+        self._writer.write(rows)
+        self.rows_written += len(rows)
+
+    def close(self):
+        self._writer.close()
+        self._writer = None
+        self.finished = True
+        logging.info(f"Exported {self.rows_written} rows to {self.path}")
+
+    def bytes_written(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def discard(self):
+        """Close and delete the file; used for failed, cancelled and expired exports."""
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+            self._writer = None
+        self.finished = False
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def to_dict(self):
+        return {
+            'format': self.format,
+            'compression': self.compression,
+            'filename': self.filename,
+            'rows_written': self.rows_written,
+            'bytes_written': self.bytes_written(),
+            'ready': self.finished,
+        }
@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from drivers import get_driver
+
+RESULT_PAGE_SIZE = int(os.getenv('RESULT_PAGE_SIZE', '500'))
+RESULT_HANDLE_TTL = float(os.getenv('RESULT_HANDLE_TTL', '300'))
+RESULT_HANDLE_MAX = int(os.getenv('RESULT_HANDLE_MAX', '8'))
+
+
+class ResultHandle:
+    """An open cursor parked between page requests, together with its pooled connection."""
+
+    def __init__(self, pool, conn, cursor, owner=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner  # session token that opened it; only that session may page or close it
+        self.pool = pool
+        self.conn = conn
+        self.cursor = cursor
+        self.last_access = time.monotonic()
+        self.exhausted = False
+        self.columns = cursor.columns
+        self.lock = threading.Lock()
+
+    def fetch(self, size):
+        with self.lock:
+            if self.cursor is None:
+                self.exhausted = True
+                return []
+            rows = self.cursor.fetch(size)
+            self.last_access = time.monotonic()
+            if len(rows) < size:
+                self.exhausted = True
+            return rows
+
+    def close(self):
+        with self.lock:
+            if self.cursor is None:
+                return
+            try:
+                self.cursor.close()
+            finally:
+                self.pool.release(self.conn, broken=not self.cursor.reusable)
+                self.cursor = None
+
+
+class ResultHandleStore:
+    """Keeps a bounded number of open result cursors with TTL and LRU eviction."""
+
+    def __init__(self, ttl=RESULT_HANDLE_TTL, max_handles=RESULT_HANDLE_MAX):
+        self.ttl = ttl
+        self.max_handles = max_handles
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, pool, db_type, query, page_size=RESULT_PAGE_SIZE, owner=None):
+        """Run the query and return (columns, first page, handle id or None)."""
+        self.expire()
+        driver = get_driver(db_type)
+        conn = pool.acquire()
+        try:
+            cursor = driver.execute(conn, query, batch_size=page_size)
+        except Exception:
+            pool.release(conn)
+            raise
+
+        handle = ResultHandle(pool, conn, cursor, owner)
+        try:
+            rows = handle.fetch(page_size)
+            if driver.writes(query):
+                # A commit ends a Postgres server-side cursor, so RETURNING rows are all read first
+                while not handle.exhausted:
+                    rows += handle.fetch(page_size)
+                conn.commit()
+        except Exception:
+            handle.close()
+            raise
+
+        if handle.exhausted:
+            handle.close()
+            return cursor.columns, rows, None
+
+        evicted = []
+        with self._lock:
+            self._handles[handle.id] = handle
+            while len(self._handles) > self.max_handles:
+                evicted.append(self._handles.popitem(last=False)[1])
+        for old in evicted:
+            logging.info(f"Evicting least recently used result handle {old.id}")
+            old.close()
+        return cursor.columns, rows, handle.id
+
+    def fetch(self, handle_id, page_size=RESULT_PAGE_SIZE, owner=None):
+        """Return (columns, next page, has_more) or None if the handle is unknown, expired or not owner's."""
+        self.expire()
+        with self._lock:
+            handle = self._handles.get(handle_id)
+            if handle is None or handle.owner != owner:
+                return None
+            self._handles.move_to_end(handle_id)
+
+        rows = handle.fetch(page_size)
+        if handle.exhausted:
+            self.close(handle_id, owner)
+        return handle.columns, rows, not handle.exhausted
+
+    def close(self, handle_id, owner=None):
+        with self._lock:
+            handle = self._handles.get(handle_id)
+            if handle is None or handle.owner != owner:
+                return False
+            del self._handles[handle_id]
+        handle.close()
+        return True
+
+    def expire(self):
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [h for h in self._handles.values() if h.last_access < cutoff]
+            for handle in expired:
+                del self._handles[handle.id]
+        for handle in expired:
+            logging.info(f"Result handle {handle.id} expired")
+            handle.close()
+        return len(expired)
+
+    def start_reaper(self, interval=30):
+        def reap():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.expire()
+                except Exception as e:
+                    logging.error(f"Error expiring result handles: {e}")
+
+        thread = threading.Thread(target=reap, name='result-handle-reaper', daemon=True)
+        thread.start()
+        return thread
+
+    def close_for_pool(self, pool):
+        with self._lock:
+            owned = [h for h in self._handles.values() if h.pool is pool]
+            for handle in owned:
+                del self._handles[handle.id]
+        for handle in owned:
+            handle.close()
+
+    def __len__(self):
+        return len(self._handles)
@@ -0,0 +1,341 @@
+import functools
+import json
+import logging
+import os
+import re
+import threading
+
+from bm25 import tokenize
+from few_shot import PROMPT_COMPLETION_PATH
+from sql_validator import validate_query
+from translation_cache import normalize_message
+
+RULE_ENGINE_MODE = os.getenv('RULE_ENGINE_MODE', 'on')  # on or off
+RULE_MIN_CONFIDENCE = float(os.getenv('RULE_MIN_CONFIDENCE', '0.8'))
+# Tables considered for a measure column when the question names no table
+RULE_CANDIDATE_TABLES = int(os.getenv('RULE_CANDIDATE_TABLES', '10'))
+
+AGGREGATE_WORDS = {
+    'average': 'AVG', 'avg': 'AVG', 'mean': 'AVG',
+    'total': 'SUM', 'sum': 'SUM',
+    'maximum': 'MAX', 'max': 'MAX', 'highest': 'MAX', 'largest': 'MAX',
+    'minimum': 'MIN', 'min': 'MIN', 'lowest': 'MIN', 'smallest': 'MIN',
+}
+AGGREGATE_ALIASES = {'AVG': 'average', 'SUM': 'total', 'MAX': 'max', 'MIN': 'min'}
+MONGO_ACCUMULATORS = {'AVG': '$avg', 'SUM': '$sum', 'MAX': '$max', 'MIN': '$min'}
+NUMERIC_TYPE = re.compile(r'int|real|num|dec|float|double|money|serial', re.IGNORECASE)
+RESERVED_WORDS = frozenset((
+    'all', 'and', 'as', 'by', 'desc', 'from', 'group', 'index', 'key', 'limit', 'order', 'select', 'table',
+    'to', 'user', 'where',
+))
+
+_SLOT = r'[\w ]+?'
+_AGG = '(?P<agg>' + '|'.join(AGGREGATE_WORDS) + ')'
+_GROUP = r'(?:by|per|for each|in each|for every|of each|grouped by|broken down by)'
+_ASK = r'(?:(?:show|find|get|list|what is|what are|give me|compute|calculate)(?: me)? )?(?:the )?'
+
+BUILTIN_TEMPLATES = [
+    ('select_all', rf'(?:show|list|get|display|fetch|return|give)(?: me)?(?: all| every)?(?: the)?'
+                   rf'(?: rows| records| entries| data)?(?: (?:of|from|in)(?: the)?)? (?P<table>{_SLOT})'
+                   r'(?: table| collection)?'),
+    ('count', rf'how many (?P<table>{_SLOT})(?: are there| exist| do we have)?'),
+    ('count', rf'{_ASK}(?:count|number)(?: of)?(?: all)?(?: the)?(?: number of)? (?P<table>{_SLOT})'),
+    ('count_by', rf'how many (?P<table>{_SLOT})(?: are there)? {_GROUP} (?P<group>{_SLOT})'),
+    ('count_by', rf'{_ASK}(?:count|number)(?: of)?(?: all)?(?: the)?(?: number of)? (?P<table>{_SLOT}) '
+                 rf'{_GROUP} (?P<group>{_SLOT})'),
+    ('aggregate_by', rf'{_ASK}{_AGG} (?P<measure>{_SLOT})(?: of(?: the)? (?P<table>{_SLOT}))? {_GROUP} '
+                     rf'(?P<group>{_SLOT})'),
+    ('aggregate', rf'{_ASK}{_AGG} (?P<measure>{_SLOT})(?: (?:of|in|across|for)(?: all)?(?: the)? (?P<table>{_SLOT}))?'),
+]
+
+# Completion shapes a seed pair must have to be turned into a phrasing template
+SEED_SHAPES = [
+    ('select_all', re.compile(r'select \* from (?P<table>\w+)', re.IGNORECASE)),
+    ('count', re.compile(r'select count\(\*\) from (?P<table>\w+)', re.IGNORECASE)),
+    ('count_by', re.compile(r'select (?P<group>\w+), count\(\*\) from (?P<table>\w+) group by (?P=group)',
+                            re.IGNORECASE)),
+    ('aggregate', re.compile(r'select (?P<agg>avg|sum|min|max)\((?P<measure>\w+)\)(?: as \w+)? from (?P<table>\w+)',
+                             re.IGNORECASE)),
+    ('aggregate_by', re.compile(r'select (?P<group>\w+), (?P<agg>avg|sum|min|max)\((?P<measure>\w+)\)(?: as \w+)? '
+                                r'from (?P<table>\w+) group by (?P=group)', re.IGNORECASE)),
+]
+
+
+@functools.lru_cache(maxsize=65536)
+def name_terms(name):
+    return frozenset(tokenize(name))
+
+
+def match_name(phrase, names):
+    """Resolve a phrase to one of names: (name, 1.0) on an exact term match, (name, 0.85) when the phrase
+    is a unique shortening of a name ('results' for exam_results), (None, 0.0) otherwise.
+
+    A name covering only part of the phrase never matches: 'students who are 15' is not a table name.
+    """
+    terms = name_terms(phrase)
+    if not terms:
+        return None, 0.0
+    exact = [name for name in names if name_terms(name) == terms]
+    if exact:
+        return (exact[0], 1.0) if len(exact) == 1 else (None, 0.0)
+    partial = [name for name in names if terms < name_terms(name)]
+    return (partial[0], 0.85) if len(partial) == 1 else (None, 0.0)
+
+
+def label_column(table):
+    """The column that best names a row (name, title or label), else a single-column primary key."""
+    for column in table['columns']:
+        if name_terms(column['name']) & {'name', 'title', 'label'}:
+            return column['name']
+    return table['primary_key'][0] if len(table['primary_key']) == 1 else None
+
+
+def neighbors(table, links):
+    """[(other, column, other_column, declared)] for join keys in either direction."""
+    found = [(ref_table, column, ref_column, declared) for column, ref_table, ref_column, declared in links.get(table, [])]
+    for other, other_links in links.items():
+        if other != table:
+            found += [(other, ref_column, column, declared)
+                      for column, ref_table, ref_column, declared in other_links if ref_table == table]
+    return found
+
+
+def quote_identifier(name, db_type):
+    plain = r'[a-z_][a-z0-9_]*' if db_type == 'postgresql' else r'[A-Za-z_]\w*'
+    if re.fullmatch(plain, name) and name.lower() not in RESERVED_WORDS:
+        return name
+    if db_type == 'mysql':
+        return '`' + name.replace('`', '``') + '`'
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_sql(spec, db_type):
+    q = lambda name: quote_identifier(name, db_type)
+    table = q(spec['table'])
+    join = spec.get('join')
+    source = table
+    if join:
+        other, column, other_column = join
+        source += f" JOIN {q(other)} ON {table}.{q(column)} = {q(other)}.{q(other_column)}"
+
+    def ref(table_name, column_name):
+        return f"{q(table_name)}.{q(column_name)}" if join else q(column_name)
+
+    kind = spec['kind']
+    if kind == 'select_all':
+        return f"SELECT * FROM {table};"
+    if kind == 'count':
+        return f"SELECT COUNT(*) FROM {table};"
+    group = ref(*spec['group']) if 'group' in spec else None
+    if kind == 'count_by':
+        return f"SELECT {group}, COUNT(*) FROM {source} GROUP BY {group};"
+    measure = ref(spec['table'], spec['measure'])
+    alias = q(f"{AGGREGATE_ALIASES[spec['agg']]}_{spec['measure']}")
+    if kind == 'aggregate':
+        return f"SELECT {spec['agg']}({measure}) AS {alias} FROM {table};"
+    return f"SELECT {group}, {spec['agg']}({measure}) AS {alias} FROM {source} GROUP BY {group};"
+
+
+def build_mongo(spec):
+    """Shell syntax for the subset mongo_query parses; joins are left to the LLM."""
+    if spec.get('join') or not re.fullmatch(r'[A-Za-z_]\w*', spec['table']):
+        return None
+    collection = f"db.{spec['table']}"
+    kind = spec['kind']
+    if kind == 'select_all':
+        return f"{collection}.find({{}})"
+    if kind == 'count':
+        return f"{collection}.countDocuments({{}})"
+    group_id = json.dumps(f"${spec['group'][1]}") if 'group' in spec else 'null'
+    if kind == 'count_by':
+        return f'{collection}.aggregate([{{"$group": {{"_id": {group_id}, "count": {{"$sum": 1}}}}}}])'
+    alias = f"{AGGREGATE_ALIASES[spec['agg']]}_{spec['measure']}"
+    accumulator = f'{{"{MONGO_ACCUMULATORS[spec["agg"]]}": {json.dumps("$" + spec["measure"])}}}'
+    return f'{collection}.aggregate([{{"$group": {{"_id": {group_id}, {json.dumps(alias)}: {accumulator}}}}}])'
+
+
+def load_seeds(path=PROMPT_COMPLETION_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not load rule engine seeds from {path}: {e}")
+        return []
+
+
+def mine_template(prompt, completion):
+    """Turn a seed pair with a supported completion shape into a phrasing template, or None.
+
+    'Count the number of students in each grade level.' with 'SELECT grade_level, COUNT(*) FROM students
+    GROUP BY grade_level;' becomes 'count the number of (?P<table>...) in each (?P<group>...)'.
+    """
+    sql = re.sub(r'\s+', ' ', completion.strip().rstrip(';').strip())
+    for kind, shape in SEED_SHAPES:
+        match = shape.fullmatch(sql)
+        if match:
+            break
+    else:
+        return None
+
+    text = normalize_message(prompt)
+    placeholders = {}
+    for slot in ('table', 'group', 'measure'):
+        value = match.groupdict().get(slot)
+        if value is None:
+            continue
+        for surface in (value.lower().replace('_', ' '), value.lower()):
+            found = re.search(rf'\b{re.escape(surface)}\b', text)
+            if found:
+                break
+        else:
+            return None
+        marker = f"\0{slot}\0"
+        text = text[:found.start()] + marker + text[found.end():]
+        placeholders[marker] = f"(?P<{slot}>{_SLOT})"
+    if 'agg' in match.groupdict():
+        words = [word for word, func in AGGREGATE_WORDS.items() if func == match.group('agg').upper()]
+        found = re.search(r'\b(' + '|'.join(words) + r')\b', text)
+        if not found:
+            return None
+        text = text[:found.start()] + '\0agg\0' + text[found.end():]
+        placeholders['\0agg\0'] = _AGG
+
+    pattern = ''.join(placeholders.get(f"\0{part}\0", re.escape(part)) if i % 2 else re.escape(part)
+                      for i, part in enumerate(text.split('\0')))
+    return kind, pattern
+
+
+class RuleEngine:
+    """Answers simple question shapes (show all X, count X by Y, average Y per X) from the schema alone."""
+
+    def __init__(self, seeds=None, min_confidence=RULE_MIN_CONFIDENCE):
+        seeds = load_seeds() if seeds is None else seeds
+        self.min_confidence = min_confidence
+        # Seed questions asked verbatim are answered with their completion, if it fits the connected schema
+        self.examples = {normalize_message(seed['prompt']): seed['completion'] for seed in seeds}
+        self.templates = [(kind, re.compile(pattern), 'builtin') for kind, pattern in BUILTIN_TEMPLATES]
+        known = {pattern for _, pattern in BUILTIN_TEMPLATES}
+        for seed in seeds:
+            mined = mine_template(seed['prompt'], seed['completion'])
+            if mined and mined[1] not in known:
+                known.add(mined[1])
+                self.templates.append((mined[0], re.compile(mined[1]), 'seed'))
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'served': 0, 'low_confidence': 0, 'no_match': 0, 'templates': {}}
+
+    def _resolve_measure(self, slots, tables, links, candidates):
+        """(table, column, confidence) for the aggregated column; a named table also lends its neighbours,
+        so 'average score of students' finds the score in exam_results."""
+        if slots.get('table'):
+            table, confidence = match_name(slots['table'], tables)
+            if not table:
+                return None
+            candidates = [(table, 1.0)] + [(other, 0.9) for other, _, _, _ in neighbors(table, links) if other in tables]
+        else:
+            confidence = 1.0
+            candidates = [(table, 1.0) for table in candidates]
+        found = []
+        for table, weight in candidates:
+            column, column_confidence = match_name(slots['measure'], [c['name'] for c in tables[table]['columns']])
+            if column:
+                found.append((column_confidence * weight, table, column))
+        found.sort(reverse=True)
+        if not found or len(found) > 1 and found[0][0] == found[1][0]:
+            return None
+        column_confidence, table, column = found[0]
+        return table, column, confidence * column_confidence
+
+    def _resolve_group(self, phrase, table, tables, links):
+        """Group column in the table itself, or in a table one join key away (by column or by table name)."""
+        columns = [column['name'] for column in tables[table]['columns']]
+        options = []
+        column, confidence = match_name(phrase, columns)
+        if column:
+            options.append((confidence, (table, column), None))
+        for other, local_column, other_column, declared in neighbors(table, links):
+            if other not in tables:
+                continue
+            column, confidence = match_name(phrase, [c['name'] for c in tables[other]['columns']])
+            # 'per student' means the student's name rather than a column that merely contains 'student'
+            named, named_confidence = match_name(phrase, [other])
+            label = label_column(tables[other]) if named else None
+            if label and named_confidence >= confidence:
+                column, confidence = label, named_confidence
+            if column:
+                options.append((confidence * (1.0 if declared else 0.9), (other, column),
+                                (other, local_column, other_column)))
+        options.sort(key=lambda option: option[0], reverse=True)
+        if not options or len(options) > 1 and options[0][0] == options[1][0] and options[0][1] != options[1][1]:
+            return None
+        return options[0]
+
+    def _resolve(self, kind, slots, tables, links, candidates):
+        """Return (spec, confidence) for a template match, or None when the schema does not fit it."""
+        if kind in ('select_all', 'count', 'count_by'):
+            table, confidence = match_name(slots['table'], tables)
+            if not table:
+                return None
+            spec = {'kind': kind, 'table': table}
+        else:
+            measure = self._resolve_measure(slots, tables, links, candidates)
+            if measure is None:
+                return None
+            table, column, confidence = measure
+            agg = AGGREGATE_WORDS[slots['agg']]
+            column_type = next(c['type'] for c in tables[table]['columns'] if c['name'] == column) or ''
+            if agg in ('AVG', 'SUM') and column_type and not NUMERIC_TYPE.search(column_type):
+                return None
+            spec = {'kind': kind, 'table': table, 'measure': column, 'agg': agg}
+        if kind in ('count_by', 'aggregate_by'):
+            group = self._resolve_group(slots['group'], table, tables, links)
+            if group is None:
+                return None
+            group_confidence, spec['group'], spec['join'] = group
+            confidence *= group_confidence
+        return spec, confidence
+
+    def match(self, message, db_type, tables, links=None, candidates=None):
+        """Return {'query', 'template', 'source', 'confidence'} when a rule answers the question
+        confidently, else None so the caller falls back to the LLM."""
+        text = normalize_message(message)
+        links = links or {}
+        candidates = [name for name in (candidates or tables) if name in tables][:RULE_CANDIDATE_TABLES]
+        best = None
+
+        example = self.examples.get(text)
+        if example and db_type != 'mongodb' and not validate_query(example, db_type, tables):
+            best = ({'query': example, 'template': 'example', 'source': 'seed'}, 1.0)
+        else:
+            for kind, pattern, source in self.templates:
+                found = pattern.fullmatch(text)
+                if not found:
+                    continue
+                resolved = self._resolve(kind, {k: v for k, v in found.groupdict().items() if v}, tables, links,
+                                         candidates)
+                if resolved is None or best and best[1] >= resolved[1]:
+                    continue
+                spec, confidence = resolved
+                query = build_mongo(spec) if db_type == 'mongodb' else build_sql(spec, db_type)
+                if query:
+                    best = ({'query': query, 'template': kind, 'source': source}, confidence)
+
+        with self._lock:
+            self._stats['requests'] += 1
+            if best is None:
+                self._stats['no_match'] += 1
+                return None
+            if best[1] < self.min_confidence:
+                self._stats['low_confidence'] += 1
+                logging.info(f"Rule engine confidence {best[1]:.2f} too low for {message!r}; using the LLM")
+                return None
+            self._stats['served'] += 1
+            templates = self._stats['templates']
+            templates[best[0]['template']] = templates.get(best[0]['template'], 0) + 1
+        return dict(best[0], confidence=round(best[1], 3))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, templates=dict(self._stats['templates']))
+        stats['template_count'] = len(self.templates)
+        stats['seed_templates'] = sum(1 for _, _, source in self.templates if source == 'seed')
+        return stats
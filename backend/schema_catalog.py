@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from drivers import get_driver
+
+SCHEMA_REFRESH_INTERVAL = float(os.getenv('SCHEMA_REFRESH_INTERVAL', '60'))
+
+DDL_KEYWORDS = ('create', 'alter', 'drop', 'rename', 'truncate')
+
+
+def is_ddl(query):
+    head = query.lstrip().split(None, 1)
+    return bool(head) and head[0].lower() in DDL_KEYWORDS
+
+
+def _hash(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def table_signatures(conn, db_type):
+    """Return {table: signature}, one cheap catalog query whose values change whenever a table's DDL does."""
+    return get_driver(db_type).list_tables(conn)
+
+
+def _new_table(name):
+    return {'name': name, 'columns': [], 'primary_key': [], 'foreign_keys': [], 'comment': None}
+
+
+def introspect(conn, db_type, table_names):
+    """Load columns, types and keys for the given tables in a handful of bulk catalog queries."""
+    tables = {name: _new_table(name) for name in table_names}
+    if not tables:
+        return tables
+
+    get_driver(db_type).introspect(conn, tables)
+    return tables
+
+
+class SchemaCatalog:
+    """In-memory copy of one connection's schema, refreshed incrementally when table signatures change."""
+
+    def __init__(self, pool, db_type):
+        self.pool = pool
+        self.db_type = db_type
+        self.tables = {}
+        self.signatures = {}
+        self.checksum = None
+        self.version = 0
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stale = threading.Event()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None:
+            self.refresh()
+        return self
+
+    def table_names(self):
+        return sorted(self.ensure_loaded().tables)
+
+    def get_table(self, name):
+        return self.ensure_loaded().tables.get(name)
+
+    def is_stale(self):
+        return self._stale.is_set()
+
+    def mark_stale(self):
+        """Ask the background refresher to look at the catalog on its next pass (e.g. after DDL)."""
+        self._stale.set()
+
+    def refresh(self):
+        """Re-read table signatures and introspect only tables that were added or changed."""
+        with self._refresh_lock:
+            self._stale.clear()
+            with self.pool.connection() as conn:
+                signatures = table_signatures(conn, self.db_type)
+                changed = [name for name, sig in signatures.items() if self.signatures.get(name) != sig]
+                removed = [name for name in self.signatures if name not in signatures]
+                if self.loaded_at is not None and not changed and not removed:
+                    return False
+                updated = introspect(conn, self.db_type, changed)
+
+            with self._lock:
+                tables = dict(self.tables)
+                for name in removed:
+                    tables.pop(name, None)
+                tables.update(updated)
+                self.tables = tables
+                self.signatures = signatures
+                self.checksum = _hash('\n'.join(f"{name}:{sig}" for name, sig in sorted(signatures.items())))
+                self.version += 1
+                self.loaded_at = time.time()
+            logging.info(
+                f"Schema catalog for {self.db_type} refreshed: {len(changed)} changed, {len(removed)} removed, "
+                f"{len(self.tables)} tables")
+            return True
+
+    def to_dict(self):
+        self.ensure_loaded()
+        return {
+            'checksum': self.checksum,
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'tables': list(self.tables.values()),
+        }
+
+
+def start_schema_refresher(catalogs, interval=SCHEMA_REFRESH_INTERVAL):
+    """Refresh every loaded catalog in the background, sooner when one has been marked stale."""
+    def run():
+        last_pass = time.monotonic()
+        while True:
+            time.sleep(1)
+            due = time.monotonic() - last_pass >= interval
+            for catalog in list(catalogs.values()):
+                if catalog.loaded_at is None or not (due or catalog.is_stale()):
+                    continue
+                try:
+                    catalog.refresh()
+                except Exception as e:
+                    logging.error(f"Error refreshing {catalog.db_type} schema catalog: {e}")
+            if due:
+                last_pass = time.monotonic()
+
+    thread = threading.Thread(target=run, name='schema-refresher', daemon=True)
+    thread.start()
+    return thread
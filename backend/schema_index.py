@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+
+from bm25 import BM25Index, tokenize
+from few_shot import estimate_tokens
+
+SCHEMA_TOP_TABLES = int(os.getenv('SCHEMA_TOP_TABLES', '8'))
+SCHEMA_TOKEN_BUDGET = int(os.getenv('SCHEMA_TOKEN_BUDGET', '1200'))
+SCHEMA_MAX_COLUMNS = int(os.getenv('SCHEMA_MAX_COLUMNS', '40'))
+
+
+def table_document(table):
+    """Text indexed for one table: its name (twice, so it outweighs a single column match), comments,
+    column names and the tables it references."""
+    parts = [table['name'], table['name'], table.get('comment') or '']
+    for column in table['columns']:
+        parts.append(column['name'])
+        if column.get('comment'):
+            parts.append(column['comment'])
+    parts += [fk['ref_table'] for fk in table['foreign_keys']]
+    return ' '.join(parts)
+
+
+def primary_key_owners(tables):
+    """Map single-column primary key names to their table; names shared by several tables are ambiguous."""
+    owners = {}
+    for name, table in tables.items():
+        if len(table['primary_key']) == 1:
+            key = table['primary_key'][0]
+            owners[key] = None if key in owners else name
+    return {key: name for key, name in owners.items() if name is not None}
+
+
+def table_links(table, pk_owners):
+    """[(column, ref_table, ref_column, declared)] for declared foreign keys, plus inferred ones where a
+    column is named after another table's primary key (warehouses often declare none)."""
+    links = [(fk['column'], fk['ref_table'], fk['ref_column'], True) for fk in table['foreign_keys']]
+    linked = {column for column, _, _, _ in links}
+    own_key = table['primary_key'][0] if len(table['primary_key']) == 1 else None
+    for column in table['columns']:
+        owner = pk_owners.get(column['name'])
+        if owner and owner != table['name'] and column['name'] != own_key and column['name'] not in linked:
+            links.append((column['name'], owner, column['name'], False))
+    return links
+
+
+class SchemaIndex:
+    """BM25 index over a SchemaCatalog's tables, kept in step with the catalog one changed table at a time."""
+
+    def __init__(self, catalog, top_n=SCHEMA_TOP_TABLES, token_budget=SCHEMA_TOKEN_BUDGET,
+                 max_columns=SCHEMA_MAX_COLUMNS):
+        self.catalog = catalog
+        self.top_n = top_n
+        self.token_budget = token_budget
+        self.max_columns = max_columns
+        self.index = BM25Index()
+        self.version = None
+        self._indexed = {}  # table name -> table dict that was indexed
+        self._links = {}
+        self._full_tokens = 0
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'tables_selected': 0, 'schema_tokens': 0, 'full_schema_tokens': 0}
+
+    def sync(self):
+        """Re-index only the tables the catalog replaced since the last sync."""
+        self.catalog.ensure_loaded()
+        # Version before tables: a refresh in between only means one extra sync later, never a missed one
+        version = self.catalog.version
+        tables = self.catalog.tables
+        with self._lock:
+            if self.version == version:
+                return False
+            # The catalog swaps in new dicts for changed tables only, so identity tells what to re-index
+            changed = [name for name, table in tables.items() if self._indexed.get(name) is not table]
+            removed = [name for name in self._indexed if name not in tables]
+            for name in removed:
+                self.index.remove(name)
+                del self._indexed[name]
+            for name in changed:
+                self.index.add(name, table_document(tables[name]))
+                self._indexed[name] = tables[name]
+            pk_owners = primary_key_owners(tables)
+            self._links = {name: table_links(table, pk_owners) for name, table in tables.items()}
+            self._full_tokens = sum(estimate_tokens(self.render_table(table)) for table in tables.values())
+            self.version = version
+            indexed = len(self.index)
+        logging.info(f"Schema index for {self.catalog.db_type}: {len(changed)} tables re-indexed, "
+                     f"{len(removed)} removed, {indexed} indexed")
+        return True
+
+    def rank(self, question, limit=None):
+        """Table names ordered by relevance to the question."""
+        self.sync()
+        # Searching while sync() rewrites the postings could see a table half removed
+        with self._lock:
+            return [name for name, _ in self.index.search(question, limit=limit)]
+
+    def links(self):
+        """{table: [(column, ref_table, ref_column, declared)]} for the current catalog version."""
+        self.sync()
+        return self._links
+
+    def render_table(self, table, terms=None):
+        columns = table['columns']
+        omitted = 0
+        if len(columns) > self.max_columns:
+            # Wide tables keep their keys and the columns the question mentions, then fill up in table order
+            keys = set(table['primary_key']) | {column for column, _, _, _ in self._links.get(table['name'], [])}
+            wanted = {column['name'] for column in columns
+                      if column['name'] in keys or terms and terms & set(tokenize(column['name']))}
+            for column in columns:
+                if len(wanted) >= self.max_columns:
+                    break
+                wanted.add(column['name'])
+            omitted = len(columns) - len(wanted)
+            columns = [column for column in columns if column['name'] in wanted]
+        described = []
+        for column in columns:
+            text = f"{column['name']} {column['type']}".strip()
+            if column['name'] in table['primary_key']:
+                text += ' PK'
+            described.append(text)
+        if omitted:
+            described.append(f"... {omitted} more")
+        line = f"{table['name']}({', '.join(described)})"
+        if table.get('comment'):
+            line += f" -- {table['comment']}"
+        return line
+
+    def select(self, question):
+        """Best-matching tables for the question, plus tables that bridge two of them."""
+        tables = self.catalog.tables
+        with self._lock:
+            if self._full_tokens <= self.token_budget:
+                # Small schemas fit whole; ranking only decides the order
+                ranked = [name for name, _ in self.index.search(question)]
+                return ranked + sorted(set(tables) - set(ranked))
+            chosen = [name for name, _ in self.index.search(question, limit=self.top_n)]
+            links = self._links
+        chosen_set = set(chosen)
+        bridges = [name for name, refs in links.items()
+                   if name not in chosen_set and len({ref for _, ref, _, _ in refs} & chosen_set) >= 2]
+        return chosen + sorted(bridges)
+
+    def summarize(self, question):
+        """Compact schema text for the tables relevant to the question, within the token budget."""
+        self.sync()
+        tables = self.catalog.tables
+        terms = set(tokenize(question))
+        lines = []
+        included = []
+        used = 0
+        for name in self.select(question):
+            if name not in tables:
+                continue  # dropped by a catalog refresh since the sync above
+            line = self.render_table(tables[name], terms)
+            cost = estimate_tokens(line)
+            if used + cost > self.token_budget:
+                continue
+            lines.append(line)
+            included.append(name)
+            used += cost
+
+        included_set = set(included)
+        join_keys = [f"{name}.{column} = {ref_table}.{ref_column}" + ('' if declared else ' (inferred)')
+                     for name in included for column, ref_table, ref_column, declared in self._links.get(name, [])
+                     if ref_table in included_set]
+        text = f"The {self.catalog.db_type} database has {len(tables)} tables."
+        if lines:
+            text += ' Relevant tables:\n' + '\n'.join(lines)
+        if join_keys:
+            text += '\nJoin keys:\n' + '\n'.join(join_keys)
+
+        tokens = estimate_tokens(text)
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['tables_selected'] += len(included)
+            self._stats['schema_tokens'] += tokens
+            self._stats['full_schema_tokens'] += self._full_tokens
+        return {'text': text, 'tables': included, 'join_keys': join_keys, 'tokens': tokens}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['indexed_tables'] = len(self.index)
+        stats['db_type'] = self.catalog.db_type
+        requests = stats['requests']
+        stats['avg_schema_tokens'] = stats['schema_tokens'] / requests if requests else 0
+        stats['avg_full_schema_tokens'] = stats['full_schema_tokens'] / requests if requests else 0
+        return stats
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+SESSION_STORE_PATH = os.getenv(
+    'SESSION_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.sqlite3'))
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', '1800'))
+# Shared last-seen timestamps are only rewritten this often, so most requests never touch the store
+SESSION_TOUCH_INTERVAL = float(os.getenv('SESSION_TOUCH_INTERVAL', '60'))
+
+
+class SessionStore:
+    """Connection descriptors keyed by session token, in a SQLite file every worker process can open."""
+
+    def __init__(self, path=SESSION_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        try:
+            os.chmod(path, 0o600)  # descriptors carry database credentials
+        except OSError:
+            pass
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "token TEXT PRIMARY KEY, db_type TEXT NOT NULL, params TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_seen REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+        self._db.commit()
+
+    def create(self, db_type, params):
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO sessions (token, db_type, params, created_at, last_seen) VALUES (?, ?, ?, ?, ?)",
+                (token, db_type, json.dumps(params), now, now))
+            self._db.commit()
+        return token
+
+    def get(self, token, idle_timeout=SESSION_IDLE_TIMEOUT):
+        """Return (db_type, params) for a live session, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT db_type, params FROM sessions WHERE token = ? AND last_seen >= ?",
+                (token, time.time() - idle_timeout)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def touch(self, token):
+        """Record activity; returns False when the session no longer exists."""
+        with self._lock:
+            cur = self._db.execute("UPDATE sessions SET last_seen = ? WHERE token = ?", (time.time(), token))
+            self._db.commit()
+        return cur.rowcount > 0
+
+    def delete(self, token):
+        with self._lock:
+            cur = self._db.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            self._db.commit()
+        return cur.rowcount > 0
+
+    def expire(self, idle_timeout=SESSION_IDLE_TIMEOUT):
+        with self._lock:
+            cur = self._db.execute("DELETE FROM sessions WHERE last_seen < ?", (time.time() - idle_timeout,))
+            self._db.commit()
+        return cur.rowcount
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class Session:
+    """A connected database as seen by one worker: the pool it built from the shared descriptor."""
+
+    def __init__(self, token, db_type, pool):
+        self.token = token
+        self.db_type = db_type
+        self.pool = pool
+        self.last_used = time.monotonic()
+        self.last_touched = time.monotonic()
+
+
+class SessionRegistry:
+    """Per-client connection sessions, rehydrated lazily in whichever worker a request lands on.
+
+    open_pool(db_type, params) builds a pool from a descriptor; on_open(session) and
+    on_close(session) let the app attach and drop per-pool state such as schema catalogs.
+    """
+
+    def __init__(self, store, open_pool, on_open=None, on_close=None,
+                 idle_timeout=SESSION_IDLE_TIMEOUT, touch_interval=SESSION_TOUCH_INTERVAL):
+        self.store = store
+        self.open_pool = open_pool
+        self.on_open = on_open
+        self.on_close = on_close
+        self.idle_timeout = idle_timeout
+        self.touch_interval = touch_interval
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._counters = {'connects': 0, 'rehydrated': 0, 'expired': 0, 'closed': 0}
+
+    def _attach(self, token, db_type, pool):
+        session = Session(token, db_type, pool)
+        with self._lock:
+            self._sessions[token] = session
+        if self.on_open is not None:
+            self.on_open(session)
+        return session
+
+    def connect(self, db_type, params, pool):
+        """Store the descriptor for an already opened pool and return the new session."""
+        token = self.store.create(db_type, params)
+        with self._lock:
+            self._counters['connects'] += 1
+        return self._attach(token, db_type, pool)
+
+    def get(self, token):
+        """Return the session for a token, building its pool here if another worker created it."""
+        with self._lock:
+            session = self._sessions.get(token)
+        if session is not None:
+            session.last_used = time.monotonic()
+            if session.last_used - session.last_touched >= self.touch_interval:
+                session.last_touched = session.last_used
+                if not self.store.touch(token):
+                    # Disconnected or expired through another worker
+                    self._close(session)
+                    return None
+            return session
+
+        with self._open_lock:
+            with self._lock:
+                session = self._sessions.get(token)
+            if session is not None:
+                return session
+            descriptor = self.store.get(token, self.idle_timeout)
+            if descriptor is None:
+                return None
+            db_type, params = descriptor
+            pool = self.open_pool(db_type, params)
+            self.store.touch(token)
+            with self._lock:
+                self._counters['rehydrated'] += 1
+            logging.info(f"Rehydrated {db_type} session from the shared store")
+            return self._attach(token, db_type, pool)
+
+    def disconnect(self, token):
+        with self._lock:
+            session = self._sessions.get(token)
+        if session is not None:
+            self._close(session)
+        return self.store.delete(token) or session is not None
+
+    def _close(self, session):
+        with self._lock:
+            if self._sessions.get(session.token) is not session:
+                return
+            del self._sessions[session.token]
+            self._counters['closed'] += 1
+        try:
+            if self.on_close is not None:
+                self.on_close(session)
+        finally:
+            session.pool.close()
+
+    def expire(self):
+        """Close sessions idle in this worker and drop descriptors idle everywhere."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [session for session in self._sessions.values() if session.last_used < cutoff]
+        for session in idle:
+            logging.info(f"Closing idle {session.db_type} session")
+            self._close(session)
+        removed = self.store.expire(self.idle_timeout)
+        with self._lock:
+            self._counters['expired'] += removed
+        return len(idle) + removed
+
+    def start_reaper(self, interval=60):
+        def reap():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.expire()
+                except Exception as e:
+                    logging.error(f"Error expiring sessions: {e}")
+
+        thread = threading.Thread(target=reap, name='session-reaper', daemon=True)
+        thread.start()
+        return thread
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['local'] = len(self._sessions)
+        stats['stored'] = self.store.count()
+        return stats
@@ -0,0 +1,30 @@
+import re
+
+# Quoted strings and quoted identifiers, so the patterns that scan SQL text can skip over them
+STRING_LITERAL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)")
+# Comments, with string literals matched first (group 1) so that comment markers inside them are left alone
+SQL_COMMENT = re.compile(STRING_LITERAL.pattern + r'|--[^\n]*|/\*.*?\*/', re.DOTALL)
+# Words that make a SELECT or WITH statement change something: a DML part, SELECT ... INTO or FOR UPDATE
+DATA_MODIFYING = re.compile(r'\b(insert|update|delete|merge|into)\b', re.IGNORECASE)
+
+
+def normalize_sql(query):
+    """Collapse whitespace outside string literals and drop trailing semicolons.
+
+    Case is kept: it decides the column labels some engines return, so folding it could serve wrong headers.
+    """
+    parts = STRING_LITERAL.split(query.strip().rstrip(';').strip())
+    return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts))
+
+
+def is_read_only(query):
+    """Whether a statement only reads, so there is nothing to commit after it.
+
+    Decided from the text rather than from whether rows came back: INSERT ... RETURNING returns rows too, and
+    a Postgres WITH can hold a data-modifying statement.
+    """
+    text = SQL_COMMENT.sub(' ', query)
+    head = text.lstrip().split(None, 1)
+    if not head or head[0].lower() not in ('select', 'with', 'values', 'table'):
+        return False
+    return not DATA_MODIFYING.search(text)
@@ -0,0 +1,397 @@
+import difflib
+import os
+import re
+
+import mongo_query
+
+# repair: validate and make one repair call on failure; report: validate only; off: skip
+SQL_VALIDATION_MODE = os.getenv('SQL_VALIDATION_MODE', 'repair')
+
+TOKEN_PATTERN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>[EeNnBbXx]?'(?:[^'\\]|''|\\.)*'|\$(?P<tag>\w*)\$.*?\$(?P=tag)\$)
+  | (?P<dquote>"(?:[^"]|"")*")
+  | (?P<backtick>`[^`]*`)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<param>%s\b|%\(\w+\)s|\?\d*|(?<!:):(?!:)\w+|\$\d+|@@?\w+)
+  | (?P<op>::|<>|!=|<=|>=|\|\||->>|->|[-+*/%<>=~!&|^@\#])
+  | (?P<name>[A-Za-z_][\w$]*)
+  | (?P<punct>[(),.;\[\]{}])
+''', re.VERBOSE | re.DOTALL)
+
+# Words that are never column references. Generous on purpose: a missed check costs less than a false alarm.
+KEYWORDS = frozenset('''
+    all and any array as asc at between both by case cast collate cross current current_date current_time
+    current_timestamp current_user day days default delete desc distinct do else end escape except exists extract
+    false fetch filter first following for from full group having hour hours if ilike in inner insert intersect
+    interval into is join key last lateral leading left like limit localtime localtimestamp minute minutes month
+    months natural next not null nulls of offset on only or order outer over partition preceding primary quarter
+    range recursive regexp replace returning right rlike row rows second seconds select session_user set similar
+    some symmetric table then ties to trailing true union unique unknown unbounded update using values week when
+    where window with within without year years epoch dow doy isodow microseconds milliseconds
+    int integer bigint smallint tinyint real float double precision numeric decimal text varchar char character
+    varying boolean bool date time timestamp timestamptz datetime blob bytea json jsonb uuid signed unsigned
+    binary zone separator materialized user div mod xor straight_join high_priority sql_calc_found_rows
+    ignore duplicate conflict nothing lock share nowait skip locked glob match escape collate nocase rowid oid
+'''.split())
+
+# Keywords that end the table list of a FROM clause or start a new clause
+CLAUSE_KEYWORDS = frozenset('''
+    where group order having limit offset fetch union intersect except window on using set values returning
+    select for into join inner left right full outer cross natural straight_join lateral as from default
+    use force ignore tablesample indexed not lock
+'''.split())
+
+
+def tokenize(query, db_type):
+    """Split SQL into (kind, text, position) tuples; kinds are name, quoted, string, number, op, param, punct."""
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        match = TOKEN_PATTERN.match(query, pos)
+        if match is None:
+            # Unknown syntax: stay silent rather than report errors we cannot back up
+            return None
+        kind = match.lastgroup
+        text = match.group()
+        if kind == 'tag':
+            kind = 'string'
+        if kind == 'dquote':
+            # Double quotes are identifiers in standard SQL but strings in MySQL (and sometimes SQLite)
+            kind = 'quoted' if db_type == 'postgresql' else 'string'
+            text = text[1:-1].replace('""', '"') if kind == 'quoted' else text
+        elif kind == 'backtick':
+            kind, text = 'quoted', text[1:-1]
+        if kind not in ('space', 'comment'):
+            tokens.append((kind, text, match.start()))
+        pos = match.end()
+    return tokens
+
+
+def _matching_parens(tokens):
+    match, stack = {}, []
+    for i, (kind, text, _) in enumerate(tokens):
+        if kind == 'punct' and text == '(':
+            stack.append(i)
+        elif kind == 'punct' and text == ')':
+            if not stack:
+                return None
+            match[stack.pop()] = i
+    return match if not stack else None
+
+
+class Scope:
+    """One SELECT (or statement) level: its FROM sources, output aliases and the names it references."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.sources = {}  # alias or table name -> set of columns, or None when unknown (derived, CTE, function)
+        self.ctes = set()
+        self.aliases = set()
+        self.qualified = []  # (qualifier, column)
+        self.unqualified = []
+        self.has_using = False
+
+    def chain(self):
+        scope = self
+        while scope is not None:
+            yield scope
+            scope = scope.parent
+
+
+class _Analyzer:
+    def __init__(self, tokens, tables):
+        self.tokens = tokens
+        self.tables = {name.lower(): {column['name'].lower() for column in table['columns']}
+                       for name, table in tables.items()}
+        self.table_names = {name.lower(): name for name in tables}
+        self.match = _matching_parens(tokens)
+        self.scopes = []
+        self.errors = []
+
+    def word(self, i):
+        """Lower-cased keyword-able text of token i, or None."""
+        if 0 <= i < len(self.tokens) and self.tokens[i][0] == 'name':
+            return self.tokens[i][1].lower()
+        return None
+
+    def text(self, i):
+        return self.tokens[i][1] if 0 <= i < len(self.tokens) else None
+
+    def is_cte(self, scope, name):
+        return any(name in s.ctes for s in scope.chain())
+
+    def parse(self, scope, start, end):
+        self.scopes.append(scope)
+        i = start
+        if self.word(i) == 'with':
+            i = self.parse_ctes(scope, i + 1, end)
+
+        depth = 0
+        expect_source = None  # keyword that introduced the table reference being waited for
+        in_from = False
+        compound = False
+        consumed = set()
+        while i < end:
+            kind, text, _ = self.tokens[i]
+            word = self.word(i)
+
+            if kind == 'punct' and text == '(':
+                close = self.match[i]
+                if self.word(i + 1) in ('select', 'with'):
+                    self.parse(Scope(scope), i + 1, close)
+                    i = close + 1
+                    if expect_source:
+                        alias, i = self.read_alias(i, end)
+                        if alias:
+                            scope.sources[alias] = None
+                        expect_source = None
+                    continue
+                depth += 1
+                i += 1
+                continue
+            if kind == 'punct' and text == ')':
+                depth -= 1
+                i += 1
+                continue
+
+            if depth == 0:
+                if word in ('union', 'intersect', 'except'):
+                    # Each branch of a compound SELECT has its own FROM; only the WITH before the first is shared
+                    branch = Scope(scope.parent)
+                    branch.ctes = scope.ctes
+                    scope = branch
+                    self.scopes.append(scope)
+                    compound = True
+                    in_from = False
+                    expect_source = None
+                    i += 1
+                    continue
+                if word == 'order' and compound:
+                    return  # ordering of a compound result names its output columns, which are not modelled
+                if word in ('from', 'join', 'update', 'into'):
+                    in_from = word in ('from', 'update')
+                    expect_source = word
+                    i += 1
+                    continue
+                if word == 'only' and expect_source:
+                    i += 1
+                    continue
+                if word in ('using', 'natural'):
+                    scope.has_using = True
+                if word in CLAUSE_KEYWORDS:
+                    in_from = in_from and word in ('join', 'inner', 'left', 'right', 'full', 'outer', 'cross',
+                                                   'natural', 'straight_join', 'lateral')
+                    expect_source = None
+                elif kind == 'punct' and text == ',' and in_from:
+                    expect_source = 'from'
+                    i += 1
+                    continue
+                elif expect_source and kind in ('name', 'quoted'):
+                    i = self.read_source(scope, i, end, expect_source)
+                    expect_source = None
+                    continue
+
+            if i not in consumed and kind in ('name', 'quoted'):
+                self.reference(scope, i, consumed)
+            i += 1
+
+    def parse_ctes(self, scope, i, end):
+        """Register CTE names (all first, so recursive and later CTEs can see them) and parse their bodies."""
+        if self.word(i) == 'recursive':
+            i += 1
+        bodies = []
+        while i < end and self.tokens[i][0] in ('name', 'quoted'):
+            scope.ctes.add(self.text(i).lower())
+            i += 1
+            if self.text(i) == '(':
+                i = self.match[i] + 1
+            if self.word(i) != 'as':
+                return i
+            i += 1
+            while self.word(i) in ('not', 'materialized'):
+                i += 1
+            if self.text(i) != '(':
+                return i
+            close = self.match[i]
+            bodies.append((i + 1, close))
+            i = close + 1
+            if self.text(i) != ',':
+                break
+            i += 1
+        for body_start, body_end in bodies:
+            self.parse(Scope(scope), body_start, body_end)
+        return i
+
+    def read_alias(self, i, end):
+        if self.word(i) == 'as':
+            i += 1
+        if i < end and self.tokens[i][0] in ('name', 'quoted') and self.word(i) not in CLAUSE_KEYWORDS:
+            alias = self.text(i).lower()
+            i += 1
+            if self.text(i) == '(' and i in self.match:
+                i = self.match[i] + 1  # column alias list
+            return alias, i
+        return None, i
+
+    def read_source(self, scope, i, end, keyword):
+        parts = [self.text(i).lower()]
+        i += 1
+        while self.text(i) == '.' and i + 1 < end and self.tokens[i + 1][0] in ('name', 'quoted'):
+            parts.append(self.text(i + 1).lower())
+            i += 2
+        name = parts[-1]
+        columns = None
+        if self.text(i) == '(' and keyword != 'into':
+            # Table-valued function; INSERT INTO t (...) is a column list and is checked as references
+            i = self.match[i] + 1
+            name = None
+        if name is not None and not self.is_cte(scope, name):
+            if name in self.tables:
+                columns = self.tables[name]
+            elif len(parts) == 1 or parts[-2] in ('public', 'main'):
+                self.error(f"Unknown table '{parts[-1]}'", name, self.table_names)
+        alias, i = self.read_alias(i, end)
+        scope.sources[alias or name or f'#{i}'] = columns
+        return i
+
+    def reference(self, scope, i, consumed):
+        if self.text(i - 1) == '.':
+            return  # member of a dotted name that started in a non-identifier position
+        previous = self.tokens[i - 1] if i > 0 else (None, None, None)
+        if self.text(i + 1) == '(' or previous[1] == '::':
+            return  # function call or type cast
+        if self.text(i + 1) == '.':
+            names = [i]
+            j = i
+            while self.text(j + 1) == '.' and j + 2 < len(self.tokens):
+                j += 2
+                names.append(j)
+            consumed.update(names)
+            if len(names) >= 2:
+                qualifier = self.text(names[-2]).lower()
+                column = self.text(names[-1])
+                if column != '*' and self.tokens[names[-1]][0] in ('name', 'quoted'):
+                    scope.qualified.append((qualifier, column.lower()))
+            return
+        if self.tokens[i][0] == 'name' and self.word(i) in KEYWORDS:
+            return
+        name = self.text(i).lower()
+        if previous[1] is not None and previous[1].lower() == 'as':
+            scope.aliases.add(name)
+            return
+        if previous[0] in ('number', 'string', 'quoted') or (previous[0] == 'punct' and previous[1] == ')') or \
+                (previous[0] == 'name' and previous[1].lower() not in KEYWORDS):
+            # Alias without AS, e.g. SELECT AVG(score) average_score
+            scope.aliases.add(name)
+            return
+        scope.unqualified.append(name)
+
+    def error(self, message, name, candidates):
+        close = difflib.get_close_matches(name, list(candidates), n=1, cutoff=0.6)
+        self.errors.append(f"{message} (did you mean '{close[0]}'?)" if close else message)
+
+    def resolve(self):
+        for scope in self.scopes:
+            for qualifier, column in scope.qualified:
+                owner = next((s for s in scope.chain() if qualifier in s.sources), None)
+                if owner is None:
+                    if not self.is_cte(scope, qualifier):
+                        aliases = {alias for s in scope.chain() for alias in s.sources}
+                        self.error(f"Unknown table or alias '{qualifier}' in '{qualifier}.{column}'", qualifier,
+                                   aliases)
+                    continue
+                columns = owner.sources[qualifier]
+                if columns is not None and column not in columns:
+                    self.error(f"Column '{column}' does not exist in '{qualifier}'", column, columns)
+
+            for column in scope.unqualified:
+                if any(column in s.aliases for s in scope.chain()):
+                    continue
+                chain = list(scope.chain())
+                if not any(s.sources for s in chain) or any(None in s.sources.values() for s in chain):
+                    continue  # no FROM, or a source whose columns we cannot know
+                for s in chain:
+                    owners = [alias for alias, columns in s.sources.items() if column in columns]
+                    if owners:
+                        if len(owners) > 1 and not s.has_using:
+                            self.errors.append(
+                                f"Column '{column}' is ambiguous between {', '.join(sorted(owners))}; qualify it")
+                        break
+                else:
+                    known = {c for s in chain for columns in s.sources.values() for c in columns}
+                    self.error(f"Unknown column '{column}'", column, known)
+
+
+def validate_sql(query, db_type, tables):
+    """Resolve tables and columns of a generated statement against the cached schema; returns error messages."""
+    tokens = tokenize(query, db_type)
+    if not tokens:
+        return []
+    head = tokens[0][1].lower()
+    if head not in ('select', 'with', 'insert', 'update', 'delete', '('):
+        return []
+    analyzer = _Analyzer(tokens, tables)
+    if analyzer.match is None:
+        return ['Unbalanced parentheses']
+    try:
+        statements, start = [], 0
+        for i, (kind, text, _) in enumerate(tokens + [('punct', ';', None)]):
+            if kind == 'punct' and text == ';':
+                if i > start:
+                    statements.append((start, i))
+                start = i + 1
+        for start, end in statements:
+            analyzer.parse(Scope(), start, end)
+        analyzer.resolve()
+    except (KeyError, IndexError, TypeError):
+        return []  # syntax we do not model; leave it to the database
+    return list(dict.fromkeys(analyzer.errors))
+
+
+def validate_mongo(query, tables):
+    try:
+        parsed = mongo_query.parse(query)
+    except mongo_query.MongoQueryError as e:
+        return [str(e)]
+    if tables and parsed.collection not in tables:
+        close = difflib.get_close_matches(parsed.collection, list(tables), n=1, cutoff=0.6)
+        hint = f" (did you mean '{close[0]}'?)" if close else ''
+        return [f"Unknown collection '{parsed.collection}'{hint}"]
+    return []
+
+
+def validate_query(query, db_type, tables):
+    if db_type == 'mongodb':
+        return validate_mongo(query, tables)
+    return validate_sql(query, db_type, tables)
+
+
+def referenced_tables(query, tables):
+    """Known tables whose names appear in the query, for the schema excerpt of a repair prompt."""
+    words = {match.lower() for match in re.findall(r'[A-Za-z_][\w$]*', query)}
+    return [name for name in tables if name.lower() in words]
+
+
+def describe_tables(tables, names, limit=50):
+    """Compact 'table(col type, ...)' lines for the given tables, plus the names of the others."""
+    lines = []
+    for name in names:
+        columns = ', '.join(f"{column['name']} {column['type']}".strip() for column in tables[name]['columns'])
+        lines.append(f"{name}({columns})")
+    others = sorted(set(tables) - set(names))
+    if others:
+        shown = ', '.join(others[:limit]) + (', ...' if len(others) > limit else '')
+        lines.append(f"Other tables: {shown}")
+    return '\n'.join(lines)
+
+
+def repair_prompt(query, errors, db_type, tables):
+    names = referenced_tables(query, tables)
+    return (
+        f"The {db_type} query you wrote does not match the database schema:\n"
+        + '\n'.join(f"- {error}" for error in errors)
+        + f"\n\nSchema:\n{describe_tables(tables, names)}\n\n"
+        "Reply with only the corrected query in a code block."
+    )
@@ -0,0 +1,19 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other by plain module name, as when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """The Flask app module, reloaded with its SQLite stores under tmp_path."""
+    for name, filename in (('SESSION_STORE_PATH', 'sessions.sqlite3'),
+                           ('TRANSLATION_CACHE_PATH', 'translations.sqlite3'),
+                           ('QUERY_HISTORY_PATH', 'history.sqlite3')):
+        monkeypatch.setenv(name, str(tmp_path / filename))
+    import app
+    return importlib.reload(app)
@@ -0,0 +1,38 @@
+import pytest
+
+from drivers import Driver, get_driver
+from query_guard import guard_query
+
+
+def test_driver_must_implement_every_engine_hook():
+    class Partial(Driver):
+        name = 'partial'
+
+        def connect(self, params):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+@pytest.mark.parametrize('query, writes, cacheable, returns_rows', [
+    ('SELECT * FROM students', False, True, True),
+    ('SELECT random() FROM students', False, False, True),
+    ("INSERT INTO students (name) VALUES ('x') RETURNING student_id", True, False, False),
+    ('DROP TABLE students', True, False, False),
+])
+def test_sql_statement_classification(query, writes, cacheable, returns_rows):
+    driver = get_driver('sqlite')
+    assert driver.writes(query) is writes
+    assert driver.is_cacheable(query) is cacheable
+    assert driver.returns_rows(query) is returns_rows
+
+
+def test_mongo_queries_are_not_cached_committed_or_guarded():
+    driver = get_driver('mongodb')
+    query = 'db.students.find({})'
+    assert not driver.writes(query)
+    assert not driver.is_cacheable(query)
+    assert driver.returns_rows(query)
+    assert guard_query(None, 'mongodb', query, mode='block') == (query, {'mode': 'block', 'warnings': [],
+                                                                        'limit_injected': None})
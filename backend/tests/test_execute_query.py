@@ -0,0 +1,94 @@
+import json
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'school.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE students (student_id INTEGER PRIMARY KEY, name TEXT)')
+    conn.executemany('INSERT INTO students (name) VALUES (?)', [(f's{i}',) for i in range(5)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def client(app_module, database):
+    client = app_module.app.test_client()
+    response = client.post('/connect/sqlite', json={'database': database})
+    client.environ_base['HTTP_X_SESSION_TOKEN'] = response.get_json()['session']
+    return client
+
+
+def execute(client, query, **options):
+    return client.post('/api/execute_query', json=dict(options, query=query, db_type='sqlite'))
+
+
+def count(client):
+    return execute(client, 'SELECT COUNT(*) AS n FROM students').get_json()['result'][0][0]
+
+
+def test_returning_write_is_committed(client):
+    response = execute(client, "INSERT INTO students (name) VALUES ('new') RETURNING student_id")
+    assert response.status_code == 200
+    assert response.get_json()['result'] == [[6]]
+    assert count(client) == 6
+
+
+def test_streamed_returning_write_is_committed(client):
+    response = execute(client, "INSERT INTO students (name) VALUES ('new') RETURNING student_id", stream='ndjson')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0] == {'columns': ['student_id']}
+    assert lines[1] == [6]
+    assert 'end' in lines[-1]
+    assert count(client) == 6
+
+
+def test_streamed_write_invalidates_cached_reads(client):
+    assert count(client) == 5
+    execute(client, "DELETE FROM students WHERE student_id = 1 RETURNING student_id", stream='ndjson').get_data()
+    assert count(client) == 4
+
+
+@pytest.mark.parametrize('options', [{}, {'stream': 'ndjson'}])
+def test_catalog_is_marked_stale_after_ddl_commits(app_module, client, database, options):
+    catalog = app_module.catalogs[client.environ_base['HTTP_X_SESSION_TOKEN']]
+    seen = []
+
+    def mark_stale():
+        conn = sqlite3.connect(database)
+        seen.append(conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'teachers'").fetchone()[0])
+        conn.close()
+
+    catalog.mark_stale = mark_stale
+    execute(client, 'CREATE TABLE teachers (teacher_id INTEGER PRIMARY KEY)', **options).get_data()
+    assert seen == [1]
+
+
+def connect_another(app_module, database):
+    other = app_module.app.test_client()
+    response = other.post('/connect/sqlite', json={'database': database})
+    other.environ_base['HTTP_X_SESSION_TOKEN'] = response.get_json()['session']
+    return other
+
+
+def test_write_in_one_session_invalidates_reads_cached_by_another(app_module, client, database):
+    other = connect_another(app_module, database)
+    assert count(client) == 5
+    execute(other, 'DELETE FROM students WHERE student_id = 1')
+    assert count(client) == 4
+
+
+def test_result_handle_belongs_to_the_session_that_opened_it(app_module, client, database):
+    handle = execute(client, 'SELECT student_id FROM students ORDER BY student_id', page_size=2).get_json()['handle']
+    other = connect_another(app_module, database)
+    body = {'handle': handle, 'db_type': 'sqlite', 'page_size': 2}
+    assert other.post('/api/execute_query/page', json=body).status_code == 404
+    assert other.post('/api/execute_query/close', json=body).status_code == 404
+    page = client.post('/api/execute_query/page', json=body)
+    assert page.status_code == 200
+    assert page.get_json()['result'] == [[3], [4]]
+    assert client.post('/api/execute_query/close', json=body).status_code == 200
@@ -0,0 +1,165 @@
+import json
+import time
+
+import pytest
+import requests
+
+from llm_client import CircuitBreaker, CircuitOpenError, LLMClient, LLMError
+
+
+class FakeResponse:
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+        self.closed = False
+
+    def json(self):
+        return json.loads(self.text)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """Replays a list of responses or exceptions, one per post()."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def make_client(outcomes, breaker=None, max_retries=2):
+    client = LLMClient('test-key', base_url='http://llm.test/v1', max_retries=max_retries, backoff_base=0,
+                       backoff_max=0, breaker=breaker)
+    client.session = FakeSession(outcomes)
+    return client
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker(threshold=1, reset_after=0.05)
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    time.sleep(0.06)
+    assert breaker.state == 'half-open'
+    return breaker
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(threshold=3, reset_after=60)
+    for _ in range(2):
+        breaker.record_failure()
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_allows_one_trial_when_half_open():
+    breaker = half_open_breaker()
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    breaker.before_call()
+
+
+def test_failed_trial_reopens_breaker():
+    breaker = half_open_breaker()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_post_returns_response_and_closes_breaker():
+    breaker = half_open_breaker()
+    client = make_client([FakeResponse(200)], breaker=breaker)
+    assert client.post('chat/completions', {}).status_code == 200
+    assert breaker.state == 'closed'
+
+
+def test_post_retries_retryable_status():
+    client = make_client([FakeResponse(503), requests.exceptions.Timeout('slow'), FakeResponse(200)])
+    assert client.post('chat/completions', {}).status_code == 200
+    assert client.session.calls == 3
+    assert client.breaker.failures == 0
+
+
+def test_post_gives_up_after_max_retries():
+    client = make_client([FakeResponse(500)] * 3)
+    with pytest.raises(LLMError) as excinfo:
+        client.post('chat/completions', {})
+    assert excinfo.value.status_code == 500
+    assert client.session.calls == 3
+
+
+def test_client_error_is_not_retried_and_does_not_count():
+    client = make_client([FakeResponse(400, 'bad request')])
+    with pytest.raises(LLMError) as excinfo:
+        client.post('chat/completions', {})
+    assert excinfo.value.status_code == 400
+    assert client.session.calls == 1
+    assert client.breaker.failures == 0
+
+
+def test_client_error_releases_half_open_trial():
+    breaker = half_open_breaker()
+    client = make_client([FakeResponse(400), FakeResponse(200)], breaker=breaker)
+    with pytest.raises(LLMError):
+        client.post('chat/completions', {})
+    assert client.post('chat/completions', {}).status_code == 200
+    assert breaker.state == 'closed'
+
+
+def test_unexpected_error_releases_half_open_trial():
+    breaker = half_open_breaker()
+    client = make_client([requests.exceptions.InvalidURL('bad url'), FakeResponse(200)], breaker=breaker)
+    with pytest.raises(requests.exceptions.InvalidURL):
+        client.post('chat/completions', {})
+    assert client.post('chat/completions', {}).status_code == 200
+    assert breaker.state == 'closed'
+
+
+def completion(content):
+    return FakeResponse(200, json.dumps({'choices': [{'message': {'role': 'assistant', 'content': content}}]}))
+
+
+def test_chat_completion_returns_decoded_body():
+    client = make_client([completion('SELECT 1')])
+    assert client.chat_completion({})['choices'][0]['message']['content'] == 'SELECT 1'
+
+
+@pytest.mark.parametrize('body', ['<html>bad gateway</html>', '{}', '{"choices": []}', '{"choices": [{}]}',
+                                  json.dumps({'choices': [{'message': {'content': None}}]})])
+def test_malformed_completion_raises_llm_error(body):
+    client = make_client([FakeResponse(200, body)], max_retries=0)
+    with pytest.raises(LLMError, match='Malformed LLM response'):
+        client.chat_completion({})
+    assert client.breaker.failures == 1
+
+
+def test_malformed_completions_open_the_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_after=60)
+    client = make_client([FakeResponse(200, 'not json'), FakeResponse(200, 'not json')], breaker=breaker,
+                         max_retries=0)
+    for _ in range(2):
+        with pytest.raises(LLMError):
+            client.chat_completion({})
+    with pytest.raises(CircuitOpenError):
+        client.chat_completion({})
+
+
+def test_malformed_completion_is_retried():
+    client = make_client([FakeResponse(200, 'not json'), completion('SELECT 1')])
+    assert client.chat_completion({})['choices'][0]['message']['content'] == 'SELECT 1'
+    assert client.session.calls == 2
+    assert client.breaker.failures == 0
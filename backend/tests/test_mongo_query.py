@@ -0,0 +1,107 @@
+import datetime
+
+import pytest
+
+from db_pool import SharedClientPool
+from mongo_query import MongoQuery, MongoQueryError, parse
+
+
+def test_find_with_cursor_modifiers():
+    query = parse("db.students.find({age: {$gt: 15}}, {name: 1, _id: 0}).sort({age: -1}).skip(5).limit(10);")
+    assert query.collection == 'students'
+    assert query.operation == 'find'
+    assert query.filter == {'age': {'$gt': 15}}
+    assert query.projection == {'name': 1, '_id': 0}
+    assert query.sort == [('age', -1)]
+    assert (query.skip, query.limit) == (5, 10)
+    assert query.columns_hint() == ['name']
+
+
+def test_literals_and_constructors():
+    query = parse("""db.getCollection('exam_results').find({"note": 'it\\'s', passed: true, grade: null,
+                     score: 9.5, exam_date: {$gte: ISODate('2024-01-01T00:00:00Z')}})""")
+    assert query.collection == 'exam_results'
+    assert query.filter['note'] == "it's"
+    assert query.filter['passed'] is True
+    assert query.filter['grade'] is None
+    assert query.filter['score'] == 9.5
+    assert query.filter['exam_date']['$gte'] == datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def test_find_one_and_count():
+    assert parse('db.students.findOne({name: "Ann"})').limit == 1
+    assert parse('db.students.count({age: 16})').operation == 'countDocuments'
+
+
+def test_aggregate_pipeline():
+    query = parse('db.exam_results.aggregate([{$group: {_id: "$subject_id", avg: {$avg: "$score"}}}])')
+    assert query.operation == 'aggregate'
+    assert query.as_pipeline() == [{'$group': {'_id': '$subject_id', 'avg': {'$avg': '$score'}}}]
+
+
+def test_find_as_pipeline():
+    query = parse('db.students.find({age: 16}).sort({name: 1}).limit(3)')
+    assert query.as_pipeline() == [{'$match': {'age': 16}}, {'$sort': {'name': 1}}, {'$limit': 3}]
+
+
+def test_aggregation_columns_fix_layout():
+    query = MongoQuery.aggregation('students', [], columns=['name', 'age'])
+    assert query.columns_hint() == ['name', 'age']
+
+
+@pytest.mark.parametrize('text', [
+    'db.students.find({$where: "this.age > 15"})',
+    'db.students.aggregate([{$group: {_id: 1, x: {$accumulator: {}}}}])',
+    'db.students.aggregate([{$match: {}}, {$out: "copy"}])',
+    'db.students.aggregate([{$merge: {into: "copy"}}])',
+    'db.students.aggregate([{"$out": "copy"}])',
+])
+def test_forbidden_operators_rejected(text):
+    with pytest.raises(MongoQueryError, match='not allowed'):
+        parse(text)
+
+
+@pytest.mark.parametrize('text', [
+    'students.find({})',
+    'db.students.drop()',
+    'db.students.insertOne({name: "x"})',
+    'db.students.find({}).forEach(printjson)',
+    'db.students.find({}); db.students.drop()',
+    'db.students.find({name: eval("1")})',
+    'db.students.find("name")',
+    'db.students.find({}, [1])',
+    'db.students.count(5)',
+    'db.students.aggregate([1])',
+    'db.students.find({}).sort("name")',
+    'db.students.find({}).sort([["name", 1]])',
+    'db.students.find({}).sort({name: "up"})',
+    'db.students.find({}).sort({name: true})',
+    'db.students.find({}).limit("ten")',
+    'db.students.find({}).limit({})',
+    'db.students.find({}).limit(2.5)',
+    'db.students.find({}).limit(true)',
+    'db.students.find({}).skip(-1)',
+    'db.students.find({}).skip(1e999)',
+])
+def test_unsupported_statements_rejected(text):
+    with pytest.raises(MongoQueryError):
+        parse(text)
+
+
+def test_whole_number_floats_are_accepted():
+    query = parse('db.students.find({}, null).sort({name: -1, score: {$meta: "textScore"}}).limit(10.0)')
+    assert query.limit == 10
+    assert query.projection is None
+
+
+@pytest.mark.parametrize('path, options', [('/api/execute_query', {}), ('/api/execute_query', {'stream': 'ndjson'}),
+                                           ('/api/jobs', {})])
+def test_malformed_query_is_a_client_error(app_module, path, options):
+    mongomock = pytest.importorskip('mongomock')
+    client = app_module.app.test_client()
+    pool = SharedClientPool('mongodb', mongomock.MongoClient('mongodb://localhost/school'))
+    session = app_module.sessions.connect('mongodb', {'database': 'school'}, pool)
+    response = client.post(path, json=dict(options, db_type='mongodb', query='db.students.find({}).limit("ten")'),
+                           headers={'X-Session-Token': session.token})
+    assert response.status_code == 400
+    assert 'non-negative whole number' in response.get_json()['error']
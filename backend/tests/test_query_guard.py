@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+from query_guard import QueryBlockedError, guard_query, inject_limit, strip_trailing_comments
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE students (student_id INTEGER PRIMARY KEY, name TEXT, age INTEGER)')
+    conn.executemany('INSERT INTO students (name, age) VALUES (?, ?)', [(f's{i}', 14 + i % 4) for i in range(20)])
+    yield conn
+    conn.close()
+
+
+def test_appends_limit():
+    assert inject_limit('SELECT * FROM students;', 10) == ('SELECT * FROM students LIMIT 10', True)
+
+
+@pytest.mark.parametrize('query', [
+    'SELECT * FROM students LIMIT 5',
+    'SELECT TOP 5 * FROM students',
+    'SELECT * FROM students FETCH FIRST 5 ROWS ONLY',
+    'SELECT * FROM students FOR UPDATE',
+    'SELECT * INTO backup FROM students',
+    'UPDATE students SET age = 1',
+])
+def test_leaves_bounded_and_non_select_queries(query):
+    assert inject_limit(query, 10) == (query, False)
+
+
+def test_limit_inside_subquery_or_literal_does_not_count():
+    query, injected = inject_limit("SELECT * FROM (SELECT * FROM students LIMIT 5) s WHERE name <> 'limit 1'", 10)
+    assert injected
+    assert query.endswith(' LIMIT 10')
+
+
+def test_limit_inside_comment_does_not_count():
+    assert inject_limit('SELECT * FROM students -- limit 5', 10) == ('SELECT * FROM students LIMIT 10', True)
+
+
+@pytest.mark.parametrize('query', [
+    'SELECT * FROM students -- all rows',
+    'SELECT * FROM students; -- all rows',
+    'SELECT * FROM students /* all\nrows */',
+    'SELECT * FROM students -- all rows\n-- second note\n',
+])
+def test_trailing_comment_does_not_swallow_limit(query):
+    assert inject_limit(query, 10) == ('SELECT * FROM students LIMIT 10', True)
+
+
+def test_comment_markers_in_literals_are_kept():
+    query = "SELECT * FROM students WHERE name = '--x' OR name = '/*y*/'"
+    assert strip_trailing_comments(query) == query
+    assert inject_limit(query, 10) == (f'{query} LIMIT 10', True)
+
+
+def test_comment_before_last_token_is_kept():
+    query = 'SELECT * FROM students -- adults\nWHERE age > 17'
+    assert inject_limit(query, 10) == (f'{query} LIMIT 10', True)
+
+
+def test_limit_goes_before_offset():
+    assert inject_limit('SELECT * FROM students ORDER BY name OFFSET 5', 10) == \
+        ('SELECT * FROM students ORDER BY name LIMIT 10 OFFSET 5', True)
+
+
+def test_offset_in_subquery_is_not_moved():
+    assert inject_limit('SELECT * FROM (SELECT * FROM students LIMIT 3 OFFSET 1) s', 10) == \
+        ('SELECT * FROM (SELECT * FROM students LIMIT 3 OFFSET 1) s LIMIT 10', True)
+
+
+@pytest.mark.parametrize('query', [
+    'SELECT * FROM students -- all rows',
+    'SELECT * FROM students ORDER BY name OFFSET 5 -- skip five',
+])
+def test_injected_query_runs_on_sqlite(conn, query):
+    guarded, report = guard_query(conn, 'sqlite', query, mode='block', default_limit=3)
+    assert report['limit_injected'] == 3
+    assert len(conn.execute(guarded).fetchall()) == 3
+
+
+def test_guard_blocks_cross_join_on_sqlite(conn):
+    with pytest.raises(QueryBlockedError):
+        guard_query(conn, 'sqlite', 'SELECT * FROM students a, students b, students c, students d', mode='block')
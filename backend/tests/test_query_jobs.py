@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from drivers import get_driver
+from query_jobs import QueryJobManager
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'school.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE students (student_id INTEGER PRIMARY KEY, name TEXT)')
+    conn.executemany('INSERT INTO students (name) VALUES (?)', [(f's{i}',) for i in range(5)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def pool(database):
+    pool = get_driver('sqlite').open_pool({'database': database})
+    yield pool
+    pool.close()
+
+
+def run(manager, pool, query):
+    job = manager.submit('owner', pool, 'sqlite', query)
+    job.future.result(timeout=10)
+    return job
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_select_job_collects_rows(pool):
+    job = run(QueryJobManager(workers=1), pool, 'SELECT student_id FROM students ORDER BY student_id')
+    assert job.state == 'succeeded'
+    assert job.columns == ['student_id']
+    assert job.rows == [[1], [2], [3], [4], [5]]
+
+
+def test_returning_write_job_is_committed(pool, database):
+    job = run(QueryJobManager(workers=1), pool, "INSERT INTO students (name) VALUES ('new') RETURNING student_id")
+    assert job.state == 'succeeded'
+    assert job.rows == [[6]]
+    assert count(database) == 6
+
+
+def test_truncated_returning_write_is_still_committed(pool, database):
+    job = run(QueryJobManager(workers=1, max_rows=2), pool, 'DELETE FROM students RETURNING student_id')
+    assert job.state == 'succeeded'
+    assert job.truncated
+    assert count(database) == 0
+
+
+def test_jobs_are_scoped_to_their_owner(pool):
+    manager = QueryJobManager(workers=1)
+    job = run(manager, pool, 'SELECT 1')
+    assert manager.get(job.id, 'owner') is job
+    assert manager.get(job.id, 'someone else') is None
+    assert manager.list('someone else') == []
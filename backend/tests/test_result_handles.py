@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from drivers import get_driver
+from result_handles import ResultHandleStore
+from sql_text import is_read_only
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'school.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE students (student_id INTEGER PRIMARY KEY, name TEXT)')
+    conn.executemany('INSERT INTO students (name) VALUES (?)', [(f's{i}',) for i in range(5)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def pool(database):
+    pool = get_driver('sqlite').open_pool({'database': database})
+    yield pool
+    pool.close()
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('query, read_only', [
+    ('SELECT * FROM students', True),
+    ("  -- note\nWITH s AS (SELECT 1) SELECT * FROM s WHERE 'insert' <> ''", True),
+    ('VALUES (1)', True),
+    ('INSERT INTO students (name) VALUES (1) RETURNING student_id', False),
+    ('WITH moved AS (DELETE FROM students RETURNING *) SELECT * FROM moved', False),
+    ('SELECT * INTO backup FROM students', False),
+    ('SELECT * FROM students FOR UPDATE', False),
+    ('UPDATE students SET name = name', False),
+    ('CREATE TABLE t (x INTEGER)', False),
+])
+def test_is_read_only(query, read_only):
+    assert is_read_only(query) is read_only
+
+
+def test_returning_write_is_committed(pool, database):
+    store = ResultHandleStore()
+    query = "INSERT INTO students (name) VALUES ('new') RETURNING student_id"
+    columns, rows, handle = store.open(pool, 'sqlite', query)
+    assert columns == ['student_id']
+    assert rows == [[6]]
+    assert handle is None
+    assert count(database) == 6
+
+
+def test_returning_rows_beyond_the_first_page_are_returned(pool, database):
+    store = ResultHandleStore()
+    columns, rows, handle = store.open(pool, 'sqlite', 'DELETE FROM students RETURNING student_id', page_size=2)
+    assert sorted(row[0] for row in rows) == [1, 2, 3, 4, 5]
+    assert handle is None
+    assert count(database) == 0
+
+
+def test_write_without_rows_is_committed(pool, database):
+    ResultHandleStore().open(pool, 'sqlite', "UPDATE students SET name = 'x'")
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM students WHERE name = 'x'").fetchone()[0] == 5
+    conn.close()
+
+
+def test_select_pages_through_a_handle(pool):
+    store = ResultHandleStore()
+    columns, rows, handle = store.open(pool, 'sqlite', 'SELECT student_id FROM students ORDER BY student_id',
+                                       page_size=2)
+    assert rows == [[1], [2]]
+    assert handle is not None
+    assert store.fetch(handle, 2) == (['student_id'], [[3], [4]], True)
+    assert store.fetch(handle, 2) == (['student_id'], [[5]], False)
+    assert store.fetch(handle, 2) is None
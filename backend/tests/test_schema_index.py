@@ -0,0 +1,77 @@
+import threading
+
+from schema_index import SchemaIndex
+
+
+def table(name, columns, primary_key=(), foreign_keys=()):
+    return {'name': name, 'comment': None, 'primary_key': list(primary_key),
+            'columns': [{'name': column, 'type': 'INTEGER', 'comment': None} for column in columns],
+            'foreign_keys': [{'column': c, 'ref_table': t, 'ref_column': r} for c, t, r in foreign_keys]}
+
+
+class FakeCatalog:
+    db_type = 'sqlite'
+
+    def __init__(self, tables):
+        self.version = 0
+        self.tables = tables
+
+    def ensure_loaded(self):
+        pass
+
+    def replace(self, tables):
+        self.tables = tables
+        self.version += 1
+
+
+def school():
+    return {
+        'students': table('students', ['student_id', 'name', 'age'], ['student_id']),
+        'subjects': table('subjects', ['subject_id', 'subject_name'], ['subject_id']),
+        'exam_results': table('exam_results', ['result_id', 'student_id', 'subject_id', 'score'], ['result_id']),
+    }
+
+
+def test_rank_and_summarize():
+    index = SchemaIndex(FakeCatalog(school()))
+    assert index.rank('average exam score')[0] == 'exam_results'
+    summary = index.summarize('average exam score per student')
+    assert summary['tables'][0] == 'exam_results'
+    assert 'exam_results.student_id = students.student_id (inferred)' in summary['join_keys']
+
+
+def test_select_adds_bridge_tables():
+    index = SchemaIndex(FakeCatalog(school()), top_n=2, token_budget=0)
+    index.sync()
+    assert set(index.select('student names and subject names')) == {'students', 'subjects', 'exam_results'}
+
+
+def test_search_is_consistent_while_catalog_changes():
+    catalog = FakeCatalog(school())
+    index = SchemaIndex(catalog)
+    index.sync()
+    errors = []
+    done = threading.Event()
+
+    def churn():
+        wide = dict(school(), **{f'extra_{i}': table(f'extra_{i}', ['student_id', 'score']) for i in range(50)})
+        for i in range(200):
+            catalog.replace(wide if i % 2 else school())
+            index.sync()
+        done.set()
+
+    def search():
+        try:
+            while not done.is_set():
+                index.rank('student exam score')
+                index.select('student exam score')
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=search) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    churn()
+    for reader in readers:
+        reader.join()
+    assert errors == []
@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'school.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE students (student_id INTEGER PRIMARY KEY, name TEXT)')
+    conn.commit()
+    conn.close()
+    return path
+
+
+def connect(client, database):
+    response = client.post('/connect/sqlite', json={'database': database})
+    assert response.status_code == 200
+    return response.get_json()['session']
+
+
+def test_token_required_by_default(app_module, database):
+    client = app_module.app.test_client()
+    token = connect(client, database)
+    assert client.get('/api/tables?db=sqlite').status_code == 401
+    response = client.get('/api/tables?db=sqlite', headers={'X-Session-Token': token})
+    assert response.status_code == 200
+
+
+def test_unknown_token_is_not_found(app_module, database):
+    client = app_module.app.test_client()
+    connect(client, database)
+    response = client.get('/api/tables?db=sqlite', headers={'X-Session-Token': 'not-a-session'})
+    assert response.status_code == 400
+
+
+def test_single_user_mode_falls_back_to_latest_session(app_module, database, monkeypatch):
+    monkeypatch.setattr(app_module, 'SINGLE_USER_MODE', 'on')
+    client = app_module.app.test_client()
+    connect(client, database)
+    assert client.get('/api/tables?db=sqlite').status_code == 200
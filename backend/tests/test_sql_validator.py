@@ -0,0 +1,62 @@
+import pytest
+
+from sql_validator import repair_prompt, validate_query, validate_sql
+
+
+def table(name, columns):
+    return {'name': name, 'columns': [{'name': column, 'type': 'INTEGER'} for column in columns],
+            'primary_key': [columns[0]], 'foreign_keys': []}
+
+
+TABLES = {
+    'students': table('students', ['student_id', 'name', 'age', 'grade_level']),
+    'exam_results': table('exam_results', ['result_id', 'student_id', 'subject_id', 'score', 'exam_date']),
+}
+
+
+@pytest.mark.parametrize('query', [
+    'SELECT name FROM students WHERE age > 15',
+    'SELECT s.name, AVG(e.score) AS avg_score FROM students s JOIN exam_results e USING (student_id) '
+    'GROUP BY s.name ORDER BY avg_score',
+    'WITH top AS (SELECT student_id, MAX(score) AS best FROM exam_results GROUP BY student_id) '
+    'SELECT s.name, t.best FROM students s JOIN top t ON t.student_id = s.student_id',
+    "SELECT 'nme' AS label FROM students -- nme",
+    'SELECT student_id, name FROM students UNION SELECT student_id, subject_id FROM exam_results',
+    'WITH s AS (SELECT student_id FROM students) SELECT student_id FROM s '
+    'UNION ALL SELECT student_id FROM exam_results ORDER BY student_id',
+    'SELECT name FROM students EXCEPT SELECT name FROM students WHERE student_id IN '
+    '(SELECT student_id FROM exam_results)',
+])
+def test_valid_queries_pass(query):
+    assert validate_sql(query, 'sqlite', TABLES) == []
+
+
+@pytest.mark.parametrize('query, error', [
+    ('SELECT nme FROM students', "Unknown column 'nme' (did you mean 'name'?)"),
+    ('SELECT name FROM student', "Unknown table 'student' (did you mean 'students'?)"),
+    ('SELECT x.name FROM students s', "Unknown table or alias 'x' in 'x.name'"),
+    ('SELECT student_id FROM students s JOIN exam_results e ON s.student_id = e.student_id',
+     "Column 'student_id' is ambiguous between e, s; qualify it"),
+    ('SELECT name FROM students WHERE student_id IN (SELECT student_id FROM exam_results WHERE scor > 90)',
+     "Unknown column 'scor' (did you mean 'score'?)"),
+    ('SELECT name FROM (students', 'Unbalanced parentheses'),
+    ('SELECT name FROM students UNION SELECT score FROM exam_result',
+     "Unknown table 'exam_result' (did you mean 'exam_results'?)"),
+    ('SELECT name FROM students UNION SELECT name FROM exam_results', "Unknown column 'name'"),
+])
+def test_schema_errors_are_reported(query, error):
+    assert validate_sql(query, 'sqlite', TABLES) == [error]
+
+
+def test_mongo_queries_check_the_collection():
+    assert validate_query('db.students.find({})', 'mongodb', TABLES) == []
+    assert validate_query('db.student.find({})', 'mongodb', TABLES) == \
+        ["Unknown collection 'student' (did you mean 'students'?)"]
+    assert validate_query('db.students.drop()', 'mongodb', TABLES) == ['Unsupported operation drop()']
+
+
+def test_repair_prompt_lists_errors_and_referenced_tables():
+    prompt = repair_prompt('SELECT nme FROM students', ["Unknown column 'nme'"], 'sqlite', TABLES)
+    assert "- Unknown column 'nme'" in prompt
+    assert 'students(student_id INTEGER, name INTEGER, age INTEGER, grade_level INTEGER)' in prompt
+    assert 'Other tables: exam_results' in prompt
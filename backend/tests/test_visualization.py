@@ -0,0 +1,103 @@
+import math
+import sqlite3
+
+import pytest
+
+from drivers import get_driver
+from visualization import VisualizationError, column_kind, detect_chart, lttb, positive_int
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute('CREATE TABLE readings (t INTEGER, value REAL, day TEXT, sensor TEXT)')
+    conn.executemany('INSERT INTO readings VALUES (?, ?, ?, ?)', [
+        (i, math.sin(i / 50) * 100, f'2024-01-{1 + i % 28:02d}', f's{i % 3}') for i in range(5000)])
+    yield conn
+    conn.close()
+
+
+def wave(count):
+    return [(i, math.sin(i / 20), None) for i in range(count)]
+
+
+def test_lttb_keeps_endpoints_and_threshold():
+    points = wave(1000)
+    selected = lttb(iter(points), len(points), 50)
+    assert len(selected) == 50
+    assert selected[0] == points[0]
+    assert selected[-1] == points[-1]
+    xs = [point[0] for point in selected]
+    assert xs == sorted(xs)
+
+
+def test_lttb_keeps_peaks():
+    points = [(i, 0.0, None) for i in range(1000)]
+    points[500] = (500, 10.0, None)
+    assert (500, 10.0, None) in lttb(points, len(points), 20)
+
+
+@pytest.mark.parametrize('count, threshold', [(10, 50), (10, 2), (0, 10)])
+def test_lttb_returns_small_series_whole(count, threshold):
+    points = wave(count)
+    assert lttb(points, count, threshold) == points
+
+
+def test_column_kind():
+    assert column_kind([1, 2.5, None]) == 'numeric'
+    assert column_kind(['2024-01-01', '2024-02-01']) == 'temporal_text'
+    assert column_kind(['a', 'b']) == 'categorical'
+    assert column_kind([None]) == 'empty'
+    assert column_kind([True, False]) == 'categorical'
+
+
+def test_detect_chart():
+    kinds = {'day': 'temporal_text', 'value': 'numeric', 'sensor': 'categorical', 't': 'numeric'}
+    assert detect_chart(['day', 'value'], kinds) == {'kind': 'line', 'x': 'day', 'y': ['value']}
+    assert detect_chart(['sensor', 'value'], kinds) == {'kind': 'bar', 'x': 'sensor', 'y': ['value']}
+    assert detect_chart(['value'], kinds) == {'kind': 'histogram', 'x': 'value', 'y': []}
+    assert detect_chart(['t', 'value'], kinds) == {'kind': 'scatter', 'x': 't', 'y': ['value']}
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+def test_series_is_downsampled(conn, method):
+    result = get_driver('sqlite').visualizer(conn, 'SELECT t, value FROM readings ORDER BY t;').build(
+        {'kind': 'line', 'x': 't', 'y': ['value'], 'method': method, 'points': 100})
+    assert result['source_rows'] == 5000
+    assert 0 < result['points'] <= 100
+    assert result['x'][0] == 0
+    assert result['x'] == sorted(result['x'])
+    assert max(result['series'][0]['data']) == pytest.approx(100, abs=1)
+
+
+def test_histogram_counts_every_row(conn):
+    result = get_driver('sqlite').visualizer(conn, 'SELECT value FROM readings').build({'bins': '10'})
+    assert result['chart'] == 'histogram'
+    assert len(result['x']) == 10
+    assert sum(result['series'][0]['data']) == 5000
+
+
+def test_bar_groups_in_database(conn):
+    result = get_driver('sqlite').visualizer(conn, 'SELECT sensor, value FROM readings').build({'agg': 'count'})
+    assert result['chart'] == 'bar'
+    assert sorted(result['x']) == ['s0', 's1', 's2']
+
+
+@pytest.mark.parametrize('chart', [
+    {'kind': 'histogram', 'x': 'value', 'bins': 'abc'},
+    {'kind': 'histogram', 'x': 'value', 'bins': 0},
+    {'kind': 'line', 'x': 't', 'y': ['value'], 'points': -5},
+    {'kind': 'line', 'x': 't', 'y': ['value'], 'points': '1.5'},
+    {'kind': 'line', 'x': 't', 'y': ['value'], 'points': [10]},
+    {'kind': 'pie', 'x': 't'},
+    {'kind': 'line', 'x': 'missing', 'y': ['value']},
+])
+def test_invalid_chart_options_are_rejected(conn, chart):
+    with pytest.raises(VisualizationError):
+        get_driver('sqlite').visualizer(conn, 'SELECT t, value FROM readings').build(chart)
+
+
+def test_positive_int_defaults():
+    assert positive_int(None, 'bins', 30) == 30
+    assert positive_int('', 'bins', 30) == 30
+    assert positive_int('12', 'bins', 30) == 12
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+TRANSLATION_CACHE_PATH = os.getenv(
+    'TRANSLATION_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'translation_cache.sqlite3'))
+TRANSLATION_CACHE_TTL = float(os.getenv('TRANSLATION_CACHE_TTL', str(7 * 24 * 3600)))
+TRANSLATION_CACHE_MEMORY_SIZE = int(os.getenv('TRANSLATION_CACHE_MEMORY_SIZE', '1000'))
+TRANSLATION_CACHE_DISK_SIZE = int(os.getenv('TRANSLATION_CACHE_DISK_SIZE', '50000'))
+
+
+def normalize_message(message):
+    """Lower-case, collapse whitespace and drop trailing punctuation so trivial variants share a key."""
+    message = re.sub(r'\s+', ' ', message.strip().lower())
+    return message.rstrip(' ?.!;')
+
+
+class TranslationCache:
+    """Two-tier (in-memory LRU + SQLite file) cache of generated queries."""
+
+    def __init__(self, path=TRANSLATION_CACHE_PATH, ttl=TRANSLATION_CACHE_TTL,
+                 memory_size=TRANSLATION_CACHE_MEMORY_SIZE, disk_size=TRANSLATION_CACHE_DISK_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory = OrderedDict()  # key -> (query, stored_at)
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._disk = None
+        try:
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, query TEXT NOT NULL, stored_at REAL NOT NULL, last_access REAL NOT NULL)")
+            self._disk.execute("CREATE INDEX IF NOT EXISTS translations_last_access ON translations (last_access)")
+            self._disk.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Translation cache disk tier disabled, could not open {path}: {e}")
+            self._disk = None
+
+    @staticmethod
+    def make_key(message, db_type, fingerprint):
+        raw = f"{db_type}\0{fingerprint}\0{normalize_message(message)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                query, stored_at = entry
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return query
+                del self._memory[key]
+
+            if self._disk is not None:
+                try:
+                    row = self._disk.execute(
+                        "SELECT query, stored_at FROM translations WHERE key = ?", (key,)).fetchone()
+                    if row is not None and now - row[1] <= self.ttl:
+                        self._disk.execute("UPDATE translations SET last_access = ? WHERE key = ?", (now, key))
+                        self._disk.commit()
+                        self._remember(key, row[0], row[1])
+                        self._counters['disk_hits'] += 1
+                        return row[0]
+                except sqlite3.Error as e:
+                    logging.warning(f"Translation cache disk lookup failed: {e}")
+
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, key, query):
+        now = time.time()
+        with self._lock:
+            self._remember(key, query, now)
+            self._counters['stores'] += 1
+            if self._disk is not None:
+                try:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO translations (key, query, stored_at, last_access) VALUES (?, ?, ?, ?)",
+                        (key, query, now, now))
+                    self._evict_disk(now)
+                    self._disk.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"Translation cache disk write failed: {e}")
+
+    def _remember(self, key, query, stored_at):
+        self._memory[key] = (query, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def _evict_disk(self, now):
+        cur = self._disk.execute("DELETE FROM translations WHERE stored_at < ?", (now - self.ttl,))
+        self._counters['evictions'] += cur.rowcount
+        count = self._disk.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        if count > self.disk_size:
+            cur = self._disk.execute(
+                "DELETE FROM translations WHERE key IN "
+                "(SELECT key FROM translations ORDER BY last_access LIMIT ?)", (count - self.disk_size,))
+            self._counters['evictions'] += cur.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM translations")
+                self._disk.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+            if self._disk is not None:
+                stats['disk_entries'] = self._disk.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,481 @@
+import abc
+import datetime
+import decimal
+import logging
+import os
+
+import mongo_query
+from result_encoding import convert_value
+from rule_engine import quote_identifier
+
+VIZ_TARGET_POINTS = int(os.getenv('VIZ_TARGET_POINTS', '1000'))
+VIZ_HISTOGRAM_BINS = int(os.getenv('VIZ_HISTOGRAM_BINS', '30'))
+VIZ_MAX_CATEGORIES = int(os.getenv('VIZ_MAX_CATEGORIES', '50'))
+VIZ_SAMPLE_ROWS = int(os.getenv('VIZ_SAMPLE_ROWS', '200'))
+VIZ_DOWNSAMPLE = os.getenv('VIZ_DOWNSAMPLE', 'lttb')  # lttb or minmax
+# Aggregations scan the whole result by design, so the cost guard only warns by default
+VIZ_GUARD_MODE = os.getenv('VIZ_GUARD_MODE', 'warn')
+
+CHART_KINDS = ('line', 'scatter', 'bar', 'histogram')
+AGGREGATES = {'sum': 'SUM', 'avg': 'AVG', 'min': 'MIN', 'max': 'MAX', 'count': 'COUNT'}
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class VisualizationError(ValueError):
+    """Raised when a result cannot be charted as requested."""
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def column_kind(values):
+    """Classify a sampled column as numeric, temporal, categorical or empty."""
+    sample = [value for value in values if value is not None]
+    if not sample:
+        return 'empty'
+    if all(isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool) for value in sample):
+        return 'numeric'
+    if all(isinstance(value, (datetime.date, datetime.datetime)) for value in sample):
+        return 'temporal'
+    # SQLite and many schemas keep dates as ISO text
+    if all(isinstance(value, str) and len(value) >= 10 and _parse_timestamp(value) for value in sample[:20]):
+        return 'temporal_text'
+    return 'categorical'
+
+
+def detect_chart(columns, kinds):
+    """Pick a chart for a result shape: {'kind', 'x', 'y'}, or None when nothing sensible fits."""
+    temporal = [column for column in columns if kinds[column] in ('temporal', 'temporal_text')]
+    numeric = [column for column in columns if kinds[column] == 'numeric']
+    categorical = [column for column in columns if kinds[column] == 'categorical']
+    if temporal and numeric:
+        return {'kind': 'line', 'x': temporal[0], 'y': numeric[:3]}
+    if categorical:
+        return {'kind': 'bar', 'x': categorical[0], 'y': numeric[:3]}
+    if temporal:
+        return {'kind': 'histogram', 'x': temporal[0], 'y': []}
+    if len(numeric) == 1:
+        return {'kind': 'histogram', 'x': numeric[0], 'y': []}
+    if len(numeric) >= 2:
+        return {'kind': 'scatter', 'x': numeric[0], 'y': numeric[1:4]}
+    return None
+
+
+def to_number(value):
+    """Numeric position of an x value, for binning and triangle areas."""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return to_number(datetime.datetime(value.year, value.month, value.day))
+    if isinstance(value, str):
+        parsed = _parse_timestamp(value)
+        return to_number(parsed) if parsed else None
+    if value is None:
+        return None
+    return float(value)
+
+
+def from_epoch(seconds):
+    # Millisecond rounding hides the float noise of julianday() and EXTRACT(EPOCH ...) arithmetic
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=round(seconds * 1000))).isoformat()
+
+
+def x_value(value, kind):
+    """JSON form of an x value; temporal text is normalized to the ISO form used for aggregated buckets."""
+    if kind == 'temporal_text':
+        parsed = _parse_timestamp(value)
+        return parsed.isoformat() if parsed else value
+    return convert_value(value)
+
+
+def positive_int(value, name, default):
+    """A positive integer chart option from the request body, or default when it is not given."""
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise VisualizationError(f"{name} must be a positive integer")
+    if number < 1 or isinstance(value, bool):
+        raise VisualizationError(f"{name} must be a positive integer")
+    return number
+
+
+def _chunks(items, size):
+    """Consecutive lists of about size items (size may be fractional), read lazily."""
+    bucket = []
+    edge = size
+    for i, item in enumerate(items, 1):
+        bucket.append(item)
+        if i >= edge:
+            yield bucket
+            bucket = []
+            edge += size
+    if bucket:
+        yield bucket
+
+
+def lttb(points, count, threshold):
+    """Largest-Triangle-Three-Buckets over an ordered stream of (x, y, payload) tuples of about count items.
+
+    Only the current and the next bucket are held in memory, so the stream can be a server-side cursor.
+    """
+    points = iter(points)
+    first = next(points, None)
+    if first is None:
+        return []
+    if threshold < 3 or count <= threshold:
+        return [first] + list(points)
+    selected = [first]
+    buckets = _chunks(points, (count - 2) / (threshold - 2))
+    current = next(buckets, None)
+    while current:
+        following = next(buckets, None)
+        if following:
+            next_x = sum(point[0] for point in following) / len(following)
+            next_y = sum(point[1] for point in following) / len(following)
+            end = None
+        else:
+            # Last bucket: its final point is the end of the series and anchors the triangle
+            end = current.pop() if len(current) > 1 else None
+            next_x, next_y = (end or current[-1])[:2]
+        a_x, a_y = selected[-1][:2]
+        best = max(current, key=lambda point: abs(
+            (a_x - next_x) * (point[1] - a_y) - (a_x - point[0]) * (next_y - a_y)))
+        selected.append(best)
+        if end is not None:
+            selected.append(end)
+        current = following
+    return selected
+
+
+class Visualizer(abc.ABC):
+    """Turns a query result into compact chart series, aggregating in the database wherever it can.
+
+    Subclasses phrase the aggregations for their engine; Driver.visualizer picks the one for a connection.
+    """
+
+    hidden_columns = ()
+
+    def __init__(self, driver, conn, query, target_points=VIZ_TARGET_POINTS, bins=VIZ_HISTOGRAM_BINS,
+                 max_categories=VIZ_MAX_CATEGORIES):
+        self.driver = driver
+        self.conn = conn
+        self.query = query
+        self.target_points = target_points
+        self.bins = bins
+        self.max_categories = max_categories
+        self.queries_run = 0
+
+    def _rows(self, query):
+        self.queries_run += 1
+        cursor = self.driver.execute(self.conn, query)
+        try:
+            return cursor.columns, [row for rows in cursor for row in rows]
+        finally:
+            cursor.close()
+
+    def _stream(self, query):
+        """Yield rows batch by batch from a server-side cursor."""
+        self.queries_run += 1
+        cursor = self.driver.execute(self.conn, query)
+        try:
+            for rows in cursor:
+                yield from rows
+        finally:
+            cursor.close()
+
+    @abc.abstractmethod
+    def _sample(self, size):
+        """(columns, rows) of the first size rows of the result."""
+
+    @abc.abstractmethod
+    def _number(self, column, kind):
+        """Expression for a numeric or temporal column as a number (epoch seconds for temporal ones)."""
+
+    @abc.abstractmethod
+    def _range_row(self, expression, column):
+        """(count, min, max) of the non-null values of an expression, as one row."""
+
+    @abc.abstractmethod
+    def _bin_counts(self, expression, column, low, high, buckets):
+        """({bucket index: row count}, bucket width) of an expression split into equal-width buckets."""
+
+    @abc.abstractmethod
+    def _category_rows(self, column, measures, func, limit):
+        """Rows of (value, count, aggregate of each measure) for the most frequent values of column."""
+
+    @abc.abstractmethod
+    def _minmax_rows(self, expression, column, measures, low, high, buckets):
+        """Rows of (min x, max x, then min and max of each measure) per bucket, in bucket order."""
+
+    @abc.abstractmethod
+    def _ordered_rows(self, column, measures):
+        """Stream of (x, measures...) rows ordered by x, nulls in x left out."""
+
+    def sample(self, size=VIZ_SAMPLE_ROWS):
+        columns, rows = self._sample(size)
+        kinds = {column: column_kind([row[i] for row in rows]) for i, column in enumerate(columns)}
+        return [column for column in columns if column not in self.hidden_columns], kinds
+
+    def _range(self, expression, column):
+        """(count, min, max) of the non-null values of an expression."""
+        row = self._range_row(expression, column)
+        if not row or not row[0]:
+            return 0, None, None
+        count, low, high = row
+        return int(count), float(low), float(high)
+
+    def histogram(self, column, kind, bins=None):
+        bins = bins or self.bins
+        expression = self._number(column, kind)
+        count, low, high = self._range(expression, column)
+        if not count:
+            return {'x': [], 'series': [{'name': 'count', 'data': []}], 'source_rows': 0}
+        counts, width = self._bin_counts(expression, column, low, high, bins)
+        starts = [low + i * width for i in range(bins)]
+        return {
+            'x': [from_epoch(start) for start in starts] if kind != 'numeric' else starts,
+            'bin_width': width,
+            'series': [{'name': 'count', 'data': [counts.get(i, 0) for i in range(bins)]}],
+            'source_rows': count,
+        }
+
+    def categories(self, column, measures, agg='sum'):
+        limit = self.max_categories
+        rows = self._category_rows(column, measures, AGGREGATES[agg], limit)
+        truncated = len(rows) > limit
+        rows = rows[:limit]
+        series = [{'name': f"{agg}({measure})", 'data': [convert_value(row[2 + i]) for row in rows]}
+                  for i, measure in enumerate(measures)] or [{'name': 'count', 'data': [row[1] for row in rows]}]
+        return {
+            'x': [convert_value(row[0]) for row in rows],
+            'series': series,
+            'truncated': truncated,
+            'source_rows': sum(row[1] for row in rows),
+        }
+
+    def series(self, column, kind, measures, method=VIZ_DOWNSAMPLE, points=None):
+        points = points or self.target_points
+        expression = self._number(column, kind)
+        count, low, high = self._range(expression, column)
+        temporal = kind != 'numeric'
+        if not count:
+            return {'x': [], 'series': [{'name': measure, 'data': []} for measure in measures], 'source_rows': 0}
+
+        if method == 'minmax' and count > points:
+            # Each bucket contributes its minimum and maximum, so half as many buckets as points
+            buckets = max(points // 2, 1)
+            rows = self._minmax_rows(expression, column, measures, low, high, buckets)
+            xs = []
+            data = [[] for _ in measures]
+            for row in rows:
+                xs += [float(row[0]), float(row[1])]
+                for i in range(len(measures)):
+                    data[i] += [convert_value(row[2 + 2 * i]), convert_value(row[3 + 2 * i])]
+            return {
+                'x': [from_epoch(x) for x in xs] if temporal else xs,
+                'series': [{'name': measure, 'data': values} for measure, values in zip(measures, data)],
+                'source_rows': count,
+                'method': 'minmax',
+            }
+
+        # LTTB, or every point when the series is already small enough
+        stream = self._ordered_rows(column, measures)
+        # The first measure drives point selection; the others are read at the same rows
+        triples = ((to_number(row[0]), float(row[1]) if row[1] is not None else 0.0, row) for row in stream
+                   if to_number(row[0]) is not None)
+        chosen = lttb(triples, count, points)
+        return {
+            'x': [x_value(row[0], kind) for _, _, row in chosen],
+            'series': [{'name': measure, 'data': [convert_value(row[1 + i]) for _, _, row in chosen]}
+                       for i, measure in enumerate(measures)],
+            'source_rows': count,
+            'method': 'lttb' if count > points else 'raw',
+        }
+
+    def build(self, chart=None):
+        """Detect (or check) the chart for this result and compute its series."""
+        chart = dict(chart or {})
+        columns, kinds = self.sample()
+        detected = detect_chart(columns, kinds) or {}
+        kind = chart.get('kind') or detected.get('kind')
+        if kind is None:
+            raise VisualizationError('The result has no column that can be charted')
+        if kind not in CHART_KINDS:
+            raise VisualizationError(f"Unsupported chart kind: {kind}")
+        x = chart.get('x') or detected.get('x')
+        y = chart.get('y') if chart.get('y') is not None else detected.get('y', [])
+        y = [y] if isinstance(y, str) else list(y)
+        for name in [x] + y:
+            if name not in kinds:
+                raise VisualizationError(f"Unknown column: {name}")
+        for name in y:
+            if kinds[name] not in ('numeric', 'empty'):
+                raise VisualizationError(f"Column {name} is not numeric")
+        x_kind = kinds[x]
+        method = chart.get('method') or VIZ_DOWNSAMPLE
+        if method not in DOWNSAMPLE_METHODS:
+            raise VisualizationError(f"Unsupported downsampling method: {method}")
+        agg = chart.get('agg') or 'sum'
+        if agg not in AGGREGATES:
+            raise VisualizationError(f"Unsupported aggregate: {agg}")
+
+        if kind == 'histogram':
+            if x_kind not in ('numeric', 'temporal', 'temporal_text'):
+                raise VisualizationError(f"Column {x} cannot be binned")
+            result = self.histogram(x, x_kind, positive_int(chart.get('bins'), 'bins', self.bins))
+            result['method'] = 'histogram'
+        elif kind == 'bar':
+            result = self.categories(x, y, agg)
+            result['method'] = 'group_by'
+        else:
+            if x_kind not in ('numeric', 'temporal', 'temporal_text'):
+                raise VisualizationError(f"Column {x} is not numeric or temporal; use a bar chart")
+            if not y:
+                raise VisualizationError(f"A {kind} chart needs at least one numeric y column")
+            points = positive_int(chart.get('points'), 'points', self.target_points)
+            result = self.series(x, x_kind, y, method, points)
+        result.update(chart=kind, x_column=x, x_kind='temporal' if x_kind == 'temporal_text' else x_kind,
+                      points=len(result['x']), queries=self.queries_run)
+        logging.info(f"Visualization: {kind} of {x} by {y} via {result['method']}, "
+                     f"{result['source_rows']} rows -> {result['points']} points")
+        return result
+
+
+class SQLVisualizer(Visualizer):
+    """Charts a SQL result by wrapping the query as a derived table; dialect details come from the driver."""
+
+    def __init__(self, driver, conn, query, **options):
+        super().__init__(driver, conn, query, **options)
+        self.source = f"({query.strip().rstrip(';').rstrip()}) AS viz_source"
+
+    def q(self, name):
+        return quote_identifier(name, self.driver.name)
+
+    def _sample(self, size):
+        return self._rows(f"SELECT * FROM {self.source} LIMIT {int(size)}")
+
+    def _number(self, column, kind):
+        ref = self.q(column)
+        return ref if kind == 'numeric' else self.driver.epoch_seconds(ref, kind)
+
+    def _range_row(self, expression, column):
+        _, rows = self._rows(f"SELECT COUNT(*), MIN({expression}), MAX({expression}) FROM {self.source} "
+                             f"WHERE {self.q(column)} IS NOT NULL")
+        return rows[0] if rows else None
+
+    def _bucket(self, expression, low, high, buckets):
+        width = (high - low) / buckets or 1.0
+        index = self.driver.floor(f"({expression} - {low!r}) / {width!r}")
+        return f"CASE WHEN {expression} >= {high!r} THEN {buckets - 1} ELSE {index} END", width
+
+    def _bin_counts(self, expression, column, low, high, buckets):
+        bucket, width = self._bucket(expression, low, high, buckets)
+        _, rows = self._rows(f"SELECT {bucket}, COUNT(*) FROM {self.source} "
+                             f"WHERE {self.q(column)} IS NOT NULL GROUP BY 1")
+        return {int(row[0]): row[1] for row in rows}, width
+
+    def _category_rows(self, column, measures, func, limit):
+        values = ''.join(
+            f", {'COUNT' if func == 'COUNT' else func}({'*' if func == 'COUNT' else self.q(measure)})"
+            for measure in measures)
+        order = 3 if measures else 2
+        _, rows = self._rows(f"SELECT {self.q(column)}, COUNT(*){values} FROM {self.source} "
+                             f"GROUP BY {self.q(column)} ORDER BY {order} DESC LIMIT {limit + 1}")
+        return rows
+
+    def _minmax_rows(self, expression, column, measures, low, high, buckets):
+        bucket, _ = self._bucket(expression, low, high, buckets)
+        values = ''.join(f", MIN({self.q(measure)}), MAX({self.q(measure)})" for measure in measures)
+        _, rows = self._rows(f"SELECT {bucket}, MIN({expression}), MAX({expression}){values} "
+                             f"FROM {self.source} WHERE {self.q(column)} IS NOT NULL GROUP BY 1 ORDER BY 1")
+        return [row[1:] for row in rows]
+
+    def _ordered_rows(self, column, measures):
+        selected = ', '.join(self.q(name) for name in [column] + measures)
+        return self._stream(f"SELECT {selected} FROM {self.source} "
+                            f"WHERE {self.q(column)} IS NOT NULL ORDER BY {self.q(column)}")
+
+
+class MongoVisualizer(Visualizer):
+    """Charts a Mongo result by appending aggregation stages to the query's own pipeline."""
+
+    # Usually an ObjectId, which is never a useful axis; it can still be named explicitly
+    hidden_columns = ('_id',)
+
+    def __init__(self, driver, conn, query, **options):
+        super().__init__(driver, conn, query, **options)
+        try:
+            parsed = mongo_query.parse(query)
+            self.base_pipeline = parsed.as_pipeline()
+        except mongo_query.MongoQueryError as e:
+            raise VisualizationError(str(e))
+        self.collection = parsed.collection
+
+    def _pipeline(self, *stages, columns=None):
+        return mongo_query.MongoQuery.aggregation(self.collection, self.base_pipeline + list(stages), columns)
+
+    def _sample(self, size):
+        return self._rows(self._pipeline({'$limit': size}))
+
+    def _number(self, column, kind):
+        if kind == 'numeric':
+            return f"${column}"
+        date = f"${column}" if kind == 'temporal' else {'$toDate': f"${column}"}
+        # Subtracting two dates gives milliseconds
+        return {'$divide': [{'$subtract': [date, EPOCH]}, 1000]}
+
+    def _range_row(self, expression, column):
+        _, rows = self._rows(self._pipeline(
+            {'$match': {column: {'$ne': None}}},
+            {'$group': {'_id': None, 'n': {'$sum': 1}, 'lo': {'$min': expression}, 'hi': {'$max': expression}}},
+            columns=['n', 'lo', 'hi']))
+        return rows[0] if rows else None
+
+    def _bucket(self, expression, low, high, buckets):
+        width = (high - low) / buckets or 1.0
+        index = {'$floor': {'$divide': [{'$subtract': [expression, low]}, width]}}
+        return {'$min': [buckets - 1, index]}, width
+
+    def _bin_counts(self, expression, column, low, high, buckets):
+        bucket, width = self._bucket(expression, low, high, buckets)
+        _, rows = self._rows(self._pipeline(
+            {'$match': {column: {'$ne': None}}},
+            {'$group': {'_id': bucket, 'n': {'$sum': 1}}},
+            columns=['_id', 'n']))
+        return {int(row[0]): row[1] for row in rows}, width
+
+    def _category_rows(self, column, measures, func, limit):
+        accumulator = {'SUM': '$sum', 'AVG': '$avg', 'MIN': '$min', 'MAX': '$max'}
+        group = {'_id': f"${column}", 'n': {'$sum': 1}}
+        for i, measure in enumerate(measures):
+            group[f"m{i}"] = {'$sum': 1} if func == 'COUNT' else {accumulator[func]: f"${measure}"}
+        order = 'm0' if measures else 'n'
+        _, rows = self._rows(self._pipeline(
+            {'$group': group}, {'$sort': {order: -1}}, {'$limit': limit + 1},
+            columns=['_id', 'n'] + [f"m{i}" for i in range(len(measures))]))
+        return rows
+
+    def _minmax_rows(self, expression, column, measures, low, high, buckets):
+        bucket, _ = self._bucket(expression, low, high, buckets)
+        group = {'_id': bucket, 'x0': {'$min': expression}, 'x1': {'$max': expression}}
+        for i, measure in enumerate(measures):
+            group[f"lo{i}"] = {'$min': f"${measure}"}
+            group[f"hi{i}"] = {'$max': f"${measure}"}
+        fields = ['x0', 'x1'] + [f"{edge}{i}" for i in range(len(measures)) for edge in ('lo', 'hi')]
+        _, rows = self._rows(self._pipeline(
+            {'$match': {column: {'$ne': None}}}, {'$group': group}, {'$sort': {'_id': 1}},
+            columns=fields))
+        return rows
+
+    def _ordered_rows(self, column, measures):
+        return self._stream(self._pipeline(
+            {'$match': {column: {'$ne': None}}}, {'$sort': {column: 1}}, columns=[column] + measures))
@@ -9,11 +9,16 @@ function ChatbotPage() {
     const [tables, setTables] = useState([]);
     const [generatedQuery, setGeneratedQuery] = useState('');
     const [queryResult, setQueryResult] = useState('');
+    const [resultColumns, setResultColumns] = useState([]);
+    const [resultRows, setResultRows] = useState([]);
+    const [resultHandle, setResultHandle] = useState(null);
+    const [historyId, setHistoryId] = useState(null);
     const [loading, setLoading] = useState(false);
 
     const location = useLocation();
     const query = new URLSearchParams(location.search);
     const db = query.get('db');
+    const sessionHeaders = { 'X-Session-Token': sessionStorage.getItem(`session:${(db || '').toLowerCase()}`) || '' };
 
     useEffect(() => {
         if (db) {
@@ -25,7 +30,7 @@ function ChatbotPage() {
 
     const fetchTables = async (db) => {
         try {
-            const res = await axios.get('http://localhost:5000/api/tables', { params: { db } });
+            const res = await axios.get('http://localhost:5000/api/tables', { params: { db }, headers: sessionHeaders });
             setTables(res.data.tables);
         } catch (error) {
             console.error("Error fetching tables:", error.response ? error.response.data : error.message);
@@ -46,23 +51,47 @@ function ChatbotPage() {
         setLoading(true);
 
         try {
-            const res = await axios.post('http://localhost:5000/api/chat', { 
-                message: msg, 
-                db_type: db 
+            const res = await fetch('http://localhost:5000/api/chat/stream', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', ...sessionHeaders },
+                body: JSON.stringify({ message: msg, db_type: db })
             });
-            //console.log(res.data.message);
-            const botMessage = res.data.message || '';
-            const query = res.data.query || '';
-            const result = res.data.results ? formatQueryResult(res.data.results) : '';
+            if (!res.ok) {
+                const body = await res.json().catch(() => ({}));
+                throw new Error(body.error || res.statusText);
+            }
 
-            setGeneratedQuery(query); // Store the generated query
-            setQueryResult(result); // Store the query result
-            if (botMessage) {
-                setMessages([...newMessages, { role: 'bot', content: botMessage }]);
+            // Show tokens as they arrive, then replace them with the extracted query
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let partial = '';
+            for (;;) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                for (const raw of events) {
+                    const event = (raw.match(/^event: (.*)$/m) || [])[1];
+                    const data = JSON.parse((raw.match(/^data: (.*)$/m) || [])[1] || 'null');
+                    if (event === 'token') {
+                        partial += data;
+                        setGeneratedQuery(partial);
+                    } else if (event === 'query') {
+                        setGeneratedQuery(data.query || '');
+                        setHistoryId(data.history_id || null);
+                        if (data.validation && !data.validation.valid) {
+                            setMessages([...newMessages, { role: 'bot', content: `Warning: the generated query does not match the schema: ${data.validation.errors.join('; ')}` }]);
+                        }
+                    } else if (event === 'error') {
+                        throw new Error(data);
+                    }
+                }
             }
+            setQueryResult('');
         } catch (error) {
-            const errorMessage = error.response ? error.response.data.error : error.message;
-            setMessages([...newMessages, { role: 'bot', content: `Error: ${errorMessage}` }]);
+            setMessages([...newMessages, { role: 'bot', content: `Error: ${error.message}` }]);
         } finally {
             setLoading(false);
         }
@@ -82,13 +111,22 @@ function ChatbotPage() {
 
     const handleExecuteQuery = async () => {
         setLoading(true);
+        if (resultHandle) {
+            axios.post('http://localhost:5000/api/execute_query/close', { handle: resultHandle, db_type: db },
+                { headers: sessionHeaders }).catch(() => {});
+        }
         try {
             const res = await axios.post('http://localhost:5000/api/execute_query', { 
                 query: generatedQuery, 
-                db_type: db 
-            });
+                db_type: db,
+                history_id: historyId
+            }, { headers: sessionHeaders });
             const columns = res.data.columns || [];
-            const result = res.data.result ? formatQueryResult(columns, res.data.result) : 'No results found';
+            const rows = res.data.result || [];
+            setResultColumns(columns);
+            setResultRows(rows);
+            setResultHandle(res.data.handle || null);
+            const result = res.data.result ? formatQueryResult(columns, rows) : 'No results found';
             setQueryResult(result);
         } catch (error) {
             const errorMessage = error.response ? error.response.data.error : error.message;
@@ -98,6 +136,26 @@ function ChatbotPage() {
         }
     };
     
+    const handleLoadMore = async () => {
+        setLoading(true);
+        try {
+            const res = await axios.post('http://localhost:5000/api/execute_query/page', {
+                handle: resultHandle,
+                db_type: db
+            }, { headers: sessionHeaders });
+            const rows = [...resultRows, ...(res.data.result || [])];
+            setResultRows(rows);
+            setResultHandle(res.data.handle || null);
+            setQueryResult(formatQueryResult(resultColumns, rows));
+        } catch (error) {
+            const errorMessage = error.response ? error.response.data.error : error.message;
+            setResultHandle(null);
+            setQueryResult(`Error: ${errorMessage}`);
+        } finally {
+            setLoading(false);
+        }
+    };
+
     const formatQueryResult = (columns, result) => {
         if (columns.length > 0 && result.length > 0) {
             let table = '<table border="1"><thead><tr>';
@@ -166,6 +224,15 @@ function ChatbotPage() {
                         <div className="message bot-message">
                             <h3>Query Result:</h3>
                             <div dangerouslySetInnerHTML={{ __html: queryResult }} />
+                            {resultHandle && (
+                                <button
+                                    className="execute-query-button"
+                                    onClick={handleLoadMore}
+                                    disabled={loading}
+                                >
+                                    {loading ? 'Loading...' : 'Load more'}
+                                </button>
+                            )}
                         </div>
                     )}
                 </div>
@@ -26,6 +26,7 @@ console.log(query);
         e.preventDefault();
         try {
             const response = await axios.post(`http://localhost:5000/connect/${db.toLowerCase()}`, credentials);
+            sessionStorage.setItem(`session:${db.toLowerCase()}`, response.data.session);
             alert(response.data.message);
             navigate(`/chat?db=${db}`);
         } catch (error) {